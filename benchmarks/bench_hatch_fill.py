@@ -0,0 +1,332 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+# bench_hatch_fill.py
+#
+# Benchmark harness for the Hatch Fill extension (extensions/km_hatch_fill.py).
+#
+# A synthetic corpus of SVG documents is generated -- nested polygons with
+# holes, thousands of small shapes, very detailed outlines -- and
+# Hatch_Fill.effect() is run headless against each of them, as Inkscape
+# would run it but without Inkscape.  Each case runs in a fresh Python
+# process of its own so that its peak resident set size can be measured.
+#
+# For every case the wall time (the best of --repeat runs), the peak RSS, the
+# number of hatch segments drawn, the number of pen lifts and the distance
+# moved with the pen up are recorded, and the lot is written out as JSON.
+# Results from two commits can then be compared with --compare:
+#
+#   python benchmarks/bench_hatch_fill.py --output before.json
+#   ... change things ...
+#   python benchmarks/bench_hatch_fill.py --output after.json --compare before.json
+#
+# Real-world drawings can be added to the corpus with --svg, and options
+# for every run passed with --extra (say, --extra="--engine=numpy --workers=0").
+
+import argparse
+import io
+import json
+import math
+import os
+import platform
+import random
+import shlex
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None  # Not on Windows: peak RSS is then not measured
+
+EXTENSIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'extensions')
+
+SVG_HEADER = ('<svg xmlns="http://www.w3.org/2000/svg" width="{0}mm" height="{1}mm" '
+              'viewBox="0 0 {0} {1}">\n')
+SHAPE_STYLE = 'fill:#000000;stroke:none'
+
+
+def polygonData(points):
+    """
+    Path data for the closed polygon through the list of (x, y) points.
+    """
+
+    return 'M ' + ' L '.join('{0:.3f},{1:.3f}'.format(x, y) for (x, y) in points) + ' Z'
+
+
+def starPoints(cx, cy, r_outer, r_inner, n_points, f_rotation=0.0):
+    points = []
+    for i in range(2 * n_points):
+        r = r_outer if i % 2 == 0 else r_inner
+        a = f_rotation + math.pi * i / n_points
+        points.append((cx + r * math.cos(a), cy + r * math.sin(a)))
+    return points
+
+
+def nestedPolygons(rnd):
+    """
+    Groups of concentric stars and rings, each ring a single path with
+    several subpaths nested within one another, so that the odd/even rule
+    leaves holes within holes.  Some groups carry transforms.
+    """
+
+    width, height = 400, 400
+    elements = []
+    for row in range(6):
+        for col in range(6):
+            cx = 35 + col * 66
+            cy = 35 + row * 66
+            subpaths = []
+            for n_ring in range(6):
+                r = 30 - 4.5 * n_ring
+                subpaths.append(polygonData(starPoints(cx, cy, r, r * 0.8, 7 + n_ring, rnd.uniform(0, math.pi))))
+            path = '<path style="{0}" d="{1}"/>'.format(SHAPE_STYLE, ' '.join(subpaths))
+            if (row + col) % 3 == 0:
+                path = '<g transform="rotate({0:.1f},{1},{2})">{3}</g>'.format(rnd.uniform(0, 90), cx, cy, path)
+            elements.append(path)
+    return width, height, elements
+
+
+def manySmallShapes(rnd):
+    """
+    Several thousand small rectangles, circles and triangles, each its own
+    element.
+    """
+
+    width, height = 600, 400
+    elements = []
+    for row in range(50):
+        for col in range(75):
+            x = 2 + col * 8 + rnd.uniform(-1, 1)
+            y = 2 + row * 8 + rnd.uniform(-1, 1)
+            kind = (row * 75 + col) % 3
+            if kind == 0:
+                elements.append('<rect style="{0}" x="{1:.3f}" y="{2:.3f}" width="5" height="4"/>'.format(SHAPE_STYLE, x, y))
+            elif kind == 1:
+                elements.append('<circle style="{0}" cx="{1:.3f}" cy="{2:.3f}" r="2.5"/>'.format(SHAPE_STYLE, x + 2.5, y + 2.5))
+            else:
+                elements.append('<path style="{0}" d="{1}"/>'.format(
+                    SHAPE_STYLE, polygonData([(x, y + 5), (x + 5, y + 5), (x + 2.5, y)])))
+    return width, height, elements
+
+
+def detailedOutlines(rnd):
+    """
+    A few very detailed outlines: wavy polygons of tens of thousands of
+    vertices and a long run of cubic Bezier curves, as from traced bitmaps.
+    """
+
+    width, height = 500, 500
+    elements = []
+    for (cx, cy, n_vertices) in ((130, 130, 20000), (370, 130, 12000), (130, 370, 30000)):
+        points = []
+        for i in range(n_vertices):
+            a = 2 * math.pi * i / n_vertices
+            r = 100 + 8 * math.sin(97 * a) + 3 * math.sin(631 * a) + rnd.uniform(-0.2, 0.2)
+            points.append((cx + r * math.cos(a), cy + r * math.sin(a)))
+        elements.append('<path style="{0}" d="{1}"/>'.format(SHAPE_STYLE, polygonData(points)))
+
+    tokens = ['M 370,270']
+    n_curves = 400
+    for i in range(n_curves):
+        a0 = 2 * math.pi * i / n_curves
+        a1 = 2 * math.pi * (i + 1) / n_curves
+        r = 100 if i % 2 == 0 else 70
+        tokens.append('C {0:.3f},{1:.3f} {2:.3f},{3:.3f} {4:.3f},{5:.3f}'.format(
+            370 + 1.3 * r * math.sin(a0), 370 - 1.3 * r * math.cos(a0),
+            370 + 1.3 * r * math.sin(a1), 370 - 1.3 * r * math.cos(a1),
+            370 + 100 * math.sin(a1), 370 - 100 * math.cos(a1)))
+    tokens.append('Z')
+    elements.append('<path style="{0}" d="{1}"/>'.format(SHAPE_STYLE, ' '.join(tokens)))
+    return width, height, elements
+
+
+# Each synthetic case: (name, corpus generator, Hatch Fill options).  Holding
+# back from the edges is on by default and trims away every hatch of shapes
+# only a few hold-back distances across, so only the case for it has it on.
+CASES = [
+    ('nested_polygons', nestedPolygons,
+     ['--hatchSpacing=1', '--hatchAngle=45', '--reducePenLifts=true', '--holdBackHatchFromEdges=false']),
+    ('many_small_shapes', manySmallShapes,
+     ['--hatchSpacing=0.5', '--hatchAngle=30', '--reducePenLifts=true', '--holdBackHatchFromEdges=false']),
+    ('detailed_outlines', detailedOutlines,
+     ['--hatchSpacing=1', '--hatchAngle=60', '--reducePenLifts=true', '--holdBackHatchFromEdges=false']),
+    ('crosshatch_holdback', nestedPolygons,
+     ['--hatchSpacing=1', '--hatchAngle=45', '--reducePenLifts=true', '--crossHatch=true',
+      '--holdBackHatchFromEdges=true', '--holdBackSteps=0.3']),
+]
+
+# Options for the real-world drawings given with --svg
+SVG_FILE_OPTIONS = ['--hatchSpacing=1', '--hatchAngle=45', '--reducePenLifts=true']
+
+
+def writeCorpus(directory, seed):
+    """
+    Generate the SVG documents of the synthetic cases into directory,
+    returning a list of (name, file name, options) for them.
+    """
+
+    corpus = []
+    for (name, generator, options) in CASES:
+        width, height, elements = generator(random.Random(seed))
+        filename = os.path.join(directory, name + '.svg')
+        with open(filename, 'w') as f:
+            f.write(SVG_HEADER.format(width, height))
+            for element in elements:
+                f.write(element + '\n')
+            f.write('</svg>\n')
+        corpus.append((name, filename, options))
+    return corpus
+
+
+def peakRss():
+    """
+    Peak resident set size of this process in kilobytes, or None where it
+    cannot be determined.
+    """
+
+    if resource is None:
+        return None
+    n_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        n_peak //= 1024  # Reported in bytes there
+    return n_peak
+
+
+def runCase(filename, options):
+    """
+    Run Hatch_Fill headless on filename, in this process, and return its
+    measurements.
+    """
+
+    sys.path.insert(0, EXTENSIONS_DIR)
+    import km_hatch_fill
+
+    hatch_fill = km_hatch_fill.Hatch_Fill()
+    output = io.BytesIO()
+    t_start = time.perf_counter()
+    hatch_fill.run(options + [filename], output=output)
+    f_wall_time = time.perf_counter() - t_start
+
+    # Every chain starts with the pen being lifted and moved to its start
+    return {
+        'wall_time': f_wall_time,
+        'peak_rss_kb': peakRss(),
+        'segments': sum(n_segments for (node, n_segments, f_pen_up) in hatch_fill.chainStats),
+        'pen_lifts': len(hatch_fill.chainStats),
+        'pen_up_distance': sum(f_pen_up for (node, n_segments, f_pen_up) in hatch_fill.chainStats),
+        'output_bytes': len(output.getvalue()),
+    }
+
+
+def measure(filename, options, n_repeat):
+    """
+    Run a case n_repeat times, each in a fresh process, keeping the best
+    wall time and the largest peak RSS.
+    """
+
+    result = None
+    for _ in range(n_repeat):
+        command = [sys.executable, os.path.abspath(__file__), '--run-case', filename, '--'] + options
+        completed = subprocess.run(command, stdout=subprocess.PIPE, check=True)
+        run = json.loads(completed.stdout.decode('utf-8'))
+        if result is None:
+            result = run
+        else:
+            result['wall_time'] = min(result['wall_time'], run['wall_time'])
+            if run['peak_rss_kb'] is not None:
+                result['peak_rss_kb'] = max(result['peak_rss_kb'], run['peak_rss_kb'])
+    return result
+
+
+def gitCommit():
+    try:
+        completed = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=EXTENSIONS_DIR,
+                                   stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return completed.stdout.decode('utf-8').strip()
+
+
+def compareResults(old, new):
+    """
+    Print a table of the cases common to two sets of results, with the
+    ratio new/old of each measurement.
+    """
+
+    keys = ('wall_time', 'peak_rss_kb', 'segments', 'pen_lifts', 'pen_up_distance')
+    print('{0:24s} {1}'.format('case  (new / old)', ' '.join('{0:>16s}'.format(k) for k in keys)))
+    for name in new['cases']:
+        if name not in old['cases']:
+            continue
+        ratios = []
+        for k in keys:
+            a = old['cases'][name].get(k)
+            b = new['cases'][name].get(k)
+            if a is None or b is None:
+                ratios.append('{0:>16s}'.format('-'))
+            elif a == 0:
+                ratios.append('{0:>16s}'.format('=' if b == 0 else 'new'))
+            else:
+                ratios.append('{0:16.3f}'.format(b / a))
+        print('{0:24s} {1}'.format(name, ' '.join(ratios)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the Hatch Fill extension.')
+    parser.add_argument('--output', help='write the results as JSON to this file (default: stdout)')
+    parser.add_argument('--compare', help='results JSON of an earlier run to compare against')
+    parser.add_argument('--repeat', type=int, default=3, help='runs of each case, keeping the best time')
+    parser.add_argument('--seed', type=int, default=1, help='seed for the synthetic corpus')
+    parser.add_argument('--cases', help='comma separated names of the synthetic cases to run')
+    parser.add_argument('--svg', nargs='*', default=[], help='real-world SVG drawings to add to the corpus')
+    parser.add_argument('--extra', default='', help='further Hatch Fill options for every run')
+    parser.add_argument('--corpus-dir', help='keep the generated corpus in this directory')
+    parser.add_argument('--run-case', help=argparse.SUPPRESS)
+    parser.add_argument('options', nargs='*', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case:
+        # A single measurement, in a process of its own
+        json.dump(runCase(args.run_case, args.options), sys.stdout)
+        return
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        corpus_dir = args.corpus_dir or temp_dir
+        os.makedirs(corpus_dir, exist_ok=True)
+        corpus = writeCorpus(corpus_dir, args.seed)
+        if args.cases:
+            wanted = args.cases.split(',')
+            corpus = [case for case in corpus if case[0] in wanted]
+        for filename in args.svg:
+            corpus.append((os.path.splitext(os.path.basename(filename))[0], os.path.abspath(filename), SVG_FILE_OPTIONS))
+
+        extra = shlex.split(args.extra)
+        results = {
+            'commit': gitCommit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'extra': extra,
+            'cases': {},
+        }
+        for (name, filename, options) in corpus:
+            results['cases'][name] = measure(filename, options + extra, args.repeat)
+            results['cases'][name]['options'] = options + extra
+            sys.stderr.write('{0}: {1:.3f}s\n'.format(name, results['cases'][name]['wall_time']))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    else:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+
+    if args.compare:
+        with open(args.compare) as f:
+            compareResults(json.load(f), results)
+
+
+if __name__ == '__main__':
+    main()
@@ -61,6 +61,13 @@
 # the group they will be placed in and apply this inverse transform to the
 # hatch lines.  Hence the need to save the transform matrix for every
 # graphical element.
+#
+# In contour fill mode (--fillMode=contour) no hatch lines are projected.
+# Instead the same vertex lists are offset inwards, a hatch spacing at a
+# time, giving rings which follow the outline of each element; holes grow
+# outwards alike and the rings merge where they meet.  When joining nearby
+# ends, each ring is linked to the next one in by a short line, so that
+# simple shapes are drawn as a single spiral.
 
 # Written by Daniel C. Newman for the Eggbot Project
 # dan dot newman at mtbaldy dot us
@@ -111,15 +118,31 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 
+import contextlib
+import hashlib
+import json
 import math
+import os
+import time
+from argparse import Namespace
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 
 import inkex
 
+try:
+    import numpy
+except ImportError:
+    numpy = None  # The vectorized intersection engine is then unavailable
+
 from inkex.transforms import Transform
 from inkex.paths import Path
-from inkex import paths, bezier
+from inkex import paths
 from lxml import etree
 
+from km_path_data import PathDataWriter
+
 N_PAGE_WIDTH = 3200
 N_PAGE_HEIGHT = 800
 
@@ -141,16 +164,72 @@ RADIAN_TOLERANCE_FOR_COLINEAR = 0.1
 RADIAN_TOLERANCE_FOR_ALTERNATING_DIRECTION = 0.1  
 # Pragmatic adjustment again, as with colinearity tolerance
 
-RECURSION_LIMIT = 500  
-# Pragmatic - if too high, risk runtime python error; 
-# if too low, miss some chances for reducing pen lifts
-
 EXTREME_POS = 1.0E70 # Extremely large positive number
 EXTREME_NEG = -1.0E70 # Extremely large negative number
 
 MIN_HATCH_FRACTION = 0.25  
 # Minimum hatch length, as a fraction of the hatch spacing.
 
+NUMPY_BATCH_LINES = 64
+# Number of hatch lines solved together by the vectorized intersection engine
+
+WORKER_OPTIONS = ('hatchSpacing', 'hatchAngle', 'crossHatch', 'reducePenLifts', 'hatchScope',
+                  'holdBackHatchFromEdges', 'holdBackSteps', 'tolerance', 'engine', 'precision',
+                  'fillMode')
+# The options needed to hatch a node in a worker process
+
+HATCH_CACHE_VERSION = 3
+# Bump whenever a change would alter the hatches computed for the same input,
+# so that hatches cached by older versions are no longer found
+
+TRAVEL_TWO_OPT_WINDOW = 30
+# Longest run of hatch paths which the travel ordering's 2-opt pass considers turning around
+
+TRAVEL_TWO_OPT_PASSES = 3
+# Most passes made by the 2-opt pass
+
+TRAVEL_TWO_OPT_GAIN = 1.0E-9
+# Least pen-up distance a 2-opt move must save to be made
+
+FLATTEN_CACHE_SIZE = 64
+# Most flattened paths kept for reuse by repeated geometry (clones, copies);
+# the least recently used is dropped first
+
+SHAPE_TAGS = tuple(tag for name in ('path', 'rect', 'line', 'polyline', 'polygon', 'ellipse', 'circle')
+                   for tag in (inkex.addNS(name, 'svg'), name))
+# Tags of the SVG elements which are hatched
+
+PATH_TAGS = (inkex.addNS('path', 'svg'), 'path')
+# Tags of the SVG elements among them which are paths already
+
+PREVIEW_TOLERANCE_FACTOR = 4.0
+# How much looser the curve flattening tolerance is in preview mode
+
+SCANLINE_SPAN_PAD = 1.0E-9
+# Padding applied to the span of each polygon edge in the scanline edge table,
+# relative to the size of the hatch grid.  Only makes the active edge set a
+# touch larger; the half-open crossing rule still has the final say.
+
+CONTOUR_MIN_ARC_STEP = 0.05
+# Smallest angle (radians) between the points of the arcs rounding the
+# corners of an offset ring in contour fill mode
+
+CONTOUR_MITER_COSINE = 0.9
+# Cosine of the largest turn into the fill mitred rather than looped when offsetting
+
+CONTOUR_SAMPLE_FRACTION = 1.0E-3
+# How far to the side of an offset piece its winding number is sampled,
+# as a fraction of the offset distance
+
+CONTOUR_MIN_EDGE_FRACTION = 0.01
+# Shortest edge kept in an offset ring, as a fraction of the flattening tolerance
+
+CONTOUR_MAX_LEVELS = 10000
+# Most rings laid inside one another in contour fill mode
+
+CONTOUR_DISTANCE_SLACK = 1.0E-3
+# Relative shortfall of the offset distance still taken as keeping it
+
 """
 Geometry 101: Determining if two lines intersect
 
@@ -273,163 +352,148 @@ def intersect(p1, p2, p3, p4):
     return sa
 
 
-def interstices(self, p1, p2, paths, hatches, b_hold_back_hatches, f_hold_back_steps):
-    """
-    For the line L defined by the points p1 & p2, determine the segments
-    of L which lie within the polygons described by the paths stored in
-    "paths"
-
-    p1 -- (x,y) coordinate [list]
-    p2 -- (x,y) coordinate [list]
-    paths -- Dictionary of all the paths to check for intersections
-
-    When an intersection of the line L is found with a polygon edge, then
-    the fractional distance along the line L is saved along with the
-    lxml.etree node which contained the intersecting polygon edge.  This
-    fractional distance is always in the range [0, 1].
-
-    Once all polygons have been checked, the list of fractional distances
-    corresponding to intersections is sorted and any duplicates removed.
-    It is then assumed that the first intersection is the line L entering
-    a polygon; the second intersection the line leaving the polygon.  This
-    line segment defined by the first and second intersection points is
-    thus a hatch fill line we sought to generate.  In general, our hatch
-    fills become the line segments described by intersection i and i+1
-    with i an odd value (1, 3, 5, ...).  Since we know the lxml.etree node
-    corresponding to each intersection, we can then correlate the hatch
-    fill lines to the graphical elements in the original SVG document.
-    This enables us to group hatch lines with the elements being hatched.
-
-    The hatch line segments are returned by populating a dictionary.
-    The dictionary is keyed off of the lxml.etree node pointer.  Each
-    dictionary value is a list of 4-tuples,
-
-        (x1, y1, x2, y2)
-
-    where (x1, y1) and (x2, y2) are the (x,y) coordinates of the line
-    segment's starting and ending points.
-    """
-
-    d_and_a = []
-    # p1 & p2 is the hatch line
-    # p3 & p4 is the polygon edge to check
-    for path in paths:
-        for subpath in paths[path]:
-            p3 = subpath[0]
-            for p4 in subpath[1:]:
-                s = intersect(p1, p2, p3, p4)
-                if 0.0 <= s <= 1.0:
-                    # Save this intersection point along the hatch line
-                    if b_hold_back_hatches:
-                        # We will need to know how the hatch meets the polygon segment, so that we can
-                        # calculate the end of a shorter line that stops short
-                        # of the polygon segment.
-                        # We compute the angle now while we have the information required,
-                        # but do _not_ apply it now, as we need the real,original, intersects
-                        # for the odd/even inside/outside operations yet to come.
-                        # Note that though the intersect() routine _could_ compute the join angle,
-                        # we do it here because we go thru here much less often than we go thru intersect().
-                        angle_hatch_radians = math.atan2(-(p2[1] - p1[1]), (p2[0] - p1[0]))  # from p1 toward p2, cartesian coordinates
-                        angle_segment_radians = math.atan2(-(p4[1] - p3[1]), (p4[0] - p3[0]))  # from p3 toward p4, cartesian coordinates
-                        angle_difference_radians = angle_hatch_radians - angle_segment_radians
-                        # coerce to range -pi to +pi
-                        if angle_difference_radians > math.pi:
-                            angle_difference_radians -= 2 * math.pi
-                        elif angle_difference_radians < -math.pi:
-                            angle_difference_radians += 2 * math.pi
-                        f_sin_of_join_angle = math.sin(angle_difference_radians)
-                        f_abs_sin_of_join_angle = abs(f_sin_of_join_angle)
-                        if f_abs_sin_of_join_angle != 0.0:  # Worrying about case of intersecting a segment parallel to the hatch
-                            prelim_length_to_be_removed = f_hold_back_steps / f_abs_sin_of_join_angle
-                            b_unconditionally_excise_hatch = False
-                        else:
-                            b_unconditionally_excise_hatch = True
-
-                        if not b_unconditionally_excise_hatch:
-                            # The relevant end of the segment is the end from which the hatch approaches at an acute angle.
-                            intersection = [0, 0]
-                            intersection[0] = p1[0] + s * (p2[0] - p1[0])  # compute intersection point of hatch with segment
-                            intersection[1] = p1[1] + s * (p2[1] - p1[1])  # intersecting hatch line starts at p1, vectored toward p2,
-                            # but terminates at intersection
-                            # Note that atan2 returns answer in range -pi to pi
-                            # Which end is the approach end of the hatch to the segment?
-                            # The dot product tells the answer:
-                            #    if dot product is positive, p2 is at the p4 end,
-                            #    else p2 is at the p3 end
-                            # We really don't need to take the time to actually take
-                            #     the cosine of the angle, we are just interested in
-                            #    the quadrant within which the angle lies.
-                            # I'm sure there is an elegant way to do this, but I'll settle for results just now.
-                            # If the angle is in quadrants I or IV then p4 is the relevant end, otherwise p3 is
-                            # nb: Y increases down, rather than up
-                            # nb: difference angle has been forced to the range -pi to +pi
-                            if abs(angle_difference_radians) < math.pi / 2:
-                                # It's near the p3 the relevant end from which the hatch departs
-                                dist_intersection_to_relevant_end = math.hypot(p3[0] - intersection[0], p3[1] - intersection[1])
-                                dist_intersection_to_irrelevant_end = math.hypot(p4[0] - intersection[0], p4[1] - intersection[1])
-                            else:
-                                # It's near the p4 end from which the hatch departs
-                                dist_intersection_to_relevant_end = math.hypot(p4[0] - intersection[0], p4[1] - intersection[1])
-                                dist_intersection_to_irrelevant_end = math.hypot(p3[0] - intersection[0], p3[1] - intersection[1])
-
-                            # Now, the problem defined in issue 22 is that we may not need to remove the
-                            # entire preliminary length we've calculated.  This problem occurs because
-                            # we have so far been considering the polygon segment as a line of infinite extent.
-                            # Thus, we may be holding back at a point where no holdback is required, when
-                            # calculated holdback is well beyond the position of the segment end.
-
-                            # To make matters worse, we do not currently know whether we're
-                            # starting a hatch or terminating a hatch, because the duplicates have
-                            # yet to be removed.  All we can do then, is calculate the required
-                            # line shortening for both possibilities - and then choose the correct
-                            # one after duplicate-removal, when actually finalizing the hatches.
-
-                            # Let's see if either end, or perhaps both ends, has a case of excessive holdback
-
-                            # First, default assumption is that neither end has excessive holdback
-                            length_remove_starting_hatch = prelim_length_to_be_removed
-                            length_remove_ending_hatch = prelim_length_to_be_removed
-
-                            # Now check each of the two ends
-                            if prelim_length_to_be_removed > (dist_intersection_to_relevant_end + f_hold_back_steps):
-                                # Yes, would be excessive holdback approaching from this direction
-                                length_remove_starting_hatch = dist_intersection_to_relevant_end + f_hold_back_steps
-                            if prelim_length_to_be_removed > (dist_intersection_to_irrelevant_end + f_hold_back_steps):
-                                # Yes, would be excessive holdback approaching from other direction
-                                length_remove_ending_hatch = dist_intersection_to_irrelevant_end + f_hold_back_steps
-
-                            d_and_a.append((s, path, length_remove_starting_hatch, length_remove_ending_hatch))
-                        else:
-                            d_and_a.append((s, path, 123456.0, 123456.0))  # Mark for complete hatch excision, hatch is parallel to segment
-                            # Just a random number guaranteed large enough to be longer than any hatch length
-                    else:
-                        d_and_a.append((s, path, 0, 0))  # zero length to be removed from hatch
+def intersectionRecord(p1, p2, p3, p4, s, path, b_hold_back_hatches, f_hold_back_steps):
+    """
+    Build the (s, path, length_remove_starting_hatch, length_remove_ending_hatch)
+    record for an intersection of the hatch line p1 & p2 with the polygon
+    edge p3 & p4 at the fraction "s" along the hatch line.  The two lengths
+    are only computed when holding back hatches from the edges; otherwise
+    nothing is to be removed from the hatch.
+    """
 
-                p3 = p4
+    if not b_hold_back_hatches:
+        return s, path, 0, 0  # zero length to be removed from hatch
+
+    # We will need to know how the hatch meets the polygon segment, so that we can
+    # calculate the end of a shorter line that stops short
+    # of the polygon segment.
+    # We compute the angle now while we have the information required,
+    # but do _not_ apply it now, as we need the real,original, intersects
+    # for the odd/even inside/outside operations yet to come.
+    # Note that though the intersect() routine _could_ compute the join angle,
+    # we do it here because we go thru here much less often than we go thru intersect().
+    angle_hatch_radians = math.atan2(-(p2[1] - p1[1]), (p2[0] - p1[0]))  # from p1 toward p2, cartesian coordinates
+    angle_segment_radians = math.atan2(-(p4[1] - p3[1]), (p4[0] - p3[0]))  # from p3 toward p4, cartesian coordinates
+    angle_difference_radians = angle_hatch_radians - angle_segment_radians
+    # coerce to range -pi to +pi
+    if angle_difference_radians > math.pi:
+        angle_difference_radians -= 2 * math.pi
+    elif angle_difference_radians < -math.pi:
+        angle_difference_radians += 2 * math.pi
+    f_sin_of_join_angle = math.sin(angle_difference_radians)
+    f_abs_sin_of_join_angle = abs(f_sin_of_join_angle)
+    if f_abs_sin_of_join_angle != 0.0:  # Worrying about case of intersecting a segment parallel to the hatch
+        prelim_length_to_be_removed = f_hold_back_steps / f_abs_sin_of_join_angle
+        b_unconditionally_excise_hatch = False
+    else:
+        b_unconditionally_excise_hatch = True
+
+    if not b_unconditionally_excise_hatch:
+        # The relevant end of the segment is the end from which the hatch approaches at an acute angle.
+        intersection = [0, 0]
+        intersection[0] = p1[0] + s * (p2[0] - p1[0])  # compute intersection point of hatch with segment
+        intersection[1] = p1[1] + s * (p2[1] - p1[1])  # intersecting hatch line starts at p1, vectored toward p2,
+        # but terminates at intersection
+        # Note that atan2 returns answer in range -pi to pi
+        # Which end is the approach end of the hatch to the segment?
+        # The dot product tells the answer:
+        #    if dot product is positive, p2 is at the p4 end,
+        #    else p2 is at the p3 end
+        # We really don't need to take the time to actually take
+        #     the cosine of the angle, we are just interested in
+        #    the quadrant within which the angle lies.
+        # I'm sure there is an elegant way to do this, but I'll settle for results just now.
+        # If the angle is in quadrants I or IV then p4 is the relevant end, otherwise p3 is
+        # nb: Y increases down, rather than up
+        # nb: difference angle has been forced to the range -pi to +pi
+        if abs(angle_difference_radians) < math.pi / 2:
+            # It's near the p3 the relevant end from which the hatch departs
+            dist_intersection_to_relevant_end = math.hypot(p3[0] - intersection[0], p3[1] - intersection[1])
+            dist_intersection_to_irrelevant_end = math.hypot(p4[0] - intersection[0], p4[1] - intersection[1])
+        else:
+            # It's near the p4 end from which the hatch departs
+            dist_intersection_to_relevant_end = math.hypot(p4[0] - intersection[0], p4[1] - intersection[1])
+            dist_intersection_to_irrelevant_end = math.hypot(p3[0] - intersection[0], p3[1] - intersection[1])
+
+        # Now, the problem defined in issue 22 is that we may not need to remove the
+        # entire preliminary length we've calculated.  This problem occurs because
+        # we have so far been considering the polygon segment as a line of infinite extent.
+        # Thus, we may be holding back at a point where no holdback is required, when
+        # calculated holdback is well beyond the position of the segment end.
+
+        # To make matters worse, we do not currently know whether we're
+        # starting a hatch or terminating a hatch, because the duplicates have
+        # yet to be removed.  All we can do then, is calculate the required
+        # line shortening for both possibilities - and then choose the correct
+        # one after duplicate-removal, when actually finalizing the hatches.
+
+        # Let's see if either end, or perhaps both ends, has a case of excessive holdback
+
+        # First, default assumption is that neither end has excessive holdback
+        length_remove_starting_hatch = prelim_length_to_be_removed
+        length_remove_ending_hatch = prelim_length_to_be_removed
+
+        # Now check each of the two ends
+        if prelim_length_to_be_removed > (dist_intersection_to_relevant_end + f_hold_back_steps):
+            # Yes, would be excessive holdback approaching from this direction
+            length_remove_starting_hatch = dist_intersection_to_relevant_end + f_hold_back_steps
+        if prelim_length_to_be_removed > (dist_intersection_to_irrelevant_end + f_hold_back_steps):
+            # Yes, would be excessive holdback approaching from other direction
+            length_remove_ending_hatch = dist_intersection_to_irrelevant_end + f_hold_back_steps
+
+        return s, path, length_remove_starting_hatch, length_remove_ending_hatch
+    else:
+        return s, path, 123456.0, 123456.0  # Mark for complete hatch excision, hatch is parallel to segment
+        # Just a random number guaranteed large enough to be longer than any hatch length
+
+
+def hatchesFromIntersections(self, p1, p2, d_and_a, hatches, b_hold_back_hatches, b_counted_once=False):
+    """
+    Given the list "d_and_a" of intersection records for the hatch line
+    p1 & p2, sort them, remove duplicates and apply the odd/even rule to
+    append the resulting hatch segments to "hatches".
+
+    When b_counted_once is true, each crossing of the outline has already
+    been counted exactly once (as by the half-open rule of the scanline
+    engines), so there are no duplicates to remove.  A pair of records at
+    (or within F_MINGAP_SMALL_VALUE of) the same place is then the hatch
+    line grazing a vertex, and makes no hatch; dropping both keeps the
+    odd/even rule intact.
+    """
 
     # Return now if there were no intersections
     if len(d_and_a) == 0:
         return None
 
-    d_and_a.sort()
-
-    # Remove duplicate intersections.  A common case where these arise
-    # is when the hatch line passes through a vertex where one line segment
-    # ends and the next one begins.
-
-    # Having sorted the data, it's trivial to just scan through
-    # removing duplicates as we go and then truncating the array
-
-    n = len(d_and_a)
-    i_last = 1
-    i = 1
-    last = d_and_a[0]
-    while i < n:
-        if (abs(d_and_a[i][0] - last[0])) > F_MINGAP_SMALL_VALUE:
-            d_and_a[i_last] = last = d_and_a[i]
-            i_last += 1
-        i += 1
-    d_and_a = d_and_a[:i_last]
+    b_profile = self.profile.enabled
+    if b_profile:
+        self.profile.count('raw_intersections', len(d_and_a))
+        t_start = time.perf_counter()
+
+    # Sort on the position along the hatch line alone: records at the same
+    # place can't be told apart by their nodes
+    d_and_a.sort(key=lambda record: record[0])
+
+    if not b_counted_once:
+        # Remove duplicate intersections.  A common case where these arise
+        # is when the hatch line passes through a vertex where one line segment
+        # ends and the next one begins.
+
+        # Having sorted the data, it's trivial to just scan through
+        # removing duplicates as we go and then truncating the array
+
+        n = len(d_and_a)
+        i_last = 1
+        i = 1
+        last = d_and_a[0]
+        while i < n:
+            if (abs(d_and_a[i][0] - last[0])) > F_MINGAP_SMALL_VALUE:
+                d_and_a[i_last] = last = d_and_a[i]
+                i_last += 1
+            i += 1
+        d_and_a = d_and_a[:i_last]
+    if b_profile:
+        self.profile.addTime('duplicate_removal', time.perf_counter() - t_start)
     if len(d_and_a) < 2:
         return
 
@@ -438,8 +502,11 @@ def interstices(self, p1, p2, paths, hatches, b_hold_back_hatches, f_hold_back_s
 
     i = 0
     while i < (len(d_and_a) - 1):
+        if d_and_a[i + 1][0] - d_and_a[i][0] <= F_MINGAP_SMALL_VALUE:
+            i += 2
+            continue  # Grazes a vertex, or as good as: nothing to draw
         if d_and_a[i][1] not in hatches:
-            hatches[d_and_a[i][1]] = []
+            hatches[d_and_a[i][1]] = LineSegmentBuffer()
 
         x1 = p1[0] + d_and_a[i][0] * (p2[0] - p1[0])
         y1 = p1[1] + d_and_a[i][0] * (p2[1] - p1[1])
@@ -448,7 +515,7 @@ def interstices(self, p1, p2, paths, hatches, b_hold_back_hatches, f_hold_back_s
 
         # These are the hatch ends if we are _not_ holding off from the boundary.
         if not b_hold_back_hatches:
-            hatches[d_and_a[i][1]].append([[x1, y1], [x2, y2]])
+            hatches[d_and_a[i][1]].append(x1, y1, x2, y2)
         else:
             # User wants us to perform a pseudo inset operation.
             # We will accomplish this by trimming back the ends of the hatches.
@@ -496,7 +563,7 @@ def interstices(self, p1, p2, paths, hatches, b_hold_back_hatches, f_hold_back_s
                 """
                 pt1 = self.RelativeControlPointPosition(f_length_to_be_removed_from_pt1, x2 - x1, y2 - y1, x1, y1)
                 pt2 = self.RelativeControlPointPosition(f_length_to_be_removed_from_pt2, x1 - x2, y1 - y2, x2, y2)
-                hatches[d_and_a[i][1]].append([[pt1[0], pt1[1]], [pt2[0], pt2[1]]])
+                hatches[d_and_a[i][1]].append(pt1[0], pt1[1], pt2[0], pt2[1])
 
         # Remember the relative start and end of this hatch segment
         last_d_and_a = [d_and_a[i], d_and_a[i + 1]]
@@ -504,38 +571,411 @@ def interstices(self, p1, p2, paths, hatches, b_hold_back_hatches, f_hold_back_s
         i += 2
 
 
-def subdivideCubicPath(sp, flat, i=1):
+class EdgeTable(object):
+    """
+    The polygon edges of the paths in "paths" (normally those of a single
+    node), packed into flat arrays once per node so that every family of
+    hatch lines can be swept against them without revisiting the vertex
+    lists.
+
+    Edge k runs from p3[k] to p4[k], i.e., from (x3[k], y3[k]) to
+    (x4[k], y4[k]).  It has length length[k] and unit direction
+    (ux[k], uy[k]), and so unit normal (-uy[k], ux[k]).  It belongs to the
+    path path_keys[path_index[k]].
     """
-    Break up a bezier curve into smaller curves, each of which
-    is approximately a straight line within a given tolerance
-    (the "smoothness" defined by [flat]).
 
-    This is a modified version of cspsubdiv.cspsubdiv() rewritten
-    to avoid recurrence.
+    def __init__(self, paths):
+        self.x3, self.y3 = array('d'), array('d')
+        self.x4, self.y4 = array('d'), array('d')
+        self.ux, self.uy = array('d'), array('d')
+        self.length = array('d')
+        self.path_index = array('l')
+        self.path_keys = []
+        self.p3 = []
+        self.p4 = []
+
+        for path in paths:
+            n_path = len(self.path_keys)
+            self.path_keys.append(path)
+            for subpath in paths[path]:
+                p3 = subpath[0]
+                for p4 in subpath[1:]:
+                    dx = p4[0] - p3[0]
+                    dy = p4[1] - p3[1]
+                    length = math.hypot(dx, dy)
+                    self.x3.append(p3[0])
+                    self.y3.append(p3[1])
+                    self.x4.append(p4[0])
+                    self.y4.append(p4[1])
+                    self.ux.append(dx / length if length > 0 else 0.0)
+                    self.uy.append(dy / length if length > 0 else 0.0)
+                    self.length.append(length)
+                    self.path_index.append(n_path)
+                    self.p3.append(p3)
+                    self.p4.append(p4)
+                    p3 = p4
+
+    def __len__(self):
+        return len(self.length)
+
+    def sweepOrders(self, frames):
+        """
+        Project every edge onto the normal (ca, sa) of each family of hatch
+        lines described by frames, as set up by makeHatchGrid(): the hatch
+        lines of a family all run along the direction (-sa, ca) and its line
+        at offset i passes through (cx + i * ca, cy + i * sa).  A single
+        pass over the edges serves all the families, e.g., both the hatches
+        and the cross-hatches.
+
+        Returns a sweep (order, offset_min, offset_max, offset_3, offset_4)
+        for each frame: the offsets of the two ends of each edge, the range
+        of hatch line offsets it spans, and the edge indices sorted by
+        offset_min, so that sweeping the hatch lines in order of increasing
+        offset only ever needs to look at the edges which have become
+        "active".  A vertex shared by two edges is projected by the very
+        same arithmetic for both, so both see it on the same side of any
+        hatch line.
+        """
+
+        offsets = [([], [], [], []) for frame in frames]
+        for (x3, y3, x4, y4) in zip(self.x3, self.y3, self.x4, self.y4):
+            for ((ca, sa, cx, cy, r), (offset_min, offset_max, offset_3, offset_4)) in zip(frames, offsets):
+                o3 = (x3 - cx) * ca + (y3 - cy) * sa
+                o4 = (x4 - cx) * ca + (y4 - cy) * sa
+                offset_3.append(o3)
+                offset_4.append(o4)
+                if o3 <= o4:
+                    offset_min.append(o3)
+                    offset_max.append(o4)
+                else:
+                    offset_min.append(o4)
+                    offset_max.append(o3)
+
+        return [(sorted(range(len(offset_min)), key=offset_min.__getitem__),
+                 offset_min, offset_max, offset_3, offset_4)
+                for (offset_min, offset_max, offset_3, offset_4) in offsets]
+
+    def holdBackFactors(self, frame):
+        """
+        For holding hatches back from the edges: since every hatch line of
+        the family described by frame runs along the same unit direction
+        h = (-sa, ca), the sine of the angle at which a hatch meets edge k
+        is just the dot product of h with the edge's unit normal, and the
+        cosine that of h with the edge's unit direction.
+
+        Returns (abs_sin, b_p3_is_relevant): |sin| of the join angle for
+        each edge, and whether the hatch approaches it from its p3 end
+        (the cosine is positive), else from its p4 end.
+        """
+
+        ca, sa = frame[:2]
+        abs_sin = [abs(ca * ux + sa * uy) for (ux, uy) in zip(self.ux, self.uy)]
+        b_p3_is_relevant = [(ca * uy - sa * ux) > 0 for (ux, uy) in zip(self.ux, self.uy)]
+        return abs_sin, b_p3_is_relevant
+
+
+def scanlineInterstices(self, lines, edge_table, frame, sweep, hatches, b_hold_back_hatches, f_hold_back_steps):
+    """
+    For each of the hatch lines in "lines", find the segments of the line
+    which lie within the polygons of the edge table, and add them to
+    "hatches" as hatchesFromIntersections() does.  Rather than testing
+    every hatch line against every polygon edge, the lines are swept in
+    order of increasing offset against the edges sorted by
+    EdgeTable.sweepOrders().
+
+    Whether a hatch line crosses an edge is decided by a half-open rule on
+    the offsets of the edge's ends: the line at offset o crosses the edge
+    when offset_min <= o < offset_max.  Each vertex is thereby classified
+    once, consistently for the two edges meeting at it, as lying below the
+    line or not.  A hatch line passing through a vertex where the outline
+    crosses over it is counted exactly once, and one merely grazing a
+    vertex either twice or not at all, so the odd/even rule always holds
+    and no duplicates need removing.  Edges parallel to the hatch lines
+    are never crossed.  The crossing lies at the fraction
+    (o - offset_3) / (offset_4 - offset_3) along the edge.
+
+    When holding back hatches from the edges, the lengths to trim are found
+    from the edge directions, lengths and normals precomputed in the edge
+    table, rather than from the angles worked out anew for every hit by
+    intersectionRecord().  The distances from the intersection to the two
+    ends of the edge come from its position along the edge direction.
+
+    lines -- (x1, y1, x2, y2) hatch lines of a single family, in order of
+             increasing offset, as generated by makeHatchGrid()
+    sweep -- that family's entry from EdgeTable.sweepOrders()
     """
 
-    while True:
-        while True:
-            if i >= len(sp):
-                return
+    ca, sa, cx, cy, r = frame
+    # Widen each edge's span ever so slightly when activating edges; the
+    # half-open rule below decides which of them are actually crossed
+    f_pad = SCANLINE_SPAN_PAD * max(1.0, r)
+
+    order, offset_min, offset_max, offset_3, offset_4 = sweep
+    if b_hold_back_hatches:
+        abs_sin, b_p3_is_relevant = edge_table.holdBackFactors(frame)
+    x3, y3, x4, y4 = edge_table.x3, edge_table.y3, edge_table.x4, edge_table.y4
+    length = edge_table.length
+    path_index, path_keys = edge_table.path_index, edge_table.path_keys
+
+    n_edges = len(order)
+    n_next_edge = 0
+    active = []
+    for (x1, y1, x2, y2) in lines:
+        offset = ((x1 + x2) / 2 - cx) * ca + ((y1 + y2) / 2 - cy) * sa
+
+        # Retire edges lying entirely below this hatch line...
+        active = [k for k in active if offset_max[k] >= offset - f_pad]
+        # ... and activate those which now reach up to it
+        while n_next_edge < n_edges and offset_min[order[n_next_edge]] <= offset + f_pad:
+            k = order[n_next_edge]
+            if offset_max[k] >= offset - f_pad:
+                active.append(k)
+            n_next_edge += 1
+
+        if not active:
+            continue
+
+        d21x = x2 - x1
+        d21y = y2 - y1
+        f_line_length_squared = d21x * d21x + d21y * d21y
+        d_and_a = []
+        for k in active:
+            if not offset_min[k] <= offset < offset_max[k]:
+                continue
+            # Where along the edge, and so where along the hatch line, the crossing is
+            f_edge_fraction = (offset - offset_3[k]) / (offset_4[k] - offset_3[k])
+            px = x3[k] + f_edge_fraction * (x4[k] - x3[k])
+            py = y3[k] + f_edge_fraction * (y4[k] - y3[k])
+            s = min(1.0, max(0.0, ((px - x1) * d21x + (py - y1) * d21y) / f_line_length_squared))
+            path = path_keys[path_index[k]]
+            if not b_hold_back_hatches:
+                d_and_a.append((s, path, 0, 0))  # zero length to be removed from hatch
+            elif abs_sin[k] == 0.0:
+                d_and_a.append((s, path, 123456.0, 123456.0))  # Mark for complete hatch excision, hatch is parallel to segment
+            else:
+                prelim_length_to_be_removed = f_hold_back_steps / abs_sin[k]
+                # Distance along the edge from p3 to the intersection
+                t = f_edge_fraction * length[k]
+                if b_p3_is_relevant[k]:
+                    dist_intersection_to_relevant_end = abs(t)
+                    dist_intersection_to_irrelevant_end = abs(length[k] - t)
+                else:
+                    dist_intersection_to_relevant_end = abs(length[k] - t)
+                    dist_intersection_to_irrelevant_end = abs(t)
+                # As in intersectionRecord(), don't hold back further than the ends of the edge call for
+                d_and_a.append((s, path,
+                                min(prelim_length_to_be_removed, dist_intersection_to_relevant_end + f_hold_back_steps),
+                                min(prelim_length_to_be_removed, dist_intersection_to_irrelevant_end + f_hold_back_steps)))
+
+        hatchesFromIntersections(self, (x1, y1), (x2, y2), d_and_a, hatches, b_hold_back_hatches, True)
+
+
+def packEdgeArrays(edge_table):
+    """
+    Copy the columns of an EdgeTable into NumPy arrays for use by
+    vectorizedInterstices().  Returns the tuple
 
-            p0 = sp[i - 1][1]
-            p1 = sp[i - 1][2]
-            p2 = sp[i][0]
-            p3 = sp[i][1]
+        (x3, y3, x4, y4, ux, uy, length, path_index, path_keys)
+    """
 
-            b = (p0, p1, p2, p3)
+    return (numpy.array(edge_table.x3, dtype=float), numpy.array(edge_table.y3, dtype=float),
+            numpy.array(edge_table.x4, dtype=float), numpy.array(edge_table.y4, dtype=float),
+            numpy.array(edge_table.ux, dtype=float), numpy.array(edge_table.uy, dtype=float),
+            numpy.array(edge_table.length, dtype=float),
+            numpy.array(edge_table.path_index, dtype=int), edge_table.path_keys)
 
-            if bezier.maxdist(b) > flat:
-                break
 
-            i += 1
+def vectorizedInterstices(self, lines, edge_arrays, frame, hatches, b_hold_back_hatches, f_hold_back_steps):
+    """
+    NumPy counterpart of scanlineInterstices().  The hatch lines are taken
+    NUMPY_BATCH_LINES at a time; the edges spanning that batch of lines are
+    picked out of the offset-sorted edge arrays, and the same half-open
+    crossing rule is applied to every line/edge pair of the batch at once.
+    The crossing points and hold-back lengths are likewise computed for
+    all of the hits together.  The resulting intersection records are then
+    finished by hatchesFromIntersections() exactly as for the other engines.
+    """
+
+    if len(lines) == 0 or len(edge_arrays[0]) == 0:
+        return
+
+    ca, sa, cx, cy, r = frame
+    f_pad = SCANLINE_SPAN_PAD * max(1.0, r)
+    x3, y3, x4, y4, ux, uy, length, path_index, path_keys = edge_arrays
+
+    # Order the edges by the lowest hatch offset they reach, as for EdgeTable.sweepOrders()
+    o3 = (x3 - cx) * ca + (y3 - cy) * sa
+    o4 = (x4 - cx) * ca + (y4 - cy) * sa
+    offset_min = numpy.minimum(o3, o4)
+    order = numpy.argsort(offset_min, kind='stable')
+    offset_min = offset_min[order]
+    offset_max = numpy.maximum(o3, o4)[order]
+    offset_3 = o3[order]
+    offset_4 = o4[order]
+    ex3, ey3 = x3[order], y3[order]
+    eux, euy, elength = ux[order], uy[order], length[order]
+    epath = path_index[order]
+    d43x_all = x4[order] - ex3
+    d43y_all = y4[order] - ey3
+    if b_hold_back_hatches:
+        # As in EdgeTable.holdBackFactors()
+        abs_sin_all = numpy.abs(ca * eux + sa * euy)
+        b_p3_is_relevant_all = (ca * euy - sa * eux) > 0
+
+    line_array = numpy.array(lines, dtype=float)
+    offsets = ((line_array[:, 0] + line_array[:, 2]) / 2 - cx) * ca + ((line_array[:, 1] + line_array[:, 3]) / 2 - cy) * sa
+
+    for n_batch in range(0, len(lines), NUMPY_BATCH_LINES):
+        batch = line_array[n_batch:n_batch + NUMPY_BATCH_LINES]
+        n_upper = numpy.searchsorted(offset_min, offsets[n_batch:n_batch + NUMPY_BATCH_LINES].max() + f_pad, side='right')
+        candidates = numpy.nonzero(offset_max[:n_upper] >= offsets[n_batch:n_batch + NUMPY_BATCH_LINES].min() - f_pad)[0]
+        if len(candidates) == 0:
+            continue
+
+        # Hatch lines down the rows, polygon edges across the columns;
+        # the same half-open rule as scanlineInterstices()
+        batch_offsets = offsets[n_batch:n_batch + NUMPY_BATCH_LINES, numpy.newaxis]
+        hit = (offset_min[candidates] <= batch_offsets) & (batch_offsets < offset_max[candidates])
+        rows, cols = numpy.nonzero(hit)
+        if len(rows) == 0:
+            continue
+
+        edges_hit = candidates[cols]
+        hit_lines = batch[rows]
+        hit_offsets = offsets[n_batch + rows]
+        # Where along the edge, and so where along the hatch line, the crossings are
+        edge_fractions = (hit_offsets - offset_3[edges_hit]) / (offset_4[edges_hit] - offset_3[edges_hit])
+        px = ex3[edges_hit] + edge_fractions * d43x_all[edges_hit]
+        py = ey3[edges_hit] + edge_fractions * d43y_all[edges_hit]
+        d21x = hit_lines[:, 2] - hit_lines[:, 0]
+        d21y = hit_lines[:, 3] - hit_lines[:, 1]
+        s_hits = numpy.clip(((px - hit_lines[:, 0]) * d21x + (py - hit_lines[:, 1]) * d21y) /
+                            (d21x * d21x + d21y * d21y), 0.0, 1.0)
+        if b_hold_back_hatches:
+            abs_sin = abs_sin_all[edges_hit]
+            with numpy.errstate(divide='ignore'):
+                prelim_length_to_be_removed = f_hold_back_steps / abs_sin
+            # Distance along the edge from p3 to the intersection
+            t = edge_fractions * elength[edges_hit]
+            dist_to_p3 = numpy.abs(t)
+            dist_to_p4 = numpy.abs(elength[edges_hit] - t)
+            b_p3_is_relevant = b_p3_is_relevant_all[edges_hit]
+            starts = numpy.minimum(prelim_length_to_be_removed,
+                                   numpy.where(b_p3_is_relevant, dist_to_p3, dist_to_p4) + f_hold_back_steps)
+            ends = numpy.minimum(prelim_length_to_be_removed,
+                                 numpy.where(b_p3_is_relevant, dist_to_p4, dist_to_p3) + f_hold_back_steps)
+            # Mark for complete hatch excision where the hatch is parallel to the segment
+            starts[abs_sin == 0.0] = 123456.0
+            ends[abs_sin == 0.0] = 123456.0
+        else:
+            starts = ends = numpy.zeros(len(rows))
+
+        # Gather the records line by line (rows come back in line order)
+        s_hits = s_hits.tolist()
+        starts = starts.tolist()
+        ends = ends.tolist()
+        paths_hit = epath[edges_hit].tolist()
+        rows = rows.tolist()
+        n_hit = 0
+        while n_hit < len(rows):
+            n_row = rows[n_hit]
+            d_and_a = []
+            while n_hit < len(rows) and rows[n_hit] == n_row:
+                d_and_a.append((s_hits[n_hit], path_keys[paths_hit[n_hit]], starts[n_hit], ends[n_hit]))
+                n_hit += 1
+            line = batch[n_row].tolist()
+            hatchesFromIntersections(self, (line[0], line[1]), (line[2], line[3]), d_and_a, hatches, b_hold_back_hatches, True)
+
+
+def pointToSegmentDistance(x, y, x0, y0, x1, y1):
+    """
+    Distance from the point (x, y) to the line segment running from
+    (x0, y0) to (x1, y1); the same measure as bezier.maxdist() uses.
+    """
+
+    dx = x1 - x0
+    dy = y1 - y0
+    dot = (x - x0) * dx + (y - y0) * dy
+    if dot <= 0:
+        return math.hypot(x - x0, y - y0)
+    length_squared = dx * dx + dy * dy
+    if length_squared <= dot:
+        return math.hypot(x - x1, y - y1)
+    return abs(dx * (y0 - y) - (x0 - x) * dy) / math.sqrt(length_squared)
+
+
+def cubicSubdivisions(x0, y0, x1, y1, x2, y2, x3, y3, flat):
+    """
+    Number of equal steps in t needed for a polyline to follow the cubic
+    bezier (x0, y0), (x1, y1), (x2, y2), (x3, y3) within [flat].
+
+    A curve whose control points already lie within [flat] of its chord
+    is taken as a straight line, just as subdividing at the midpoint until
+    bezier.maxdist() <= flat would.  Otherwise the count comes straight from
+    the control points: a chord across a step of 1/n in t strays from the
+    curve by at most (1/8)(1/n)^2 max|B''|, and max|B''| is no more than six
+    times the largest second difference of the control points.
+    """
+
+    if max(pointToSegmentDistance(x1, y1, x0, y0, x3, y3),
+           pointToSegmentDistance(x2, y2, x0, y0, x3, y3)) <= flat:
+        return 1
+
+    dd = max(math.hypot(x0 - 2 * x1 + x2, y0 - 2 * y1 + y2),
+             math.hypot(x1 - 2 * x2 + x3, y1 - 2 * y2 + y3))
+    return max(1, int(math.ceil(math.sqrt(0.75 * dd / flat))))
+
+
+def flattenCubicSubpath(sp, flat):
+    """
+    Flatten a subpath of a cubic superpath -- a list of [control-in,
+    vertex, control-out] triples -- into a list of (x, y) vertices lying
+    along the curve, such that each piece of the curve strays no further
+    than [flat] from the line segment replacing it.
+
+    Rather than splitting the curves at their midpoints until each piece
+    is flat enough, as subdivideCubicPath() in km_plot_utils does, the
+    number of pieces for each curve is decided up front by
+    cubicSubdivisions().  The vertices are then evaluated straight into
+    coordinate arrays sized once for the whole subpath.
+    """
 
-        one, two = bezier.beziersplitatt(b, 0.5)
-        sp[i - 1][2] = one[1]
-        sp[i][0] = two[2]
-        p = [one[2], one[3], two[1]]
-        sp[i:1] = [p]
+    x0, y0 = sp[0][1]
+    segments = []
+    n_vertices = 1
+    for i in range(1, len(sp)):
+        x1, y1 = sp[i - 1][2]
+        x2, y2 = sp[i][0]
+        x3, y3 = sp[i][1]
+        n = cubicSubdivisions(x0, y0, x1, y1, x2, y2, x3, y3, flat)
+        segments.append((n, x0, y0, x1, y1, x2, y2, x3, y3))
+        n_vertices += n
+        x0, y0 = x3, y3
+
+    xs = array('d', bytes(8 * n_vertices))
+    ys = array('d', bytes(8 * n_vertices))
+    xs[0], ys[0] = sp[0][1]
+    k = 1
+    for (n, x0, y0, x1, y1, x2, y2, x3, y3) in segments:
+        if n > 1:
+            # B(t) = ((a t + b) t + c) t + p0
+            cx = 3 * (x1 - x0)
+            cy = 3 * (y1 - y0)
+            bx = 3 * (x2 - x1) - cx
+            by = 3 * (y2 - y1) - cy
+            ax = x3 - x0 - cx - bx
+            ay = y3 - y0 - cy - by
+            for j in range(1, n):
+                t = j / n
+                xs[k] = ((ax * t + bx) * t + cx) * t + x0
+                ys[k] = ((ay * t + by) * t + cy) * t + y0
+                k += 1
+        # End exactly on the vertex
+        xs[k] = x3
+        ys[k] = y3
+        k += 1
+
+    return list(zip(xs, ys))
 
 
 def distanceSquared(p1, p2):
@@ -552,6 +992,842 @@ def distanceSquared(p1, p2):
     return dx * dx + dy * dy
 
 
+def ringArea(ring):
+    """
+    Signed area of the closed polygon "ring", a list of (x, y) vertices
+    without the first one repeated at the end.  Positive when the polygon
+    runs counterclockwise in the usual y-up sense, i.e., when its inside
+    lies to the left of its edges.
+    """
+
+    f_area = 0.0
+    x0, y0 = ring[-1]
+    for (x1, y1) in ring:
+        f_area += x0 * y1 - x1 * y0
+        x0, y0 = x1, y1
+    return f_area / 2.0
+
+
+def pointInRing(x, y, ring):
+    """
+    Odd/even test of the point (x, y) against the closed polygon "ring"
+    """
+
+    b_inside = False
+    x0, y0 = ring[-1]
+    for (x1, y1) in ring:
+        if (y0 > y) != (y1 > y) and x < x0 + (y - y0) * (x1 - x0) / (y1 - y0):
+            b_inside = not b_inside
+        x0, y0 = x1, y1
+    return b_inside
+
+
+def orientRings(subpaths, f_min_length):
+    """
+    Turn the closed subpaths of an element into rings for offsetting: the
+    repeated closing vertex and any vertices closer than f_min_length to
+    the one before are dropped, as are rings with no area left, and each
+    ring is turned so that the area filled by the odd/even rule lies to
+    its left.  That is counterclockwise for the outlines and clockwise for
+    the holes (outlines nested an odd number of times in others).
+    """
+
+    rings = []
+    for subpath in subpaths:
+        ring = []
+        for vertex in subpath:
+            if not ring or distanceSquared(ring[-1], vertex) > f_min_length * f_min_length:
+                ring.append((vertex[0], vertex[1]))
+        while len(ring) > 1 and distanceSquared(ring[0], ring[-1]) <= f_min_length * f_min_length:
+            ring.pop()
+        if len(ring) >= 3 and ringArea(ring) != 0.0:
+            rings.append(ring)
+
+    oriented = []
+    for (n_ring, ring) in enumerate(rings):
+        n_depth = 0
+        for (n_other, other) in enumerate(rings):
+            if n_other != n_ring and pointInRing(ring[0][0], ring[0][1], other):
+                n_depth += 1
+        if (ringArea(ring) > 0) == (n_depth % 2 == 0):
+            oriented.append(ring)
+        else:
+            oriented.append(ring[::-1])
+    return oriented
+
+
+def rawOffsetRing(ring, distance, flat):
+    """
+    Move each edge of "ring" the given distance to its left, joining the
+    moved edges up again as Clipper does.  Where the ring turns right the
+    moved edges part, and are joined by an arc around the vertex.  Where it
+    turns left they overlap; slight turns take the point where they cross,
+    sharper ones go back through the vertex itself so that the overlap
+    makes a loop which cleanOffsetRings() cuts away.  The result is a
+    closed polyline which may cross itself and other rings.
+    """
+
+    n = len(ring)
+    # A right turn is mitred rather than rounded while the mitre sticks
+    # out no further than "flat" past the arc
+    f_miter_cosine_right = distance / (distance + flat)
+    normals = []
+    for i in range(n):
+        (x0, y0), (x1, y1) = ring[i], ring[(i + 1) % n]
+        length = math.hypot(x1 - x0, y1 - y0)
+        normals.append((-(y1 - y0) / length, (x1 - x0) / length))
+
+    # Largest angle between arc points which keeps the arc within "flat"
+    f_arc_step = 2.0 * math.acos(max(-1.0, 1.0 - flat / distance)) if flat < distance else math.pi / 2
+    f_arc_step = max(f_arc_step, CONTOUR_MIN_ARC_STEP)
+
+    points = []
+    for i in range(n):
+        x, y = ring[i]
+        nx_in, ny_in = normals[i - 1]
+        nx_out, ny_out = normals[i]
+        cross = nx_in * ny_out - ny_in * nx_out  # Same as for the edge directions
+        dot = nx_in * nx_out + ny_in * ny_out
+        if dot >= (CONTOUR_MITER_COSINE if cross >= 0 else 2.0 * f_miter_cosine_right ** 2 - 1.0):
+            # Turning only a little: where the moved edges cross
+            f_miter = distance / (1.0 + dot)
+            points.append((x + f_miter * (nx_in + nx_out), y + f_miter * (ny_in + ny_out)))
+        elif cross < 0 or (cross == 0 and dot < 0):
+            # Turning right (or right back on itself): an arc around the vertex
+            f_angle = math.atan2(cross, dot) if cross != 0 else -math.pi
+            n_steps = max(1, int(math.ceil(-f_angle / f_arc_step)))
+            for j in range(n_steps + 1):
+                a = f_angle * j / n_steps
+                ca, sa = math.cos(a), math.sin(a)
+                points.append((x + distance * (nx_in * ca - ny_in * sa), y + distance * (nx_in * sa + ny_in * ca)))
+        else:
+            points.append((x + distance * nx_in, y + distance * ny_in))
+            points.append((x, y))
+            points.append((x + distance * nx_out, y + distance * ny_out))
+    return points
+
+
+def segmentCrossing(a, b, c, e):
+    """
+    Where the segments a-b and c-e cross, as (t, u) with the crossing at
+    a + t (b - a) = c + u (e - c), or None.  Both ranges are half-open,
+    [0, 1), so that a crossing at the vertex joining two segments of a
+    polyline is found on only one of them.
+    """
+
+    rx, ry = b[0] - a[0], b[1] - a[1]
+    sx, sy = e[0] - c[0], e[1] - c[1]
+    denominator = rx * sy - ry * sx
+    if denominator == 0:
+        return None  # Parallel
+    qx, qy = c[0] - a[0], c[1] - a[1]
+    t = (qx * sy - qy * sx) / denominator
+    if t < 0.0 or t >= 1.0:
+        return None
+    u = (qx * ry - qy * rx) / denominator
+    if u < 0.0 or u >= 1.0:
+        return None
+    return t, u
+
+
+def cleanOffsetRings(raw_rings, rings, distance, flat):
+    """
+    Cut the raw offset polylines made by rawOffsetRing() from "rings"
+    where they cross one another or themselves, and keep the pieces which
+    bound the area of positive winding number: that area is the true
+    offset of the rings, free of the loops left by corners, narrow necks
+    and edges too short to survive the offset, and holes and islands which
+    have run into each other are merged.  A piece bounds it when the
+    winding number just to its left is exactly 1, and it keeps the offset
+    distance from the rings; the latter does away with what is left of a
+    ring offset by more than its own width, which comes out turned inside
+    out but the right way round.  The pieces kept are strung back together
+    into rings at the crossings.
+
+    Crossings are found with a uniform grid of the segments, winding
+    numbers with horizontal bands of them and distances with a grid of the
+    edges of "rings", so none of them looks at every segment.
+    """
+
+    segments = []  # (a, b, ring number, index in ring)
+    xmin = ymin = EXTREME_POS
+    xmax = ymax = EXTREME_NEG
+    for (n_ring, ring) in enumerate(raw_rings):
+        n = len(ring)
+        for i in range(n):
+            a, b = ring[i], ring[(i + 1) % n]
+            segments.append((a, b, n_ring, i))
+            xmin, xmax = min(xmin, a[0]), max(xmax, a[0])
+            ymin, ymax = min(ymin, a[1]), max(ymax, a[1])
+    if not segments:
+        return []
+    n_segments = len(segments)
+    f_cell = max(xmax - xmin, ymax - ymin, distance) / max(1.0, math.sqrt(n_segments))
+
+    # Crossings, as (t, node) splits of each segment
+    grid = {}
+    for (n_segment, (a, b, n_ring, i)) in enumerate(segments):
+        for gx in range(int((min(a[0], b[0]) - xmin) / f_cell), int((max(a[0], b[0]) - xmin) / f_cell) + 1):
+            for gy in range(int((min(a[1], b[1]) - ymin) / f_cell), int((max(a[1], b[1]) - ymin) / f_cell) + 1):
+                grid.setdefault((gx, gy), []).append(n_segment)
+    splits = {}
+    nodes = []
+    tested = set()
+    for cell in grid.values():
+        for (n_first, n_segment) in enumerate(cell):
+            a, b = segments[n_segment][0], segments[n_segment][1]
+            for n_other in cell[n_first + 1:]:
+                pair = (n_segment, n_other) if n_segment < n_other else (n_other, n_segment)
+                if pair in tested:
+                    continue
+                tested.add(pair)
+                crossing = segmentCrossing(a, b, segments[n_other][0], segments[n_other][1])
+                if crossing is None:
+                    continue
+                t, u = crossing
+                n_node = len(nodes)
+                nodes.append((a[0] + t * (b[0] - a[0]), a[1] + t * (b[1] - a[1])))
+                splits.setdefault(n_segment, []).append((t, n_node))
+                splits.setdefault(n_other, []).append((u, n_node))
+
+    # Horizontal bands of segments, for the winding numbers
+    n_bands = max(1, int(math.sqrt(n_segments)))
+    f_band = (ymax - ymin) / n_bands if ymax > ymin else 1.0
+    bands = [[] for n_band in range(n_bands)]
+    for (a, b, n_ring, i) in segments:
+        for n_band in range(min(n_bands - 1, int((min(a[1], b[1]) - ymin) / f_band)),
+                            min(n_bands - 1, int((max(a[1], b[1]) - ymin) / f_band)) + 1):
+            bands[n_band].append((a, b))
+
+    def windingNumber(x, y):
+        n_band = int((y - ymin) / f_band)
+        if n_band < 0 or n_band >= n_bands:
+            return 0
+        n_winding = 0
+        for (a, b) in bands[n_band]:
+            if a[1] <= y:
+                if b[1] > y and (b[0] - a[0]) * (y - a[1]) - (x - a[0]) * (b[1] - a[1]) > 0:
+                    n_winding += 1
+            elif b[1] <= y and (b[0] - a[0]) * (y - a[1]) - (x - a[0]) * (b[1] - a[1]) < 0:
+                n_winding -= 1
+        return n_winding
+
+    # The edges of the rings offset, for the distance check
+    f_least_distance = distance * (1.0 - CONTOUR_DISTANCE_SLACK) - flat
+    f_edge_cell = max(distance, f_cell)
+    edge_grid = {}
+    for ring in rings:
+        for i in range(len(ring)):
+            a, b = ring[i - 1], ring[i]
+            for gx in range(int(math.floor(min(a[0], b[0]) / f_edge_cell)), int(math.floor(max(a[0], b[0]) / f_edge_cell)) + 1):
+                for gy in range(int(math.floor(min(a[1], b[1]) / f_edge_cell)), int(math.floor(max(a[1], b[1]) / f_edge_cell)) + 1):
+                    edge_grid.setdefault((gx, gy), []).append((a, b))
+
+    def keepsDistance(x, y):
+        for gx in range(int(math.floor((x - f_least_distance) / f_edge_cell)), int(math.floor((x + f_least_distance) / f_edge_cell)) + 1):
+            for gy in range(int(math.floor((y - f_least_distance) / f_edge_cell)), int(math.floor((y + f_least_distance) / f_edge_cell)) + 1):
+                for (a, b) in edge_grid.get((gx, gy), ()):
+                    if pointToSegmentDistance(x, y, a[0], a[1], b[0], b[1]) < f_least_distance:
+                        return False
+        return True
+
+    def bounds(points):
+        # Whether the piece through "points" has winding number 1 just to its left
+        for j in range(len(points) - 1):
+            (x0, y0), (x1, y1) = points[j], points[j + 1]
+            length = math.hypot(x1 - x0, y1 - y0)
+            if length > 0:
+                break
+        else:
+            return False
+        f_step = min(length, distance) * CONTOUR_SAMPLE_FRACTION / length
+        return (windingNumber((x0 + x1) / 2 - (y1 - y0) * f_step, (y0 + y1) / 2 + (x1 - x0) * f_step) == 1 and
+                keepsDistance((x0 + x1) / 2, (y0 + y1) / 2))
+
+    # Cut the rings into pieces running from crossing to crossing
+    rings = []
+    pieces = {}  # Pieces kept, by their starting node
+    n_segment = 0
+    for ring in raw_rings:
+        points = []  # (point, node or None)
+        for i in range(len(ring)):
+            points.append((ring[i], None))
+            for (t, n_node) in sorted(splits.get(n_segment + i, [])):
+                points.append((nodes[n_node], n_node))
+        n_segment += len(ring)
+
+        n_first_node = next((j for (j, (point, n_node)) in enumerate(points) if n_node is not None), None)
+        if n_first_node is None:
+            # Crosses nothing: kept or dropped whole
+            ring_points = [point for (point, n_node) in points]
+            if bounds(ring_points):
+                rings.append(ring_points)
+            continue
+        points = points[n_first_node:] + points[:n_first_node]
+        piece = [points[0][0]]
+        n_start = points[0][1]
+        for (point, n_node) in points[1:] + points[:1]:
+            piece.append(point)
+            if n_node is not None:
+                if bounds(piece):
+                    pieces.setdefault(n_start, []).append((piece, n_node))
+                piece = [point]
+                n_start = n_node
+
+    # String the pieces kept back together, from crossing to crossing
+    while pieces:
+        n_start = next(iter(pieces))
+        ring_points = []
+        n_node = n_start
+        while n_node in pieces:
+            piece, n_next = pieces[n_node].pop()
+            if not pieces[n_node]:
+                del pieces[n_node]
+            ring_points.extend(piece[:-1])
+            n_node = n_next
+            if n_node == n_start:
+                break
+        if len(ring_points) >= 3:
+            rings.append(ring_points)
+
+    return rings
+
+
+def contourRings(subpaths, f_first_distance, f_spacing, flat):
+    """
+    The rings of a contour (concentric) fill of the polygons "subpaths":
+    the outlines moved f_first_distance inwards, then f_spacing further
+    inwards again and again until nothing is left.  Holes move outwards
+    alike, and rings meeting one another merge.  Returns a list of
+    [level, ring] pairs, the level being the number of the inward step,
+    each ring a list of [x, y] vertices with the area left to fill lying
+    to its left.
+    """
+
+    f_min_length = flat * CONTOUR_MIN_EDGE_FRACTION
+    rings = orientRings(subpaths, f_min_length)
+    contours = []
+    f_distance = f_first_distance
+    n_level = 0
+    while rings and n_level < CONTOUR_MAX_LEVELS:
+        raw_rings = [rawOffsetRing(ring, f_distance, flat) for ring in rings]
+        offset_rings = cleanOffsetRings(raw_rings, rings, f_distance, flat)
+        rings = []
+        for ring in offset_rings:
+            # Lose the vertices crowded together by the offset
+            thinned = [ring[0]]
+            for vertex in ring[1:]:
+                if distanceSquared(thinned[-1], vertex) > f_min_length * f_min_length:
+                    thinned.append(vertex)
+            if len(thinned) >= 3 and abs(ringArea(thinned)) > f_min_length * f_spacing:
+                rings.append(thinned)
+                contours.append([n_level, [[x, y] for (x, y) in thinned]])
+        f_distance = f_spacing
+        n_level += 1
+    return contours
+
+
+def nearestPointOnRing(ring, pt):
+    """
+    The point of the closed polygon "ring" nearest to pt, as
+    (distance squared, edge index, point)
+    """
+
+    best = (EXTREME_POS, 0, ring[0])
+    n = len(ring)
+    for i in range(n):
+        (x0, y0), (x1, y1) = ring[i], ring[(i + 1) % n]
+        dx, dy = x1 - x0, y1 - y0
+        length_squared = dx * dx + dy * dy
+        t = 0.0
+        if length_squared > 0:
+            t = min(1.0, max(0.0, ((pt[0] - x0) * dx + (pt[1] - y0) * dy) / length_squared))
+        x, y = x0 + t * dx, y0 + t * dy
+        f_distance_squared = (x - pt[0]) * (x - pt[0]) + (y - pt[1]) * (y - pt[1])
+        if f_distance_squared < best[0]:
+            best = (f_distance_squared, i, [x, y])
+    return best
+
+
+def ringStartingAt(ring, i, pt):
+    """
+    The vertices of "ring" rotated to start at pt, which lies on its edge i
+    """
+
+    return [pt] + ring[i + 1:] + ring[:i + 1]
+
+
+def linkCrossesRings(pt1, pt2, rings):
+    """
+    Whether the straight link from pt1 to pt2 crosses any edge of "rings"
+    other than at its own ends
+    """
+
+    for ring in rings:
+        n = len(ring)
+        for i in range(n):
+            a, b = ring[i], ring[(i + 1) % n]
+            if a == pt1 or b == pt1 or a == pt2 or b == pt2:
+                continue
+            crossing = segmentCrossing(pt1, pt2, a, b)
+            if crossing is not None and 0.0 < crossing[0]:
+                return True
+    return False
+
+
+def hatchSubpathsInWorker(job):
+    """
+    Hatch and chain the flattened polygons of a single document element.
+    This runs in a worker process when hatching with more than one
+    process, so it is handed the vertex lists of the element rather than
+    the element itself.
+
+    job -- (options, subpaths, matrix, stroke_width) with the matrix being
+           that of the element's inverse transform, or None
+
+    Returns None if the element has no hatches, else the tuple
+
+        (segments, path data, [(segments joined, pen-up distance), ...])
+    """
+
+    options, subpaths, matrix, stroke_width = job
+    hatch_fill = Hatch_Fill()
+    hatch_fill.options = options
+    hatch_fill.paths = {0: subpaths}
+    hatch_fill.hatchPaths()
+    if 0 not in hatch_fill.hatches:
+        return None
+
+    transform = Transform(matrix) if matrix is not None else None
+    path = hatch_fill.chainHatches(0, hatch_fill.hatches[0], transform, stroke_width)
+    return (hatch_fill.hatches[0], path,
+            [(n_segments, f_pen_up_distance) for (key, n_segments, f_pen_up_distance) in hatch_fill.chainStats])
+
+
+def hatchCacheDirectory():
+    """
+    Directory in which to keep the hatch cache: the per-user cache
+    directory of the platform, falling back to ~/.cache
+    """
+
+    base = os.environ.get('XDG_CACHE_HOME') or os.environ.get('LOCALAPPDATA')
+    if not base:
+        base = os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'km_hatch_fill')
+
+
+class HatchCache(object):
+    """
+    On-disk cache of the hatch segments computed for document elements,
+    so that re-running the extension on a document in which only a few
+    objects changed only has to recompute those objects.
+
+    Entries are addressed by a hash of everything the hatches depend upon:
+    the element's flattened vertices, its composed transform and the hatch
+    options.  Each entry is a small JSON file.  Reading an entry refreshes
+    its modification time, and once the cache grows beyond its size limit
+    the least recently used entries are deleted.
+
+    Problems reading or writing the cache are never fatal: the hatches are
+    then simply computed as if there were no cache.
+    """
+
+    def __init__(self, directory, n_max_bytes):
+        self.directory = directory
+        self.n_max_bytes = n_max_bytes
+
+    @staticmethod
+    def key(subpaths, matrix, option_values):
+        digest = hashlib.sha1()
+        digest.update(repr((HATCH_CACHE_VERSION, matrix, option_values)).encode('utf-8'))
+        digest.update(repr(subpaths).encode('utf-8'))
+        return digest.hexdigest()
+
+    def fileOf(self, key):
+        return os.path.join(self.directory, key + '.json')
+
+    def get(self, key):
+        """
+        Return (True, segments) on a hit, else (False, None).  The cached
+        segments are None for an element which produced no hatches.
+        """
+        file_name = self.fileOf(key)
+        try:
+            with open(file_name, 'r') as cache_file:
+                segments = json.load(cache_file)
+            os.utime(file_name, None)  # Most recently used
+        except (OSError, ValueError):
+            return False, None
+        return True, segments
+
+    def put(self, key, segments):
+        file_name = self.fileOf(key)
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            # Write then rename, so that a reader never sees half an entry
+            with open(file_name + '.tmp', 'w') as cache_file:
+                json.dump(segments, cache_file, separators=(',', ':'))
+            os.replace(file_name + '.tmp', file_name)
+        except OSError:
+            pass
+
+    def evict(self):
+        """
+        Delete the least recently used entries until the cache fits in its size limit
+        """
+        try:
+            entries = []
+            n_total_bytes = 0
+            for file_name in os.listdir(self.directory):
+                if file_name.endswith('.json'):
+                    stat = os.stat(os.path.join(self.directory, file_name))
+                    entries.append((stat.st_mtime, stat.st_size, file_name))
+                    n_total_bytes += stat.st_size
+            entries.sort()
+            for (mtime, n_bytes, file_name) in entries:
+                if n_total_bytes <= self.n_max_bytes:
+                    break
+                os.remove(os.path.join(self.directory, file_name))
+                n_total_bytes -= n_bytes
+        except OSError:
+            pass
+
+
+class HatchProfile(object):
+    """
+    Wall time spent in each phase of a run, and counts of the work done,
+    for finding out where the time goes on a slow job.  Does nothing
+    unless enabled.
+
+    Phases may nest: duplicate removal is part of intersections, and the
+    traversal phase is whatever time is left over once the other phases
+    have been accounted for.  With worker processes, the hatching itself
+    happens in the workers and is only seen as traversal.
+    """
+
+    PHASES = ('traversal', 'preview_estimate', 'flattening', 'hatch_grid', 'intersections',
+              'duplicate_removal', 'offsetting', 'chaining', 'joining', 'travel_ordering')
+
+    def __init__(self):
+        self.enabled = False
+        self.times = {}
+        self.counts = {}
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        if not self.enabled:
+            yield
+            return
+        t_start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.addTime(name, time.perf_counter() - t_start)
+
+    def addTime(self, name, f_seconds):
+        self.times[name] = self.times.get(name, 0.0) + f_seconds
+
+    def count(self, name, n=1):
+        if self.enabled:
+            self.counts[name] = self.counts.get(name, 0) + n
+
+    def report(self, f_total_seconds):
+        """
+        The profile as a dictionary, ready for json.dump()
+        """
+
+        times = dict((name, self.times.get(name, 0.0)) for name in self.PHASES)
+        times['traversal'] = max(0.0, f_total_seconds - sum(
+                times[name] for name in self.PHASES if name not in ('traversal', 'duplicate_removal')))
+        times['total'] = f_total_seconds
+        return {'seconds': times, 'counts': self.counts}
+
+
+class LineSegmentBuffer(object):
+    """
+    Line segments held flat in an array of doubles, four to a segment
+    (x1, y1, x2, y2), with a bitset flagging the segments already drawn.
+    That is 32 bytes and a bit for each segment, where a list of two point
+    lists and a flag takes several hundred, which matters once an element
+    has a million hatches.  The buffer pickles as it is, for the worker
+    processes, and goes to and from a flat list for the hatch cache.
+    """
+
+    def __init__(self, coordinates=()):
+        self.coordinates = array('d', coordinates)
+        self.drawn = bytearray((len(self) + 7) // 8)
+
+    def __len__(self):
+        return len(self.coordinates) // 4
+
+    def append(self, x1, y1, x2, y2):
+        if len(self) == 8 * len(self.drawn):
+            self.drawn.append(0)
+        self.coordinates.extend((x1, y1, x2, y2))
+
+    def point(self, n_segment, n_end):
+        """
+        End n_end (0 or 1) of segment n_segment, as an (x, y) tuple
+        """
+        k = 4 * n_segment + 2 * n_end
+        return self.coordinates[k], self.coordinates[k + 1]
+
+    def isDrawn(self, n_segment):
+        return self.drawn[n_segment >> 3] & (1 << (n_segment & 7)) != 0
+
+    def setDrawn(self, n_segment):
+        self.drawn[n_segment >> 3] |= 1 << (n_segment & 7)
+
+    def toList(self):
+        return self.coordinates.tolist()
+
+
+class SegmentEndGrid(object):
+    """
+    Uniform grid holding the end points of the line segments which have
+    yet to be drawn, so that the search for a nearby segment to join only
+    has to look at the handful of segments in the neighbouring grid cells
+    rather than at every segment.
+
+    The cells are made at least as large as the neighborhood radius.  Any
+    end point within that radius of a reference point must then lie in the
+    reference point's own cell or in one of the eight cells around it.
+
+    The segments are those of a LineSegmentBuffer.  The cells hold each
+    end as the single integer 2 * segment index + end index, and the cells
+    of a segment are worked out again from its ends when it is removed.
+    """
+
+    def __init__(self, abs_line_segments, segment_indices, f_neighborhood_radius):
+        self.f_cell_size = f_neighborhood_radius if f_neighborhood_radius > 0 else 1.0
+        self.abs_line_segments = abs_line_segments
+        self.cells = {}
+        for n_segment in segment_indices:
+            if abs_line_segments.isDrawn(n_segment):
+                continue  # Already drawn
+            for n_end in range(2):
+                cell = self.cellOf(abs_line_segments.point(n_segment, n_end))
+                self.cells.setdefault(cell, set()).add(2 * n_segment + n_end)
+
+    def cellOf(self, pt):
+        return int(math.floor(pt[0] / self.f_cell_size)), int(math.floor(pt[1] / self.f_cell_size))
+
+    def add(self, n_segment):
+        """
+        Hold a segment which was left out when the grid was made
+        """
+        for n_end in range(2):
+            cell = self.cellOf(self.abs_line_segments.point(n_segment, n_end))
+            self.cells.setdefault(cell, set()).add(2 * n_segment + n_end)
+
+    def remove(self, n_segment):
+        """
+        Forget a segment once it has been drawn
+        """
+        for n_end in range(2):
+            cell_key = self.cellOf(self.abs_line_segments.point(n_segment, n_end))
+            cell = self.cells.get(cell_key)
+            if cell is not None:
+                cell.discard(2 * n_segment + n_end)
+                if not cell:
+                    del self.cells[cell_key]
+
+    def near(self, pt):
+        """
+        Return the (segment index, end index) pairs of the undrawn segment
+        ends in the cells around pt.  These are sorted in the same order
+        that a scan of all the segments would visit them, so that ties in
+        distance are still resolved in favour of the first segment found.
+        """
+        n_cell_x, n_cell_y = self.cellOf(pt)
+        candidates = []
+        for n_x in range(n_cell_x - 1, n_cell_x + 2):
+            for n_y in range(n_cell_y - 1, n_cell_y + 2):
+                cell = self.cells.get((n_x, n_y))
+                if cell:
+                    candidates.extend(cell)
+        candidates.sort()
+        return [divmod(n_segment_end, 2) for n_segment_end in candidates]
+
+    def nearest(self, pt):
+        """
+        Return the (segment index, end index) pair of the undrawn segment
+        end closest to pt, or None once every segment has been drawn.  The
+        rings of cells around pt are searched outwards until no end any
+        closer can remain; should a ring hold more cells than are still
+        occupied, the occupied cells are simply all looked at instead.
+        """
+        if not self.cells:
+            return None
+        n_cell_x, n_cell_y = self.cellOf(pt)
+        best = None
+        n_ring = 0
+        while True:
+            b_all_cells = 8 * n_ring >= len(self.cells)
+            if b_all_cells:
+                cells = list(self.cells)
+            elif n_ring == 0:
+                cells = [(n_cell_x, n_cell_y)]
+            else:
+                cells = []
+                for n_x in range(n_cell_x - n_ring, n_cell_x + n_ring + 1):
+                    cells.append((n_x, n_cell_y - n_ring))
+                    cells.append((n_x, n_cell_y + n_ring))
+                for n_y in range(n_cell_y - n_ring + 1, n_cell_y + n_ring):
+                    cells.append((n_cell_x - n_ring, n_y))
+                    cells.append((n_cell_x + n_ring, n_y))
+            for cell in cells:
+                for n_segment_end in self.cells.get(cell, ()):
+                    n_segment, n_end = divmod(n_segment_end, 2)
+                    candidate = (distanceSquared(pt, self.abs_line_segments.point(n_segment, n_end)), n_segment, n_end)
+                    if best is None or candidate < best:
+                        best = candidate
+            # Any end in a further ring is at least n_ring cells away
+            if b_all_cells or (best is not None and best[0] <= (n_ring * self.f_cell_size) ** 2):
+                break
+            n_ring += 1
+        return best[1], best[2]
+
+
+def travelCellSize(points):
+    """
+    A grid cell size for a SegmentEndGrid holding about len(points) ends
+    spread over the bounding box of points.
+    """
+
+    xs = [pt[0] for pt in points]
+    ys = [pt[1] for pt in points]
+    f_extent = max(max(xs) - min(xs), max(ys) - min(ys))
+    return f_extent / math.sqrt(len(points)) if f_extent > 0 else 1.0
+
+
+def reverseTravelItem(item):
+    """
+    Turn around a [content, start, end, b_reversed] travel item.
+    """
+
+    item[1], item[2] = item[2], item[1]
+    item[3] = not item[3]
+
+
+def orderTravelItems(items, pt_pen):
+    """
+    Order the [content, start, end, b_reversed] travel items so as to
+    keep the pen-up travel from pt_pen through all of them short, turning
+    items around as needed.  Each step goes on to the item with the
+    nearest end, after which the order is improved by twoOptTravelItems().
+    Returns the items in their new order.
+    """
+
+    segments = LineSegmentBuffer()
+    for item in items:
+        segments.append(item[1][0], item[1][1], item[2][0], item[2][1])
+    segment_ends = SegmentEndGrid(segments, range(len(items)),
+                                  travelCellSize([item[1] for item in items] + [item[2] for item in items]))
+
+    ordered = []
+    pt = pt_pen
+    while True:
+        found = segment_ends.nearest(pt)
+        if found is None:
+            break
+        n_item, n_end = found
+        segment_ends.remove(n_item)
+        item = items[n_item]
+        if n_end == 1:
+            reverseTravelItem(item)
+        ordered.append(item)
+        pt = item[2]
+
+    twoOptTravelItems(ordered, pt_pen)
+    return ordered
+
+
+def twoOptTravelItems(items, pt_pen, fReversible=None):
+    """
+    Improve the order of the [content, start, end, b_reversed] travel
+    items in place with 2-opt moves: a run of items is turned around
+    whenever doing so shortens the pen-up moves into and out of it.  To
+    keep the cost linear in the number of items, runs are at most
+    TRAVEL_TWO_OPT_WINDOW items long, and at most TRAVEL_TWO_OPT_PASSES
+    passes are made.  When given, fReversible(run) says whether the list
+    of items "run" may be turned around.
+    """
+
+    n_items = len(items)
+    for n_pass in range(TRAVEL_TWO_OPT_PASSES):
+        b_improved = False
+        for i in range(n_items):
+            pt_before = pt_pen if i == 0 else items[i - 1][2]
+            for j in range(i, min(n_items, i + TRAVEL_TWO_OPT_WINDOW)):
+                f_old = math.hypot(items[i][1][0] - pt_before[0], items[i][1][1] - pt_before[1])
+                f_new = math.hypot(items[j][2][0] - pt_before[0], items[j][2][1] - pt_before[1])
+                if j + 1 < n_items:
+                    pt_after = items[j + 1][1]
+                    f_old += math.hypot(pt_after[0] - items[j][2][0], pt_after[1] - items[j][2][1])
+                    f_new += math.hypot(pt_after[0] - items[i][1][0], pt_after[1] - items[i][1][1])
+                if f_new < f_old - TRAVEL_TWO_OPT_GAIN and \
+                        (fReversible is None or fReversible(items[i:j + 1])):
+                    items[i:j + 1] = items[i:j + 1][::-1]
+                    for item in items[i:j + 1]:
+                        reverseTravelItem(item)
+                    b_improved = True
+        if not b_improved:
+            break
+
+
+def overlappingBoxes(boxes):
+    """
+    For each of the bounding boxes (or None) in "boxes", the set of the
+    indices of the other boxes which overlap or touch it.  The boxes are
+    swept in order of their left sides, so that each is only compared
+    with those still open across it.
+    """
+
+    overlaps = [set() for box in boxes]
+    open_boxes = []
+    for n_box in sorted((n for n in range(len(boxes)) if boxes[n] is not None), key=lambda n: boxes[n].left):
+        box = boxes[n_box]
+        open_boxes = [n for n in open_boxes if boxes[n].right >= box.left]
+        for n_open in open_boxes:
+            if boxes[n_open].top <= box.bottom and box.top <= boxes[n_open].bottom:
+                overlaps[n_box].add(n_open)
+                overlaps[n_open].add(n_box)
+        open_boxes.append(n_box)
+    return overlaps
+
+
+def writePathData(path_data, path):
+    """
+    Write the inkex Path path, made only of moves, lines and cubic
+    Beziers as the hatch paths are, to the PathDataWriter path_data.
+    """
+
+    for command in path.to_absolute():
+        if command.letter == 'M':
+            path_data.moveTo(*command.args)
+        elif command.letter == 'L':
+            path_data.lineTo(*command.args)
+        elif command.letter == 'C':
+            path_data.curveTo(*command.args)
+        elif command.letter == 'Z':
+            path_data.close()
+
+
+def travelDistance(items, pt_pen):
+    """
+    Pen-up distance from pt_pen through the [content, start, end,
+    b_reversed] travel items in their present order.
+    """
+
+    f_distance = 0.0
+    for item in items:
+        f_distance += math.hypot(item[1][0] - pt_pen[0], item[1][1] - pt_pen[1])
+        pt_pen = item[2]
+    return f_distance
+
+
 class Hatch_Fill(inkex.Effect):
 
     def __init__(self):
@@ -562,8 +1838,20 @@ class Hatch_Fill(inkex.Effect):
         self.xmax, self.ymax = (0.0, 0.0)
         self.paths = {}
         self.grid = []
+        self.gridFrames = []
         self.hatches = {}
         self.transforms = {}
+        self.chainStats = []  # (node, segments joined, pen-up distance) for each chain drawn
+        self.chainedPaths = {}  # Path data of nodes already chained by worker processes
+        self.pendingNodes = []  # (node, subpaths) awaiting the worker processes
+        self.hatchCache = None
+        self.cacheKeys = {}  # Cache keys of the nodes whose hatches are to be cached
+        self.hatchGroups = []  # Groups made by joinFillsWithNode(), kept for the travel ordering
+        self.flattenedPaths = OrderedDict()  # Recently flattened closed subpaths, by path data hash, linear transform and tolerance
+        self.pageBox = None  # (xmin, ymin, xmax, ymax) of the page when culling, else None
+        self.nCulled = 0  # Hidden or off-page elements skipped
+        self.bStyleSheets = None  # Whether the document has CSS style sheets, once looked up
+        self.profile = HatchProfile()
 
         # For handling an SVG viewbox attribute, we will need to know the
         # values of the document's <svg> width and height attributes as well
@@ -594,6 +1882,10 @@ class Hatch_Fill(inkex.Effect):
                 "--crossHatch",
                 type=inkex.Boolean, default=False,
                 help="Generate a cross hatch pattern")
+        self.arg_parser.add_argument(
+                "--fillMode", type=str,
+                default="lines",
+                help="Fill pattern: lines (parallel hatches) or contour (rings following the outline)")
         self.arg_parser.add_argument(
                 "--hatchAngle", type=float,
                 default=90.0,
@@ -606,6 +1898,54 @@ class Hatch_Fill(inkex.Effect):
                 "--tolerance", type=float,
                 default=20.0,
                 help="Allowed deviation from original paths")
+        self.arg_parser.add_argument(
+                "--logChainStats",
+                type=inkex.Boolean, default=False,
+                help="Report the segments joined and pen-up distance of each chain")
+        self.arg_parser.add_argument(
+                "--profile",
+                type=inkex.Boolean, default=False,
+                help="Report the time spent in each phase of hatching, and the work done")
+        self.arg_parser.add_argument(
+                "--profileFile", type=str,
+                default="",
+                help="JSON file to write the profile to; if empty, the profile goes to stderr")
+        self.arg_parser.add_argument(
+                "--cullHidden",
+                type=inkex.Boolean, default=True,
+                help="Skip hidden and off-page objects when hatching the whole document")
+        self.arg_parser.add_argument(
+                "--useCache",
+                type=inkex.Boolean, default=False,
+                help="Reuse the hatches of unchanged objects from previous runs")
+        self.arg_parser.add_argument(
+                "--cacheSize", type=int,
+                default=100,
+                help="Size limit of the hatch cache (MB)")
+        self.arg_parser.add_argument(
+                "--workers", type=int,
+                default=1,
+                help="Number of processes hatching nodes in parallel (0 = one per CPU core)")
+        self.arg_parser.add_argument(
+                "--engine", type=str,
+                default="python",
+                help="Intersection engine: python or numpy (falls back to python without NumPy)")
+        self.arg_parser.add_argument(
+                "--optimizeTravel",
+                type=inkex.Boolean, default=False,
+                help="Reorder the hatches to shorten the pen-up travel between them")
+        self.arg_parser.add_argument(
+                "--preview",
+                type=inkex.Boolean, default=False,
+                help="Quick, coarser hatching for previews")
+        self.arg_parser.add_argument(
+                "--previewSegments", type=int,
+                default=20000,
+                help="Rough limit on the number of hatch segments in preview mode")
+        self.arg_parser.add_argument(
+                "--precision", type=int,
+                default=3,
+                help="Decimal places written in the hatch path data")
 
     def handleViewBox(self):
 
@@ -631,48 +1971,35 @@ class Hatch_Fill(inkex.Effect):
 
         transform = node.composed_transform()
 
-        if node.tag in [
-                inkex.addNS('rect', 'svg'), 'rect', 
-                inkex.addNS('line', 'svg'), 'line', 
-                inkex.addNS('polyline', 'svg'), 'polyline', 
-                inkex.addNS('polygon', 'svg'), 'polygon', 
-                inkex.addNS('ellipse', 'svg'), 'ellipse',
-                inkex.addNS('circle', 'svg'), 'circle']:
+        if node.tag not in PATH_TAGS:
             # We use a copy for the shapes, don't want to convert everything to a path
             node_as_path = node.to_path_element()
             p = node_as_path.path
         else:
             p = node.path
 
-        # Get a cubic super duper path  
-        p = p.transform(transform).to_superpath()
-        
-        # Now traverse the simplified path
-        subpaths = []
-        subpath_vertices = []
-        for sp in p:
-            # We've started a new subpath
-            # See if there is a prior subpath and whether we should keep it
-            if len(subpath_vertices):
-                if distanceSquared(subpath_vertices[0], subpath_vertices[-1]) < 1:
-                    # Keep the prior subpath: it appears to be a closed path
-                    subpaths.append(subpath_vertices)
-            subpath_vertices = []
-            subdivideCubicPath(sp, float(self.options.tolerance / 100))
-            for csp in sp:
-                # Add this vertex to the list of vertices
-                subpath_vertices.append(csp[1])
-
-        # Handle final subpath
-        if len(subpath_vertices):
-            if distanceSquared(subpath_vertices[0], subpath_vertices[-1]) < 1:
-                # Path appears to be closed so let's keep it
-                subpaths.append(subpath_vertices)
+        # Repeated geometry need only be flattened once.  Translating a path
+        # doesn't change how finely it must be flattened, so only the rest
+        # of the transform goes into the key and the offset is added after.
+        # Only the last FLATTEN_CACHE_SIZE paths are kept, so that memory
+        # stays bounded by the largest elements rather than the document.
+        (a, c, e), (b, d, f) = transform.matrix
+        key = (hashlib.sha1(str(p).encode('utf-8')).digest(), (a, b, c, d), self.options.tolerance)
+        flattened = self.flattenedPaths.get(key)
+        if flattened is None:
+            flattened = self.flattenPath(p.transform(Transform(((a, c, 0.0), (b, d, 0.0)))))
+            self.flattenedPaths[key] = flattened
+            if len(self.flattenedPaths) > FLATTEN_CACHE_SIZE:
+                self.flattenedPaths.popitem(last=False)
+        else:
+            self.flattenedPaths.move_to_end(key)
 
         # Empty path?
-        if len(subpaths) == 0:
+        if len(flattened) == 0:
             return
 
+        subpaths = [[(x + e, y + f) for (x, y) in subpath] for subpath in flattened]
+
         # And add this path to our dictionary of paths
         self.paths[node] = subpaths
 
@@ -680,6 +2007,26 @@ class Hatch_Fill(inkex.Effect):
         # by the element's lxml node pointer
         self.transforms[node] = transform
 
+    def flattenPath(self, p):
+
+        """
+        Flatten the (already transformed) path p into a list of its closed
+        subpaths, each a list of (x, y) vertices.  Open subpaths, whose
+        ends lie a unit or more apart, are dropped.
+        """
+
+        # Get a cubic super duper path
+        subpaths = []
+        flat = float(self.options.tolerance / 100)
+        for sp in p.to_superpath():
+            if len(sp) == 0:
+                continue
+            subpath_vertices = flattenCubicSubpath(sp, flat)
+            if distanceSquared(subpath_vertices[0], subpath_vertices[-1]) < 1:
+                # Keep this subpath: it appears to be a closed path
+                subpaths.append(subpath_vertices)
+        return subpaths
+
     def getBoundingBox(self):
 
         """
@@ -719,11 +2066,16 @@ class Hatch_Fill(inkex.Effect):
         Once a supported graphical element is found, we call functions to
         create a hatchfill specific to this element. These hatches and their
         corresponding transforms are stored in self.hatches and self.transforms
-        These two dictionaries are used when we return to the effect method
-        in joinFillsWithNode()
+
+        This is a generator: each element is yielded as soon as its hatches
+        are in self.hatches, so that the effect method can write them out with
+        joinFillsWithNode() and free them before moving on.  That moves the
+        element into a new group, so we walk a snapshot of the child list.
+        When hatching with worker processes, the elements are only collected
+        in self.pendingNodes here, and are yielded by hatchPendingNodes().
 
         """
-        for node in a_node_list:
+        for node in list(a_node_list):
 
             """
              Initialize dictionary for each new node
@@ -735,29 +2087,35 @@ class Hatch_Fill(inkex.Effect):
             self.xmax, self.ymax = (0.0, 0.0)
             self.paths = {}
             self.grid = []
+            self.gridFrames = []
+
+            if self.pageBox is not None and self.isCulled(node):
+                self.nCulled += 1
+                continue
 
             if node.tag in [inkex.addNS('g', 'svg'), 'g']:
-                self.recursivelyTraverseSvg(node)
+                yield from self.recursivelyTraverseSvg(node)
 
-            elif node.tag in [
-                inkex.addNS('path', 'svg'), 'path',
-                inkex.addNS('rect', 'svg'), 'rect', 
-                inkex.addNS('line', 'svg'), 'line', 
-                inkex.addNS('polyline', 'svg'), 'polyline', 
-                inkex.addNS('polygon', 'svg'), 'polygon', 
-                inkex.addNS('ellipse', 'svg'), 'ellipse',
-                inkex.addNS('circle', 'svg'), 'circle']:
+            elif node.tag in SHAPE_TAGS:
 
-                self.addPathVertices(node)
+                with self.profile.phase('flattening'):
+                    self.addPathVertices(node)
                 # We now have a path we want to apply a (cross)hatch to
-                # Apply appropriate functions
-                b_have_grid = self.makeHatchGrid(float(self.options.hatchAngle), float(self.options.hatchSpacing), True)
-                if b_have_grid:
-                    if self.options.crossHatch:
-                        self.makeHatchGrid(float(self.options.hatchAngle + 90.0), float(self.options.hatchSpacing), False)
-                    # Now loop over our hatch lines looking for intersections
-                    for h in self.grid:
-                        interstices(self, (h[0], h[1]), (h[2], h[3]), self.paths, self.hatches, self.options.holdBackHatchFromEdges, self.options.holdBackSteps)
+                if node not in self.paths:
+                    continue  # No closed subpaths, nothing to hatch
+                if self.hatchCache is not None and self.lookUpCachedHatches(node):
+                    subpaths = None  # Unchanged since a previous run
+                else:
+                    subpaths = self.paths[node]
+
+                if self.options.workers != 1:
+                    # Leave the rest to the worker processes, in document order
+                    self.pendingNodes.append((node, subpaths))
+                    continue
+                if subpaths is not None:
+                    self.hatchPaths()
+                if node in self.hatches:
+                    yield node
 
             elif node.tag in [inkex.addNS('use', 'svg'), 'use']:
                 inkex.errormsg('Warning: unable to hatch object <{0}>, please unlink any clones first.'.format(node.get_id()))
@@ -769,6 +2127,228 @@ class Hatch_Fill(inkex.Effect):
                 inkex.errormsg('Warning: unable to hatch object <{0}>, please convert it to a path first.'.format(node.get_id()))
                 pass
 
+    def hatchedNodes(self):
+
+        """
+        Generate the document elements to be hatched, in document order,
+        as soon as their hatches are ready in self.hatches
+        """
+
+        if self.options.ids:
+            # Traverse the selected objects
+            for id_ in self.options.ids:
+                yield from self.recursivelyTraverseSvg([self.svg.selected[id_]])
+        else:
+            # Traverse the entire document, less what can't be seen
+            if self.options.cullHidden:
+                self.pageBox = self.visiblePageBox()
+            yield from self.recursivelyTraverseSvg(self.document.getroot())
+
+        if self.pendingNodes:
+            yield from self.hatchPendingNodes()
+
+    def visiblePageBox(self):
+
+        """
+        The page, as (xmin, ymin, xmax, ymax) in user units.  Without a
+        usable page size, nothing is off the page, so the box is then
+        unbounded and only hidden elements are culled.
+        """
+
+        vbox = self.svg.get_viewbox()
+        if not vbox or vbox[2] <= 0 or vbox[3] <= 0:
+            return (EXTREME_NEG, EXTREME_NEG, EXTREME_POS, EXTREME_POS)
+        return (vbox[0], vbox[1], vbox[0] + vbox[2], vbox[1] + vbox[3])
+
+    def isCulled(self, node):
+
+        """
+        Whether node need not be hatched because it can't be seen: it is
+        not displayed (as a hidden layer isn't), it is made invisible, or
+        it lies entirely off the page.  Only the display setting is looked
+        at for groups, so that a hidden layer is passed over without
+        visiting its contents; visibility is inherited but may be turned
+        back on further down, so it is looked at for each shape.  Shapes
+        are also judged by the bounding box of their transformed path,
+        which is far cheaper than flattening them.
+
+        Documents without style sheets are styled by presentation
+        attributes and style attributes alone, which are read directly.
+        Otherwise the cascaded style from node.specified_style() is used.
+        """
+
+        if self.bStyleSheets is None:
+            self.bStyleSheets = len(self.svg.xpath('//svg:style')) > 0
+
+        if self.bStyleSheets:
+            style = node.specified_style()
+            display = style.get('display')
+        else:
+            style = None
+            display = inkex.Style(node.get('style')).get('display', node.get('display'))
+        if display == 'none':
+            return True
+        if node.tag not in SHAPE_TAGS:
+            return False
+
+        if style is not None:
+            visibility = style.get('visibility')
+        else:
+            # Inherited from the nearest element setting it
+            visibility = None
+            element = node
+            while visibility is None and element is not None:
+                visibility = inkex.Style(element.get('style')).get('visibility', element.get('visibility'))
+                element = element.getparent()
+        if visibility in ('hidden', 'collapse'):
+            return True
+
+        if node.tag in PATH_TAGS:
+            p = node.path
+        else:
+            p = node.to_path_element().path
+        bbox = p.transform(self.composedTransform(node)).bounding_box()
+        if bbox is None:
+            return False  # Empty, left for addPathVertices() to pass over
+        (xmin, ymin, xmax, ymax) = self.pageBox
+        return bbox.right < xmin or bbox.left > xmax or bbox.bottom < ymin or bbox.top > ymax
+
+    def composedTransform(self, node):
+
+        """
+        The transform from node's coordinates to the document's, composed
+        from the transform attributes of node and its ancestors.  Unlike
+        node.composed_transform(), this never writes to the document, so
+        that culling leaves the nodes it keeps exactly as they were.
+        """
+
+        transform = Transform()
+        while node is not None:
+            transform = Transform(node.get('transform')) @ transform
+            node = node.getparent()
+        return transform
+
+    def lookUpCachedHatches(self, node):
+
+        """
+        Look for the hatches of node in the hatch cache.  On a hit, they
+        are put into self.hatches and True is returned.  On a miss, the
+        cache key is remembered so the hatches can be cached once computed.
+        """
+
+        option_values = (self.options.hatchAngle, self.options.hatchSpacing, self.options.crossHatch,
+                         self.options.holdBackHatchFromEdges, self.options.holdBackSteps, self.options.tolerance,
+                         self.options.fillMode)
+        key = self.hatchCache.key(self.paths[node], self.transforms[node].matrix, option_values)
+        b_hit, segments = self.hatchCache.get(key)
+        if b_hit:
+            if segments is not None:
+                # Line hatches are cached as the flat list of their coordinates
+                self.hatches[node] = segments if self.options.fillMode == 'contour' else LineSegmentBuffer(segments)
+            return True
+        self.cacheKeys[node] = key
+        return False
+
+    def hatchPaths(self):
+
+        """
+        Build the hatch grid for the polygons in self.paths, and intersect
+        it with them, adding the resulting hatch segments to self.hatches
+        """
+
+        if self.options.fillMode == 'contour':
+            self.contourPaths()
+            return
+
+        with self.profile.phase('hatch_grid'):
+            b_have_grid = self.makeHatchGrid(float(self.options.hatchAngle), float(self.options.hatchSpacing), True)
+            if b_have_grid and self.options.crossHatch:
+                self.makeHatchGrid(float(self.options.hatchAngle + 90.0), float(self.options.hatchSpacing), False)
+        if b_have_grid:
+            self.profile.count('grid_lines', len(self.grid))
+            # Now sweep each family of hatch lines across the polygon
+            # edges, looking for intersections
+            with self.profile.phase('intersections'):
+                edge_table = EdgeTable(self.paths)
+                self.profile.count('edges', len(edge_table))
+                if self.options.engine == 'numpy' and numpy is not None:
+                    edge_arrays = packEdgeArrays(edge_table)
+                    for (frame, n_first, n_last) in self.gridFrames:
+                        vectorizedInterstices(self, self.grid[n_first:n_last], edge_arrays, frame, self.hatches,
+                                              self.options.holdBackHatchFromEdges, self.options.holdBackSteps)
+                else:
+                    sweeps = edge_table.sweepOrders([frame for (frame, n_first, n_last) in self.gridFrames])
+                    for ((frame, n_first, n_last), sweep) in zip(self.gridFrames, sweeps):
+                        scanlineInterstices(self, self.grid[n_first:n_last], edge_table, frame, sweep, self.hatches,
+                                            self.options.holdBackHatchFromEdges, self.options.holdBackSteps)
+
+    def contourPaths(self):
+
+        """
+        Contour fill mode: offset the polygons in self.paths inwards again
+        and again, a hatch spacing at a time, adding the resulting
+        [level, ring] pairs to self.hatches in place of hatch segments
+        """
+
+        if self.options.holdBackHatchFromEdges:
+            f_first_distance = self.options.holdBackSteps
+        else:
+            f_first_distance = self.options.hatchSpacing / 2.0
+        with self.profile.phase('offsetting'):
+            for key in self.paths:
+                contours = contourRings(self.paths[key], f_first_distance, self.options.hatchSpacing,
+                                        float(self.options.tolerance / 100))
+                if contours:
+                    self.hatches[key] = contours
+
+    def hatchPendingNodes(self):
+
+        """
+        Hatch and chain the nodes collected in self.pendingNodes on a pool
+        of worker processes.  The results are merged back into self.hatches,
+        self.chainedPaths and self.chainStats, yielding each node in document
+        order as its results arrive.  Nodes whose subpaths are None already
+        had their hatches found in the hatch cache.
+        """
+
+        n_workers = self.options.workers if self.options.workers > 0 else (os.cpu_count() or 1)
+        worker_options = Namespace(**{name: getattr(self.options, name) for name in WORKER_OPTIONS})
+        pending_nodes = self.pendingNodes
+        self.pendingNodes = []
+        jobs = []
+        for (node, subpaths) in pending_nodes:
+            if subpaths is None:
+                continue
+            transform, stroke_width = self.hatchTransform(node)
+            # Transforms don't pickle, so hand the worker the bare matrix
+            matrix = transform.matrix if transform is not None else None
+            jobs.append((worker_options, subpaths, matrix, stroke_width))
+        chunk_size = max(1, len(jobs) // (n_workers * 4))
+
+        try:
+            executor = ProcessPoolExecutor(max_workers=n_workers)
+            results = executor.map(hatchSubpathsInWorker, jobs, chunksize=chunk_size)
+        except (OSError, NotImplementedError):
+            # No process pool available on this system; just do the work here
+            executor = None
+            results = map(hatchSubpathsInWorker, jobs)
+
+        try:
+            for (node, subpaths) in pending_nodes:
+                if subpaths is not None:
+                    result = next(results)
+                    if result is not None:
+                        segments, path, chain_stats = result
+                        self.hatches[node] = segments
+                        self.chainedPaths[node] = path
+                        self.chainStats.extend((node, n_segments, f_pen_up_distance)
+                                               for (n_segments, f_pen_up_distance) in chain_stats)
+                if node in self.hatches:
+                    yield node
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
     def joinFillsWithNode(self, node, stroke_width, path):
 
         """
@@ -815,6 +2395,8 @@ class Hatch_Fill(inkex.Effect):
             inverse_parent_transform = -node.getparent().composed_transform()
             hatch = etree.SubElement(g, inkex.addNS('path', 'svg'), line_attribs)
             hatch.transform = inverse_parent_transform
+            if self.options.optimizeTravel:
+                self.hatchGroups.append((g, hatch))
 
     def makeHatchGrid(self, angle, spacing, init=True):  # returns True if succeeds in making grid, else False
 
@@ -840,6 +2422,7 @@ class Hatch_Fill(inkex.Effect):
         if init:
             self.getBoundingBox()
             self.grid = []
+            self.gridFrames = []
 
         # Determine the width and height of the bounding box containing
         # all the polygons to be hatched
@@ -875,6 +2458,7 @@ class Hatch_Fill(inkex.Effect):
             # Since the spacing may be fractional (e.g., 6.5), we
             # don't try to use range() or other integer iterator
             spacing = float(abs(spacing))
+            n_first = len(self.grid)
             i = -r
             while i <= r:
                 # Line starts at (i, -r) and goes to (i, +r)
@@ -891,12 +2475,18 @@ class Hatch_Fill(inkex.Effect):
                     continue
                 self.grid.append((x1, y1, x2, y2))
 
+            # Remember the rotated frame of this family of hatch lines, and
+            # which entries of self.grid belong to it, for the scanline pass
+            self.gridFrames.append(((ca, sa, cx, cy, r), n_first, len(self.grid)))
+
         return ret_value
 
     def effect(self):
 
-        global ref_count
-        global pt_last_position_abs
+        if self.options.profile:
+            self.profile.enabled = True
+        t_start = time.perf_counter()
+
         # Viewbox handling
         self.handleViewBox()
 
@@ -906,19 +2496,262 @@ class Hatch_Fill(inkex.Effect):
         if self.options.hatchSpacing == 0:
             self.options.hatchSpacing = 0.1 # Hardcode minimum value
 
-        ref_count = 0
-        pt_last_position_abs = [0, 0]
+        if self.options.preview:
+            # Flatten more loosely, don't bother joining up the segments, and
+            # space the hatches out far enough to stay within the budget
+            self.options.tolerance *= PREVIEW_TOLERANCE_FACTOR
+            self.options.reducePenLifts = False
+            self.options.optimizeTravel = False
+            with self.profile.phase('preview_estimate'):
+                self.options.hatchSpacing *= self.previewSpacingFactor()
+
+        if self.options.useCache:
+            self.hatchCache = HatchCache(hatchCacheDirectory(), self.options.cacheSize * 1024 * 1024)
+
+        # Now, dump the hatch fills of each document element as soon as
+        # they have been computed.  This is made easy by the fact that we
+        # saved the information and used each element's lxml.etree node
+        # pointer as the dictionary key under which to save the hatch
+        # fills for that node.  Once written, the hatches of an element are
+        # dropped, so that only one element's worth is ever held at a time.
+
+        for key in self.hatchedNodes():
+            segments = self.hatches.pop(key)
+            if key in self.cacheKeys:
+                self.hatchCache.put(self.cacheKeys.pop(key),
+                                    segments.toList() if isinstance(segments, LineSegmentBuffer) else segments)
+
+            self.profile.count('nodes_hatched')
+            self.profile.count('segments', len(segments))
+
+            transform, stroke_width = self.hatchTransform(key)
+            if key in self.chainedPaths:
+                # Already chained by a worker process
+                path = self.chainedPaths.pop(key)
+            else:
+                with self.profile.phase('chaining'):
+                    path = self.chainHatches(key, segments, transform, stroke_width)
+            with self.profile.phase('joining'):
+                self.joinFillsWithNode(key, stroke_width, path)
+            self.transforms.pop(key, None)
+
+        if self.hatchCache is not None:
+            # Also remember the elements which turned out to have no hatches
+            for node in self.cacheKeys:
+                self.hatchCache.put(self.cacheKeys[node], None)
+            self.hatchCache.evict()
+
+        if self.options.optimizeTravel:
+            with self.profile.phase('travel_ordering'):
+                self.optimizeTravel()
+
+        if self.options.logChainStats:
+            self.reportChainStats()
+
+        if self.nCulled:
+            inkex.errormsg('Skipped {0} hidden or off-page objects'.format(self.nCulled))
+
+        if self.profile.enabled:
+            self.reportProfile(time.perf_counter() - t_start)
+
+    def reportProfile(self, f_total_seconds):
+
+        """
+        Write the profile of this run to the JSON file profileFile or,
+        without one, a summary of it to stderr.
+        """
+
+        report = self.profile.report(f_total_seconds)
+        if self.options.profileFile:
+            try:
+                with open(self.options.profileFile, 'w') as profile_file:
+                    json.dump(report, profile_file, indent=2, sort_keys=True)
+                return
+            except OSError as error:
+                inkex.errormsg('Unable to write the profile to {0}: {1}'.format(self.options.profileFile, error))
+        for name in HatchProfile.PHASES + ('total',):
+            inkex.errormsg('{0}: {1:.3f} s'.format(name, report['seconds'][name]))
+        for name in sorted(report['counts']):
+            inkex.errormsg('{0}: {1}'.format(name, report['counts'][name]))
+
+    def optimizeTravel(self):
 
-        # Build a list of the vertices for the document's graphical elements
+        """
+        Reorder the hatches drawn by this run so as to shorten the pen-up
+        travel between them, and report the travel before and after.
+
+        Every node hatched has been moved into a new group, together with
+        its hatch path, and these groups were added to the end of the node's
+        parent.  So the groups added to a parent follow one another, and
+        may be put in another order there.  Only where two of them overlap
+        does their order show, in which is painted on top; such a pair is
+        kept in document order.  The order of the chains (subpaths) within
+        each hatch path is free to change.  Chains and groups alike may
+        also be drawn backwards.  Since the hatch paths carry the inverse
+        of their parent's transform, their path data is in document
+        coordinates throughout.
+
+        Each parent's groups are visited in turn, going on each time to the
+        group with the chain end nearest the pen, of those groups which
+        come after no overlapping group not yet drawn.  That group's chains
+        are then ordered in the same way.  A 2-opt pass over the chains and
+        then over the groups follows, leaving alone any run of groups which
+        holds an overlapping pair.
+        """
+
+        if not self.hatchGroups:
+            return
+
+        document_order = {}
+        for n_element, element in enumerate(self.document.getroot().iter()):
+            document_order[element] = n_element
+
+        # The groups of each parent, in document order
+        parents = {}
+        for (g, hatch) in sorted(self.hatchGroups, key=lambda group: document_order[group[0]]):
+            chains = []
+            for chain in inkex.Path(hatch.get('d')).to_absolute().break_apart():
+                end_points = list(chain.end_points)
+                chains.append([chain, (end_points[0].x, end_points[0].y),
+                               (end_points[-1].x, end_points[-1].y), False])
+            if chains:
+                parents.setdefault(g.getparent(), []).append([(g, hatch, chains),
+                                                              chains[0][1], chains[-1][2], False])
+
+        f_travel_before = 0.0
+        f_travel_after = 0.0
+        pt_pen_before = (0.0, 0.0)
+        pt_pen_after = (0.0, 0.0)
+        for parent in sorted(parents, key=lambda element: document_order[parents[element][0][0][0]]):
+            groups = parents[parent]
+            chains = [chain for group in groups for chain in group[0][2]]
+            f_travel_before += travelDistance(chains, pt_pen_before)
+            pt_pen_before = chains[-1][2]
+
+            # Which groups overlap, and so must keep their order.  The
+            # hatches lie within their elements, so the element's own box,
+            # in the coordinates of the parent as the new group has no
+            # transform, stands for the group's.
+            overlaps = overlappingBoxes([group[0][0][0].bounding_box() for group in groups])
+            n_waiting = [len([n for n in overlaps[n_group] if n < n_group]) for n_group in range(len(groups))]
+
+            # Visit the groups one at a time, the nearest ready one first
+            n_chain_group = []
+            group_chains = []
+            for n_group, group in enumerate(groups):
+                group_chains.append(range(len(n_chain_group), len(n_chain_group) + len(group[0][2])))
+                n_chain_group.extend([n_group] * len(group[0][2]))
+            segments = LineSegmentBuffer()
+            for chain in chains:
+                segments.append(chain[1][0], chain[1][1], chain[2][0], chain[2][1])
+            chain_ends = SegmentEndGrid(segments, [n_chain for n_group in range(len(groups)) if n_waiting[n_group] == 0
+                                                   for n_chain in group_chains[n_group]],
+                                        travelCellSize([chain[1] for chain in chains] + [chain[2] for chain in chains]))
+            ordered_groups = []
+            pt_pen = pt_pen_after
+            while True:
+                found = chain_ends.nearest(pt_pen)
+                if found is None:
+                    break
+                n_group = n_chain_group[found[0]]
+                for n_chain in group_chains[n_group]:
+                    chain_ends.remove(n_chain)
+                for n_later in overlaps[n_group]:
+                    if n_later > n_group:
+                        n_waiting[n_later] -= 1
+                        if n_waiting[n_later] == 0:
+                            for n_chain in group_chains[n_later]:
+                                chain_ends.add(n_chain)
+                (g, hatch, ordered_chains) = groups[n_group][0]
+                ordered_chains = orderTravelItems(ordered_chains, pt_pen)
+                ordered_groups.append([(g, hatch, ordered_chains, n_group),
+                                       ordered_chains[0][1], ordered_chains[-1][2], False])
+                pt_pen = ordered_chains[-1][2]
+
+            def fReversible(run):
+                # No two groups of the run may overlap
+                n_groups = set(item[0][3] for item in run)
+                return all(not (overlaps[n_group] & n_groups) for n_group in n_groups)
+
+            twoOptTravelItems(ordered_groups, pt_pen_after, fReversible)
+
+            # Now redraw the groups in their new order
+            for ((g, hatch, ordered_chains, n_group), pt_start, pt_end, b_reversed) in ordered_groups:
+                if b_reversed:
+                    ordered_chains = ordered_chains[::-1]
+                    for chain in ordered_chains:
+                        reverseTravelItem(chain)
+                f_travel_after += travelDistance(ordered_chains, pt_pen_after)
+                pt_pen_after = ordered_chains[-1][2]
+                path_data = PathDataWriter(self.options.precision)
+                for (chain, pt_chain_start, pt_chain_end, b_chain_reversed) in ordered_chains:
+                    writePathData(path_data, chain.reverse() if b_chain_reversed else chain)
+                hatch.set('d', str(path_data))
+                parent.append(g)
+
+        inkex.errormsg('Pen-up travel between hatches: {0:.1f} before, {1:.1f} after reordering'.format(
+            f_travel_before, f_travel_after))
+
+    def previewSpacingFactor(self):
+
+        """
+        For preview mode: the whole number by which to multiply the hatch
+        spacing to keep the number of hatch segments near or below
+        previewSegments.  Every hatch line crossing an element makes at
+        least one segment, so the estimate is the number of hatch lines
+        crossing the bounding boxes of the elements to be hatched.  Using
+        a whole number keeps the preview's hatch lines a subset of the final
+        ones, so that only the density differs.
+
+        This walks the same elements recursivelyTraverseSvg() does,
+        culling the same hidden and off-page ones.  The most recently
+        flattened paths stay in self.flattenedPaths, to be reused when
+        they are hatched.
+        """
+
+        if self.options.previewSegments <= 0:
+            return 1
+
+        ca = math.cos(math.radians(90 - float(self.options.hatchAngle)))
+        sa = math.sin(math.radians(90 - float(self.options.hatchAngle)))
         if self.options.ids:
-            # Traverse the selected objects
-            for id_ in self.options.ids:
-                self.recursivelyTraverseSvg([self.svg.selected[id_]])
+            nodes = [self.svg.selected[id_] for id_ in self.options.ids]
         else:
-            # Traverse the entire document
-            self.recursivelyTraverseSvg(self.document.getroot())
+            nodes = list(self.document.getroot())
+            if self.options.cullHidden:
+                self.pageBox = self.visiblePageBox()
+
+        f_lines = 0.0
+        while nodes:
+            node = nodes.pop()
+            if self.pageBox is not None and self.isCulled(node):
+                continue
+            if node.tag in [inkex.addNS('g', 'svg'), 'g']:
+                nodes.extend(node)
+            elif node.tag in SHAPE_TAGS:
+                self.paths = {}
+                self.addPathVertices(node)
+                if node not in self.paths:
+                    continue
+                self.getBoundingBox()
+                w = self.xmax - self.xmin
+                h = self.ymax - self.ymin
+                # Extent of the bounding box across the hatch lines
+                f_lines += (abs(w * ca) + abs(h * sa)) / self.options.hatchSpacing
+                if self.options.crossHatch:
+                    f_lines += (abs(w * sa) + abs(h * ca)) / self.options.hatchSpacing
+
+        self.paths = {}
+        self.transforms = {}
+        return max(1, int(math.ceil(f_lines / self.options.previewSegments)))
+
+    def hatchTransform(self, key):
+
+        """
+        Return the inverse transform (or None) to apply to the hatches of
+        the element "key", along with the stroke width of its hatch lines.
+        """
 
-        # After recursively traversing the svg, we will have a dictionary of transforms and hatches
         # Target stroke width will be (doc width + doc height) / 2 / 1000
         # stroke_width_target = ( self.svg.height + self.svg.width ) / 2000
         # stroke_width_target = 1
@@ -936,448 +2769,531 @@ class Hatch_Fill(inkex.Effect):
         # x and y scaling factors in the transform and average them.
         s = stroke_width_target / math.sqrt(2)
 
-        # Now, dump the hatch fills sorted by which document element
-        # they correspond to.  This is made easy by the fact that we
-        # saved the information and used each element's lxml.etree node
-        # pointer as the dictionary key under which to save the hatch
-        # fills for that node.
+        if key in self.transforms:
+            transform = -Transform(self.transforms[key])
+            # Determine the scaled stroke width for a hatch line
+            # We produce a line segment of unit length, transform
+            # its endpoints and then determine the length of the
+            # resulting line segment.
+            pt1 = [0, 0]
+            pt2 = [s, s]
+            Transform(transform).apply_to_point(pt1)
+            Transform(transform).apply_to_point(pt2)
+            dx = pt2[0] - pt1[0]
+            dy = pt2[1] - pt1[1]
+            stroke_width = math.sqrt(dx * dx + dy * dy)
+        else:
+            transform = None
+            stroke_width = 1.0
 
-        abs_line_segments = {} # Absolute line segments
-        n_abs_line_segment_total = 0
-        n_pen_lifts = 0
-        # To implement
-        for key in self.hatches:
-            direction = True
-            if key in self.transforms:
-                transform = -Transform(self.transforms[key])
-                # Determine the scaled stroke width for a hatch line
-                # We produce a line segment of unit length, transform
-                # its endpoints and then determine the length of the
-                # resulting line segment.
-                pt1 = [0, 0]
-                pt2 = [s, s]
-                Transform(transform).apply_to_point(pt1)
-                Transform(transform).apply_to_point(pt2)
-                dx = pt2[0] - pt1[0]
-                dy = pt2[1] - pt1[1]
-                stroke_width = math.sqrt(dx * dx + dy * dy)
+        return transform, stroke_width
+
+    def chainHatches(self, key, segments, transform, stroke_width):
+
+        """
+        Generate the path data which draws the hatch line segments of one
+        document element.  Each family of parallel hatch lines is chained
+        on its own by chainHatchFamily(), one family after the other, so
+        that a cross-hatch segment is never joined to one at right angles
+        to it.
+
+        The hatches are written in document coordinates whatever the
+        element's transform, as the hatch path is given the inverse of its
+        parent's transform; only stroke_width depends on it.
+        """
+
+        global pt_last_position_abs
+
+        path_data = PathDataWriter(self.options.precision)  # regardless of whether or not we're reducing pen lifts
+        pt_last_position_abs = [0, 0]
+        if self.options.fillMode == 'contour':
+            self.chainContours(key, segments, stroke_width, path_data)
+            return str(path_data)
+        for family in self.hatchFamilies(segments):
+            self.chainHatchFamily(key, family, stroke_width, path_data)
+        return str(path_data)
+
+    def hatchFamilies(self, segments):
+
+        """
+        Split the hatch segments of an element into the families of
+        parallel hatch lines they belong to: just the one, unless
+        cross-hatching.  Cross-hatch segments run at right angles to the
+        hatch angle, so each segment goes with the family whose direction
+        it lies closer to.
+        """
+
+        if not self.options.crossHatch:
+            return [segments]
+
+        # Direction of the first family, as in makeHatchGrid()
+        ca = math.cos(math.radians(90 - float(self.options.hatchAngle)))
+        sa = math.sin(math.radians(90 - float(self.options.hatchAngle)))
+        hatches = LineSegmentBuffer()
+        cross_hatches = LineSegmentBuffer()
+        for n_segment in range(len(segments)):
+            (x1, y1), (x2, y2) = segments.point(n_segment, 0), segments.point(n_segment, 1)
+            if abs(ca * (y2 - y1) - sa * (x2 - x1)) >= abs(ca * (x2 - x1) + sa * (y2 - y1)):
+                hatches.append(x1, y1, x2, y2)
             else:
-                transform = None
-                stroke_width = 1.0
-
-            # The transform also applies to the hatch spacing we use when searching for end connections
-            transformed_hatch_spacing = stroke_width * self.options.hatchSpacing
-
-            path = ''  # regardless of whether or not we're reducing pen lifts
-            pt_last_position_abs = [0, 0]
-            pt_last_position_abs[0] = 0
-            pt_last_position_abs[1] = 0
-            f_distance_moved_with_pen_up = 0
-            if not self.options.reducePenLifts:
-                for segment in self.hatches[key]:
-                    if len(segment) < 2:
-                        continue
-                    pt1 = segment[0]
-                    pt2 = segment[1]
-                    # Okay, we're going to put these hatch lines into the same
-                    # group as the element they hatch.  That element is down
-                    # some chain of SVG elements, some of which may have
-                    # transforms attached.  But, our hatch lines have been
-                    # computed assuming that those transforms have already
-                    # been applied (since we had to apply them so as to know
-                    # where this element is on the page relative to other
-                    # elements and their transforms).  So, we need to invert
-                    # the transforms for this element and then either apply
-                    # that inverse transform here and now or set it in a
-                    # transform attribute of the <path> element.  Having it
-                    # set in the path element seems a bit counterintuitive
-                    # after the fact (i.e., what's this transform here for?).
-                    # So, we compute the inverse transform and apply it here.
-                    if transform is not None:
-                        Transform(transform).apply_to_point(pt1)
-                        Transform(transform).apply_to_point(pt2)
-                    # Now generate the path data for the <path>
-                    if direction:
-                        # Go this direction
-                        path += ('M {0:f},{1:f} l {2:f},{3:f} '.format(pt1[0], pt1[1], pt2[0] - pt1[0], pt2[1] - pt1[1]))
-                    else:
-                        # Or go this direction
-                        path += ('M {0:f},{1:f} l {2:f},{3:f} '.format(pt2[0], pt2[1], pt1[0] - pt2[0], pt1[1] - pt2[1]))
+                cross_hatches.append(x1, y1, x2, y2)
+        return [hatches, cross_hatches]
+
+    def chainHatchFamily(self, key, segments, stroke_width, path_data):
 
-                    direction = not direction
-                self.joinFillsWithNode(key, stroke_width, path[:-1])
+        """
+        Write the path data which draws one family of parallel hatch line
+        segments to the PathDataWriter path_data.  When reducing pen lifts, nearby segments
+        are chained together with Bezier curves.  Each chain drawn is
+        recorded in self.chainStats.
+        """
 
+        global pt_last_position_abs
+
+        # The transform also applies to the hatch spacing we use when searching for end connections
+        transformed_hatch_spacing = stroke_width * self.options.hatchSpacing
+
+        # Lay the segments out in the order they will be considered for
+        # drawing, every other one turned around.  There is no need to map
+        # them through the element's inverse transform: they are in document
+        # coordinates, and the hatch path which draws them carries the
+        # inverse of its parent's transform (see joinFillsWithNode()).
+        abs_line_segments = LineSegmentBuffer()  # Absolute line segments
+        direction = True
+        for n_segment in range(len(segments)):
+            (x1, y1), (x2, y2) = segments.point(n_segment, 0), segments.point(n_segment, 1)
+            if direction:
+                abs_line_segments.append(x1, y1, x2, y2)
             else:
-                for segment in self.hatches[key]:
-                    if len(segment) < 2:  # Copied from original, no idea why this is needed [sbm]
-                        continue
-                    if direction:
-                        pt1 = segment[0]
-                        pt2 = segment[1]
+                abs_line_segments.append(x2, y2, x1, y1)
+            direction = not direction
+        n_abs_line_segment_total = len(abs_line_segments)
+        n_pen_lifts = 0
+        f_distance_moved_with_pen_up = 0
+        if not self.options.reducePenLifts:
+            for n_segment in range(n_abs_line_segment_total):
+                pt1 = abs_line_segments.point(n_segment, 0)
+                pt2 = abs_line_segments.point(n_segment, 1)
+                path_data.moveTo(pt1[0], pt1[1])
+                path_data.lineTo(pt2[0], pt2[1])
+                f_pen_up_distance = math.hypot(pt1[0] - pt_last_position_abs[0], pt1[1] - pt_last_position_abs[1])
+                self.chainStats.append((key, 1, f_pen_up_distance))
+                pt_last_position_abs = [pt2[0], pt2[1]]
+
+        else:
+            # Now have a nice juicy buffer full of line segments with absolute coordinates
+            f_proposed_neighborhood_radius_squared = self.ProposeNeighborhoodRadiusSquared(transformed_hatch_spacing)  
+            # Just fixed and simple for now - may make function of neighborhood later
+
+            # Keep the segment ends in a spatial index, so that only nearby ones are considered for joining
+            segment_ends = SegmentEndGrid(abs_line_segments,
+                                          range(n_abs_line_segment_total),
+                                          math.sqrt(f_proposed_neighborhood_radius_squared))
+
+            for ref_count in range(n_abs_line_segment_total):  # This is the entire range of segments,
+                # Sets ref_count to segment which has an end closest to current pen position.
+                # Doesn't need to select which end is closest, as that will happen below, with n_ref_end_index.
+                # When we have gone thru this whole range, we will be completely done.
+                # We only get here again, after all _connected_ segments have been "drawn".
+                if not abs_line_segments.isDrawn(ref_count):  # Test whether this segment has been drawn
+                    # Has not been drawn yet
+
+                    # Before we do any irrevocable changes to path, let's see if we are going to be able to append any segments.
+                    # The below solution is inelegant, but has the virtue of being relatively simple to implement.
+                    # Pre-qualify this segment on the issue of whether it has any connecting segments.
+                    # If it does not, then just add the path for this one segment, and go on to the next.
+                    # If it does have connecting segments, we need to go through the chaining logic.
+                    # Lazily, again, select the desired direction of line ahead of time.
+
+                    b_found_segment_to_add = False  # default assumption
+                    n_ref_end_index_at_closest = 0
+                    f_closest_distance_squared = 123456  # just a random large number
+                    for n_ref_end_index in range(2):
+                        pt_reference = abs_line_segments.point(ref_count, n_ref_end_index)
+                        pt_reference_other_end = abs_line_segments.point(ref_count, not n_ref_end_index)
+                        f_reference_direction_radians = math.atan2(pt_reference_other_end[1] - pt_reference[1], pt_reference_other_end[0] - pt_reference[0])  # from other end to this end
+                        # The following is just a simple copy from the routine in appendNearbySegments procedure
+                        # Look through all possibilities to choose the closest that fulfills all requirements e.g. direction and colinearity
+                        # The spatial index only offers undrawn segment ends which may lie within the neighborhood
+                        for innerCount, nNewSegmentInitialEndIndex in segment_ends.near(pt_reference):
+                            # Each candidate is an undrawn segment end, so it is a candidate for a path extension
+                            # First try initial end of test segment (aka pt1) vs final end (aka pt2) of reference segment
+                            if innerCount != ref_count:  # don't investigate self ends
+                                delta_x = abs_line_segments.point(innerCount, nNewSegmentInitialEndIndex)[0] - pt_reference[0]  # proposed initial pt1 X minus existing final pt1 X
+                                delta_y = abs_line_segments.point(innerCount, nNewSegmentInitialEndIndex)[1] - pt_reference[1]  # proposed initial pt1 Y minus existing final pt1 Y
+                                if (delta_x * delta_x + delta_y * delta_y) < f_proposed_neighborhood_radius_squared:
+                                    f_this_distance_squared = delta_x * delta_x + delta_y * delta_y
+                                    pt_new_segment_this_end = abs_line_segments.point(innerCount, nNewSegmentInitialEndIndex)
+                                    pt_new_segment_other_end = abs_line_segments.point(innerCount, not nNewSegmentInitialEndIndex)
+                                    f_new_segment_direction_radians = math.atan2(pt_new_segment_this_end[1] - pt_new_segment_other_end[1], pt_new_segment_this_end[0] - pt_new_segment_other_end[0])  # from other end to this end
+                                    # If this end would cause an alternating direction,
+                                    # then exclude it
+                                    if not self.WouldBeAnAlternatingDirection(f_reference_direction_radians, f_new_segment_direction_radians):
+                                        pass
+                                    elif f_this_distance_squared < f_closest_distance_squared:
+                                        # One other thing could rule out choosing this segment end:
+                                        # Want to screen and remove two segments that, while close enough,
+                                        # should be disqualified because they are colinear.  The reason for this is that
+                                        # if they are colinear, they arose from the same global grid line, which means
+                                        # that the gap between them arises from intersections with the boundary.
+                                        # The idea here is that, all things being more-or-less equal,
+                                        # we would like to give preference to connecting to a segment
+                                        # which is the reverse of our current direction.  This makes for better
+                                        # bezier curve join.
+                                        # The criterion for being colinear is that the reference segment angle is effectively
+                                        # the same as the line connecting the reference segment to the end of the new segment.
+                                        f_joiner_direction_radians = math.atan2(pt_new_segment_this_end[1] - pt_reference[1], pt_new_segment_this_end[0] - pt_reference[0])
+                                        if not self.AreCoLinear(f_reference_direction_radians, f_joiner_direction_radians):
+                                            # not colinear
+                                            f_closest_distance_squared = f_this_distance_squared
+                                            b_found_segment_to_add = True
+                                            n_ref_end_index_at_closest = n_ref_end_index
+
+                    # At last we've looked at all the candidate segment ends, as related to all the reference ends
+                    if not b_found_segment_to_add:
+                        # This segment is solitary.
+                        # Must start a new line, not joined to any previous paths
+                        delta_x = abs_line_segments.point(ref_count, 1)[0] - abs_line_segments.point(ref_count, 0)[0]  # end minus start, in original direction
+                        delta_y = abs_line_segments.point(ref_count, 1)[1] - abs_line_segments.point(ref_count, 0)[1]  # end minus start, in original direction
+                        path_data.moveTo(abs_line_segments.point(ref_count, 0)[0], abs_line_segments.point(ref_count, 0)[1])
+                        path_data.lineBy(delta_x, delta_y)  # delta is from initial point
+                        f_pen_up_distance = math.hypot(
+                                abs_line_segments.point(ref_count, 0)[0] - pt_last_position_abs[0],
+                                abs_line_segments.point(ref_count, 0)[1] - pt_last_position_abs[1])
+                        f_distance_moved_with_pen_up += f_pen_up_distance
+                        self.chainStats.append((key, 1, f_pen_up_distance))
+                        pt_last_position_abs[0] = abs_line_segments.point(ref_count, 0)[0] + delta_x
+                        pt_last_position_abs[1] = abs_line_segments.point(ref_count, 0)[1] + delta_y
+                        abs_line_segments.setDrawn(ref_count)  # True flags that this line segment has been
+                        # added to the path to be drawn, so should
+                        # no longer be a candidate for any kind of move.
+                        segment_ends.remove(ref_count)
+                        n_pen_lifts += 1
                     else:
-                        pt1 = segment[1]
-                        pt2 = segment[0]
-                    # Okay, we're going to put these hatch lines into the same
-                    # group as the element they hatch.  That element is down
-                    # some chain of SVG elements, some of which may have
-                    # transforms attached.  But, our hatch lines have been
-                    # computed assuming that those transforms have already
-                    # been applied (since we had to apply them so as to know
-                    # where this element is on the page relative to other
-                    # elements and their transforms).  So, we need to invert
-                    # the transforms for this element and then either apply
-                    # that inverse transform here and now or set it in a
-                    # transform attribute of the <path> element.  Having it
-                    # set in the path element seems a bit counterintuitive
-                    # after the fact (i.e., what's this transform here for?).
-                    # So, we compute the inverse transform and apply it here.
-                    if transform is not None:
-                        Transform(transform).apply_to_point(pt1)
-                        Transform(transform).apply_to_point(pt2)
-
-                    # Now generate the path data for the <path>
-                    # BUT we want to combine as many paths as possible to reduce pen lifts.
-                    # In order to combine paths, we need to know all of the path segments.
-                    # The solution to this conundrum is to generate all path segments,
-                    # but instead of drawing them into the path right away, we put them in
-                    # an array where they'll be available for random access
-                    # by our anti-pen-lift algorithm
-                    abs_line_segments[n_abs_line_segment_total] = [pt1, pt2, False]  # False indicates that segment has not yet been drawn
-                    n_abs_line_segment_total += 1
-                    direction = not direction
-
-                # Now have a nice juicy buffer full of line segments with absolute coordinates
-                f_proposed_neighborhood_radius_squared = self.ProposeNeighborhoodRadiusSquared(transformed_hatch_spacing)  
-                # Just fixed and simple for now - may make function of neighborhood later
-                
-                for ref_count in range(n_abs_line_segment_total):  # This is the entire range of segments,
-                    # Sets global ref_count to segment which has an end closest to current pen position.
-                    # Doesn't need to select which end is closest, as that will happen below, with n_ref_end_index.
-                    # When we have gone thru this whole range, we will be completely done.
-                    # We only get here again, after all _connected_ segments have been "drawn".
-                    if not abs_line_segments[ref_count][2]:  # Test whether this segment has been drawn
-                        # Has not been drawn yet
-
-                        # Before we do any irrevocable changes to path, let's see if we are going to be able to append any segments.
-                        # The below solution is inelegant, but has the virtue of being relatively simple to implement.
-                        # Pre-qualify this segment on the issue of whether it has any connecting segments.
-                        # If it does not, then just add the path for this one segment, and go on to the next.
-                        # If it does have connecting segments, we need to go through the recursive logic.
-                        # Lazily, again, select the desired direction of line ahead of time.
-
-                        b_found_segment_to_add = False  # default assumption
-                        n_ref_end_index_at_closest = 0
-                        f_closest_distance_squared = 123456  # just a random large number
-                        for n_ref_end_index in range(2):
-                            pt_reference = abs_line_segments[ref_count][n_ref_end_index]
-                            pt_reference_other_end = abs_line_segments[ref_count][not n_ref_end_index]
-                            f_reference_direction_radians = math.atan2(pt_reference_other_end[1] - pt_reference[1], pt_reference_other_end[0] - pt_reference[0])  # from other end to this end
-                            # The following is just a simple copy from the routine in recursivelyAppendNearbySegments procedure
-                            # Look through all possibilities to choose the closest that fulfills all requirements e.g. direction and colinearity
-                            for innerCount in range(n_abs_line_segment_total):  # investigate all segments
-                                if not abs_line_segments[innerCount][2]:
-                                    # This segment currently undrawn, so it is a candidate for a path extension
-                                    # Need to check both ends of each and every proposed segment so we can find the most appropriate one
-                                    # Define pt2 in the reference as the end which we want to extend
-                                    for nNewSegmentInitialEndIndex in range(2):
-                                        # First try initial end of test segment (aka pt1) vs final end (aka pt2) of reference segment
-                                        if innerCount != ref_count:  # don't investigate self ends
-                                            delta_x = abs_line_segments[innerCount][nNewSegmentInitialEndIndex][0] - pt_reference[0]  # proposed initial pt1 X minus existing final pt1 X
-                                            delta_y = abs_line_segments[innerCount][nNewSegmentInitialEndIndex][1] - pt_reference[1]  # proposed initial pt1 Y minus existing final pt1 Y
-                                            if (delta_x * delta_x + delta_y * delta_y) < f_proposed_neighborhood_radius_squared:
-                                                f_this_distance_squared = delta_x * delta_x + delta_y * delta_y
-                                                pt_new_segment_this_end = abs_line_segments[innerCount][nNewSegmentInitialEndIndex]
-                                                pt_new_segment_other_end = abs_line_segments[innerCount][not nNewSegmentInitialEndIndex]
-                                                f_new_segment_direction_radians = math.atan2(pt_new_segment_this_end[1] - pt_new_segment_other_end[1], pt_new_segment_this_end[0] - pt_new_segment_other_end[0])  # from other end to this end
-                                                # If this end would cause an alternating direction,
-                                                # then exclude it
-                                                if not self.WouldBeAnAlternatingDirection(f_reference_direction_radians, f_new_segment_direction_radians):
-                                                    pass
-                                                elif f_this_distance_squared < f_closest_distance_squared:
-                                                    # One other thing could rule out choosing this segment end:
-                                                    # Want to screen and remove two segments that, while close enough,
-                                                    # should be disqualified because they are colinear.  The reason for this is that
-                                                    # if they are colinear, they arose from the same global grid line, which means
-                                                    # that the gap between them arises from intersections with the boundary.
-                                                    # The idea here is that, all things being more-or-less equal,
-                                                    # we would like to give preference to connecting to a segment
-                                                    # which is the reverse of our current direction.  This makes for better
-                                                    # bezier curve join.
-                                                    # The criterion for being colinear is that the reference segment angle is effectively
-                                                    # the same as the line connecting the reference segment to the end of the new segment.
-                                                    f_joiner_direction_radians = math.atan2(pt_new_segment_this_end[1] - pt_reference[1], pt_new_segment_this_end[0] - pt_reference[0])
-                                                    if not self.AreCoLinear(f_reference_direction_radians, f_joiner_direction_radians):
-                                                        # not colinear
-                                                        f_closest_distance_squared = f_this_distance_squared
-                                                        b_found_segment_to_add = True
-                                                        n_ref_end_index_at_closest = n_ref_end_index
-
-                        # At last we've looked at all the candidate segment ends, as related to all the reference ends
-                        if not b_found_segment_to_add:
-                            # This segment is solitary.
-                            # Must start a new line, not joined to any previous paths
-                            delta_x = abs_line_segments[ref_count][1][0] - abs_line_segments[ref_count][0][0]  # end minus start, in original direction
-                            delta_y = abs_line_segments[ref_count][1][1] - abs_line_segments[ref_count][0][1]  # end minus start, in original direction
-                            path += ('M {0:f},{1:f} l {2:f},{3:f} '.format(abs_line_segments[ref_count][0][0],
-                                                                           abs_line_segments[ref_count][0][1],
-                                                                           delta_x,
-                                                                           delta_y))  # delta is from initial point
-                            f_distance_moved_with_pen_up += math.hypot(
-                                    abs_line_segments[ref_count][0][0] - pt_last_position_abs[0],
-                                    abs_line_segments[ref_count][0][1] - pt_last_position_abs[1])
-                            pt_last_position_abs[0] = abs_line_segments[ref_count][0][0] + delta_x
-                            pt_last_position_abs[1] = abs_line_segments[ref_count][0][1] + delta_y
-                            abs_line_segments[ref_count][2] = True  # True flags that this line segment has been
-                            # added to the path to be drawn, so should
-                            # no longer be a candidate for any kind of move.
-                            n_pen_lifts += 1
-                        else:
-                            # Found segment to add, and we must get to it in absolute terms
-                            delta_x = (abs_line_segments[ref_count][n_ref_end_index_at_closest][0] -
-                                       abs_line_segments[ref_count][not n_ref_end_index_at_closest][0])
-                            # final point (which was closer to the closest continuation segment) minus initial point = delta_x
-
-                            delta_y = (abs_line_segments[ref_count][n_ref_end_index_at_closest][1] -
-                                       abs_line_segments[ref_count][not n_ref_end_index_at_closest][1])
-                            # final point (which was closer to the closest continuation segment) minus initial point = delta_y
-
-                            path += ('M {0:f},{1:f} l '.format(abs_line_segments[ref_count][not n_ref_end_index_at_closest][0],
-                                                               abs_line_segments[ref_count][not n_ref_end_index_at_closest][1]))
-                            f_distance_moved_with_pen_up += math.hypot(
-                                    abs_line_segments[ref_count][not n_ref_end_index_at_closest][0] - pt_last_position_abs[0],
-                                    abs_line_segments[ref_count][not n_ref_end_index_at_closest][1] - pt_last_position_abs[1])
-                            pt_last_position_abs[0] = abs_line_segments[ref_count][not n_ref_end_index_at_closest][0]
-                            pt_last_position_abs[1] = abs_line_segments[ref_count][not n_ref_end_index_at_closest][1]
-                            # Note that this does not complete the line, as the completion (the delta_x, delta_y part) is being held in abeyance
-
-                            # We are coming up on a problem:
-                            # If we add a curve to the end of the line, we have made the curve extend beyond the end of the line,
-                            # and thus beyond the boundaries we should be respecting.
-                            # The solution is to hold in abeyance the actual plotting of the line,
-                            # holding it available for shrinking if a curve is to be added.
-                            # That is
-                            relative_held_line_pos = {0: delta_x, 1: delta_y}
-                            # delta is from initial point
-                            # Will be printed after we know if it must be modified
-                            # to keep the ending join within bounds
-                            pt_last_position_abs[0] += delta_x
-                            pt_last_position_abs[1] += delta_y
-
-                            abs_line_segments[ref_count][2] = True  # True flags that this line segment has been
-                            # added to the path to be drawn, so should
-                            # no longer be a candidate for any kind of move.
-                            n_pen_lifts += 1
-                            # Now comes the speedup logic:
-                            # We've just drawn a segment starting at an absolute, not relative, position.
-                            # It was drawn from pt1 to pt2.
-                            # Look for an as-yet-not-drawn segment which has a beginning or ending
-                            # point "near" the end point of this absolute draw, and leave the pen down
-                            # while moving to and then drawing this found line.
-                            # Do this recursively, marking each segment True to show that
-                            # it has been "drawn" already.
-                            # pt2 is the reference point, ie. the point from which the next segment will start
-                            path = self.recursivelyAppendNearbySegments(transformed_hatch_spacing,
-                                                                            0,
-                                                                            ref_count,
-                                                                            n_ref_end_index_at_closest,
-                                                                            n_abs_line_segment_total,
-                                                                            abs_line_segments,
-                                                                            path,
-                                                                            relative_held_line_pos)
-
-                self.joinFillsWithNode(key, stroke_width, path[:-1])
-
-    def recursivelyAppendNearbySegments(self,
-                                            transformed_hatch_spacing,
-                                            n_recursion_count,
-                                            n_ref_segment_count,
-                                            n_ref_end_index,
-                                            n_abs_line_segment_total,
-                                            abs_line_segments,
-                                            cumulative_path,
-                                            relative_held_line_pos):
+                        # Found segment to add, and we must get to it in absolute terms
+                        delta_x = (abs_line_segments.point(ref_count, n_ref_end_index_at_closest)[0] -
+                                   abs_line_segments.point(ref_count, not n_ref_end_index_at_closest)[0])
+                        # final point (which was closer to the closest continuation segment) minus initial point = delta_x
+
+                        delta_y = (abs_line_segments.point(ref_count, n_ref_end_index_at_closest)[1] -
+                                   abs_line_segments.point(ref_count, not n_ref_end_index_at_closest)[1])
+                        # final point (which was closer to the closest continuation segment) minus initial point = delta_y
+
+                        path_data.moveTo(abs_line_segments.point(ref_count, not n_ref_end_index_at_closest)[0],
+                                         abs_line_segments.point(ref_count, not n_ref_end_index_at_closest)[1])
+                        f_pen_up_distance = math.hypot(
+                                abs_line_segments.point(ref_count, not n_ref_end_index_at_closest)[0] - pt_last_position_abs[0],
+                                abs_line_segments.point(ref_count, not n_ref_end_index_at_closest)[1] - pt_last_position_abs[1])
+                        f_distance_moved_with_pen_up += f_pen_up_distance
+                        pt_last_position_abs[0] = abs_line_segments.point(ref_count, not n_ref_end_index_at_closest)[0]
+                        pt_last_position_abs[1] = abs_line_segments.point(ref_count, not n_ref_end_index_at_closest)[1]
+                        # Note that this does not complete the line, as the completion (the delta_x, delta_y part) is being held in abeyance
+
+                        # We are coming up on a problem:
+                        # If we add a curve to the end of the line, we have made the curve extend beyond the end of the line,
+                        # and thus beyond the boundaries we should be respecting.
+                        # The solution is to hold in abeyance the actual plotting of the line,
+                        # holding it available for shrinking if a curve is to be added.
+                        # That is
+                        relative_held_line_pos = {0: delta_x, 1: delta_y}
+                        # delta is from initial point
+                        # Will be printed after we know if it must be modified
+                        # to keep the ending join within bounds
+                        pt_last_position_abs[0] += delta_x
+                        pt_last_position_abs[1] += delta_y
+
+                        abs_line_segments.setDrawn(ref_count)  # True flags that this line segment has been
+                        # added to the path to be drawn, so should
+                        # no longer be a candidate for any kind of move.
+                        segment_ends.remove(ref_count)
+                        n_pen_lifts += 1
+                        # Now comes the speedup logic:
+                        # We've just drawn a segment starting at an absolute, not relative, position.
+                        # It was drawn from pt1 to pt2.
+                        # Look for an as-yet-not-drawn segment which has a beginning or ending
+                        # point "near" the end point of this absolute draw, and leave the pen down
+                        # while moving to and then drawing this found line.
+                        # Keep doing this, marking each segment True to show that
+                        # it has been "drawn" already.
+                        # pt2 is the reference point, ie. the point from which the next segment will start
+                        n_segments_joined = self.appendNearbySegments(transformed_hatch_spacing,
+                                                                      ref_count,
+                                                                      n_ref_end_index_at_closest,
+                                                                      abs_line_segments,
+                                                                      path_data,
+                                                                      relative_held_line_pos,
+                                                                      segment_ends)
+                        self.chainStats.append((key, 1 + n_segments_joined, f_pen_up_distance))
+
+    def chainContours(self, key, contours, stroke_width, path_data):
+
+        """
+        Write the path data which draws the [level, ring] contours of one
+        document element to the PathDataWriter path_data.  Each ring is
+        drawn whole, ending where it started.  When reducing pen lifts,
+        the pen then stays down for a short, straight link to the nearest
+        point of a ring one level further in, provided that it is within
+        range and crosses neither level, so that the rings of a simple
+        shape are drawn as a single spiral.  Otherwise the pen lifts and
+        goes to the nearest ring of the outermost level left.  Each chain
+        of rings drawn is recorded in self.chainStats.
+        """
+
+        global pt_last_position_abs
+
+        levels = {}
+        for (n_level, ring) in contours:
+            levels.setdefault(n_level, []).append(ring)
+        f_link_range_squared = (self.options.hatchScope * stroke_width * self.options.hatchSpacing) ** 2
+        # Every ring of each level, drawn or not, for checking the links
+        level_rings = dict((n_level, list(rings)) for (n_level, rings) in levels.items())
+
+        while levels:
+            # Pen up to the nearest ring of the outermost level
+            n_level = min(levels)
+            rings = levels[n_level]
+            f_distance_squared, i, pt, n_ring = min(
+                    nearestPointOnRing(ring, pt_last_position_abs) + (n_ring,) for (n_ring, ring) in enumerate(rings))
+            original_ring = rings.pop(n_ring)
+            ring = ringStartingAt(original_ring, i, pt)
+            f_pen_up_distance = math.sqrt(f_distance_squared)
+            path_data.moveTo(pt[0], pt[1])
+            n_rings_joined = 0
+            while True:
+                for vertex in ring[1:] + ring[:1]:
+                    path_data.lineTo(vertex[0], vertex[1])
+                pt_last_position_abs = [ring[0][0], ring[0][1]]
+                n_rings_joined += 1
+                if not levels[n_level]:
+                    del levels[n_level]
+                if not self.options.reducePenLifts or n_level + 1 not in levels:
+                    break
+
+                # Link to the nearest ring one level in, if close enough
+                rings = levels[n_level + 1]
+                f_distance_squared, i, pt, n_ring = min(
+                        nearestPointOnRing(ring, pt_last_position_abs) + (n_ring,) for (n_ring, ring) in enumerate(rings))
+                if f_distance_squared > f_link_range_squared:
+                    break
+                next_ring = ringStartingAt(rings[n_ring], i, pt)
+                other_rings = [other for other in level_rings[n_level] + level_rings[n_level + 1]
+                               if other is not original_ring and other is not rings[n_ring]]
+                if linkCrossesRings(ring[0], pt, [ring, next_ring] + other_rings):
+                    break
+                original_ring = rings.pop(n_ring)
+                ring = next_ring
+                n_level += 1
+                path_data.lineTo(pt[0], pt[1])
+            self.chainStats.append((key, n_rings_joined, f_pen_up_distance))
+
+    def reportChainStats(self):
+
+        """
+        Write a summary of the chains drawn for each node to stderr:
+        the number of chains (i.e., pen lifts), the number of segments
+        in the longest chain and the total distance moved with the pen up.
+        """
+
+        summary = {}
+        for (node, n_segments, f_pen_up_distance) in self.chainStats:
+            n_chains, n_segments_total, n_longest, f_pen_up_total = summary.get(node, (0, 0, 0, 0.0))
+            summary[node] = (n_chains + 1, n_segments_total + n_segments,
+                             max(n_longest, n_segments), f_pen_up_total + f_pen_up_distance)
+        for node in summary:
+            n_chains, n_segments_total, n_longest, f_pen_up_total = summary[node]
+            inkex.errormsg('{0}: {1} segments in {2} chains (longest {3}), pen-up distance {4:.3f}'.format(
+                node.get_id(), n_segments_total, n_chains, n_longest, f_pen_up_total))
+
+    def appendNearbySegments(self,
+                             transformed_hatch_spacing,
+                             n_ref_segment_count,
+                             n_ref_end_index,
+                             abs_line_segments,
+                             path_data,
+                             relative_held_line_pos,
+                             segment_ends):
+
+        """
+        Starting from the segment n_ref_segment_count, just drawn towards its
+        end n_ref_end_index, keep joining the closest suitable undrawn segment
+        with a Bezier curve for as long as one can be found.  The path data
+        is written to path_data, and the number of segments joined onto
+        the chain is returned.
+
+        This is a plain loop, so a chain may grow to any length: the drawn
+        segment simply becomes the reference segment for the next pass.
+        """
 
         global pt_last_position_abs
         f_proposed_neighborhood_radius_squared = self.ProposeNeighborhoodRadiusSquared(transformed_hatch_spacing)
+        n_segments_joined = 0
 
-        # Look through all possibilities to choose the closest
-        b_found_segment_to_add = False  # default assumption
-        n_new_segment_end1_index_at_closest = 0
-        n_outer_count_at_closest = -1
-        f_closest_distance_squared = 123456789.0  # just a random large number
-
-        pt_reference = abs_line_segments[n_ref_segment_count][n_ref_end_index]
-        pt_reference_other_end = abs_line_segments[n_ref_segment_count][not n_ref_end_index]
-        f_reference_delta_x = pt_reference_other_end[0] - pt_reference[0]
-        f_reference_delta_y = pt_reference_other_end[1] - pt_reference[1]
-        f_reference_direction_radians = math.atan2(f_reference_delta_y, f_reference_delta_x)  # from other end to this end
-
-        for outerCount in range(n_abs_line_segment_total):  # investigate all segments
-            if not abs_line_segments[outerCount][2]:
-                # This segment currently undrawn, so it is a candidate for a path extension
-
-                # Need to check both ends of each and every proposed segment until we find one in the neighborhood
-                # Defines pt2 in the reference as the end which we want to extend
-
-                for n_new_segment_end1_index in range(2):
-                    # First try initial end of test segment (aka pt1) vs final end (aka pt2) of reference segment
-                    if outerCount != n_ref_segment_count:  # don't investigate self ends
-                        delta_x = abs_line_segments[outerCount][n_new_segment_end1_index][0] - pt_reference[0]  # proposed initial pt1 X minus existing final pt1 X
-                        delta_y = abs_line_segments[outerCount][n_new_segment_end1_index][1] - pt_reference[1]  # proposed initial pt1 Y minus existing final pt1 Y
-                        if (delta_x * delta_x + delta_y * delta_y) < f_proposed_neighborhood_radius_squared:
-                            f_this_distance_squared = delta_x * delta_x + delta_y * delta_y
-                            pt_new_segment_this_end = abs_line_segments[outerCount][n_new_segment_end1_index]
-                            pt_new_segment_other_end = abs_line_segments[outerCount][not n_new_segment_end1_index]
-                            f_new_segment_Dx = pt_new_segment_this_end[0] - pt_new_segment_other_end[0]
-                            f_new_segment_Dy = pt_new_segment_this_end[1] - pt_new_segment_other_end[1]
-                            f_new_segment_direction_radians = math.atan2(f_new_segment_Dy, f_new_segment_Dx)  # from other end to this end
-                            if not self.WouldBeAnAlternatingDirection(f_reference_direction_radians, f_new_segment_direction_radians):
-                                # If this end would cause an alternating direction,
-                                # then exclude it regardless of how close it is
-                                pass
-
-                            elif f_this_distance_squared < f_closest_distance_squared:
-                                # One other thing could rule out choosing this segment end:
-                                # Want to screen and remove two segments that, while close enough,
-                                # should be disqualified because they are colinear.  The reason for this is that
-                                # if they are colinear, they arose from the same global grid line, which means
-                                # that the gap between them arises from intersections with the boundary.
-                                # The idea here is that, all things being more-or-less equal,
-                                # we would like to give preference to connecting to a segment
-                                # which is the reverse of our current direction.  This makes for better
-                                # bezier curve join.
-                                # The criterion for being colinear is that the reference segment angle is effectively
-                                # the same as the line connecting the reference segment to the end of the new segment.
-
-                                f_joiner_direction_radians = math.atan2(pt_new_segment_this_end[1] - pt_reference[1], pt_new_segment_this_end[0] - pt_reference[0])
-                                if not self.AreCoLinear(f_reference_direction_radians, f_joiner_direction_radians):
-                                    # not colinear
-                                    f_closest_distance_squared = f_this_distance_squared
-                                    b_found_segment_to_add = True
-                                    n_new_segment_end1_index_at_closest = n_new_segment_end1_index
-                                    n_outer_count_at_closest = outerCount
-                                    delta_x_at_closest = delta_x
-                                    delta_y_at_closest = delta_y
-
-        # At last we've looked at all the candidate segment ends
-        n_recursion_count += 1
-        if not b_found_segment_to_add or n_recursion_count >= RECURSION_LIMIT:
-            cumulative_path += '{0:f},{1:f} '.format(relative_held_line_pos[0],
-                                                     relative_held_line_pos[1])  # close out this segment
-            pt_last_position_abs[0] += relative_held_line_pos[0]
-            pt_last_position_abs[1] += relative_held_line_pos[1]
-            return cumulative_path  # No undrawn segments were suitable for appending,
-            # or there were so many that we worry about python recursion limit
-        else:
-            n_new_segment_end1_index = n_new_segment_end1_index_at_closest
-            n_new_segment_end2_index = not n_new_segment_end1_index
-            # n_new_segment_end1_index is 0 for connecting to pt1,
-            # and is 1 for connecting to pt2
-            count = n_outer_count_at_closest  # count is the index of the segment to be appended.
-            delta_x = delta_x_at_closest  # delta from final end of incoming segment to initial end of outgoing segment
-            delta_y = delta_y_at_closest
-
-            # First, move pen to initial end (may be either its pt1 or its pt2) of new segment
-
-            # Insert a bezier curve for this transition element
-            # To accomplish this, we need information on the incoming and outgoing segments.
-            # Specifically, we need to know the lengths and angles of the segments in
-            # order to decide on control points.
-            f_in_Dx = abs_line_segments[n_ref_segment_count][n_ref_end_index][0] - abs_line_segments[n_ref_segment_count][not n_ref_end_index][0]
-            f_in_Dy = abs_line_segments[n_ref_segment_count][n_ref_end_index][1] - abs_line_segments[n_ref_segment_count][not n_ref_end_index][1]
-            # The outgoing deltas are based on the reverse direction of the segment, i.e. the segment pointing back to the joiner bezier curve
-            f_out_Dx = abs_line_segments[count][n_new_segment_end1_index][0] - abs_line_segments[count][n_new_segment_end2_index][0]  # index is [count][start point = 0, final point = 1][0=x, 1=y]
-            f_out_Dy = abs_line_segments[count][n_new_segment_end1_index][1] - abs_line_segments[count][n_new_segment_end2_index][1]
-
-            length_of_incoming = math.hypot(f_in_Dx, f_in_Dy)
-            length_of_outgoing = math.hypot(f_out_Dx, f_out_Dy)
-
-            # We are going to trim-up the ends of the incoming and outgoing segments,
-            # in order to get a curve which reliably does not extend beyond the boundary.
-            # Crude readings from inkscape on bezier curve overshoot, using control points extended hatch-spacing distance parallel to segment:
-            # when end points are in line, overshoot 12/16 in direction of segment
-            #          when at 45 degrees, overshoot 12/16 in direction of segment
-            #          when at 60 degrees, overshoot 12/16 in direction of segment
-            # Conclusion, at any angle, remove 0.75 * hatch spacing from the length of both lines,
-            # where 0.75 is, by no coincidence, BEZIER_OVERSHOOT_MULTIPLIER
-
-            # If hatches are getting quite short, we can use a smaller Bezier loop at
-            # the end to squeeze into smaller spaces.  We'll use a normal nice smooth
-            # curve for non-short hatches
-            f_desired_shorten_for_smoothest_join = transformed_hatch_spacing * BEZIER_OVERSHOOT_MULTIPLIER  # This is what we really want to use for smooth curves
-            # Separately check incoming vs outgoing lengths to see if bezier distances must be reduced,
-            # then choose greatest reduction to apply to both - lest we go off-course
-            # Finally, clip reduction to be no less than 1.0
-            f_control_point_divider_incoming = 2.0 * f_desired_shorten_for_smoothest_join / length_of_incoming
-            f_control_point_divider_outgoing = 2.0 * f_desired_shorten_for_smoothest_join / length_of_outgoing
-            if f_control_point_divider_incoming > f_control_point_divider_outgoing:
-                f_largest_desired_control_point_divider = f_control_point_divider_incoming
-            else:
-                f_largest_desired_control_point_divider = f_control_point_divider_outgoing
-            if f_largest_desired_control_point_divider < 1.0:
-                f_control_point_divider = 1.0
+        while True:
+            # Look through all possibilities to choose the closest
+            b_found_segment_to_add = False  # default assumption
+            n_new_segment_end1_index_at_closest = 0
+            n_outer_count_at_closest = -1
+            f_closest_distance_squared = 123456789.0  # just a random large number
+
+            pt_reference = abs_line_segments.point(n_ref_segment_count, n_ref_end_index)
+            pt_reference_other_end = abs_line_segments.point(n_ref_segment_count, not n_ref_end_index)
+            f_reference_delta_x = pt_reference_other_end[0] - pt_reference[0]
+            f_reference_delta_y = pt_reference_other_end[1] - pt_reference[1]
+            f_reference_direction_radians = math.atan2(f_reference_delta_y, f_reference_delta_x)  # from other end to this end
+
+            # The spatial index only offers the undrawn segment ends which may lie within the neighborhood
+            for outerCount, n_new_segment_end1_index in segment_ends.near(pt_reference):
+                # Each candidate is an undrawn segment end, so it is a candidate for a path extension
+                # First try initial end of test segment (aka pt1) vs final end (aka pt2) of reference segment
+                if outerCount != n_ref_segment_count:  # don't investigate self ends
+                    delta_x = abs_line_segments.point(outerCount, n_new_segment_end1_index)[0] - pt_reference[0]  # proposed initial pt1 X minus existing final pt1 X
+                    delta_y = abs_line_segments.point(outerCount, n_new_segment_end1_index)[1] - pt_reference[1]  # proposed initial pt1 Y minus existing final pt1 Y
+                    if (delta_x * delta_x + delta_y * delta_y) < f_proposed_neighborhood_radius_squared:
+                        f_this_distance_squared = delta_x * delta_x + delta_y * delta_y
+                        pt_new_segment_this_end = abs_line_segments.point(outerCount, n_new_segment_end1_index)
+                        pt_new_segment_other_end = abs_line_segments.point(outerCount, not n_new_segment_end1_index)
+                        f_new_segment_Dx = pt_new_segment_this_end[0] - pt_new_segment_other_end[0]
+                        f_new_segment_Dy = pt_new_segment_this_end[1] - pt_new_segment_other_end[1]
+                        f_new_segment_direction_radians = math.atan2(f_new_segment_Dy, f_new_segment_Dx)  # from other end to this end
+                        if not self.WouldBeAnAlternatingDirection(f_reference_direction_radians, f_new_segment_direction_radians):
+                            # If this end would cause an alternating direction,
+                            # then exclude it regardless of how close it is
+                            pass
+
+                        elif f_this_distance_squared < f_closest_distance_squared:
+                            # One other thing could rule out choosing this segment end:
+                            # Want to screen and remove two segments that, while close enough,
+                            # should be disqualified because they are colinear.  The reason for this is that
+                            # if they are colinear, they arose from the same global grid line, which means
+                            # that the gap between them arises from intersections with the boundary.
+                            # The idea here is that, all things being more-or-less equal,
+                            # we would like to give preference to connecting to a segment
+                            # which is the reverse of our current direction.  This makes for better
+                            # bezier curve join.
+                            # The criterion for being colinear is that the reference segment angle is effectively
+                            # the same as the line connecting the reference segment to the end of the new segment.
+
+                            f_joiner_direction_radians = math.atan2(pt_new_segment_this_end[1] - pt_reference[1], pt_new_segment_this_end[0] - pt_reference[0])
+                            if not self.AreCoLinear(f_reference_direction_radians, f_joiner_direction_radians):
+                                # not colinear
+                                f_closest_distance_squared = f_this_distance_squared
+                                b_found_segment_to_add = True
+                                n_new_segment_end1_index_at_closest = n_new_segment_end1_index
+                                n_outer_count_at_closest = outerCount
+                                delta_x_at_closest = delta_x
+                                delta_y_at_closest = delta_y
+
+            # At last we've looked at all the candidate segment ends
+            if not b_found_segment_to_add:
+                path_data.lineBy(relative_held_line_pos[0], relative_held_line_pos[1])  # close out this segment
+                pt_last_position_abs[0] += relative_held_line_pos[0]
+                pt_last_position_abs[1] += relative_held_line_pos[1]
+                return n_segments_joined  # No undrawn segments were suitable for appending
             else:
-                f_control_point_divider = f_largest_desired_control_point_divider
-            f_desired_shorten = f_desired_shorten_for_smoothest_join / f_control_point_divider
-
-            pt_delta_to_subtract_from_incoming_end = self.RelativeControlPointPosition(f_desired_shorten, f_in_Dx, f_in_Dy, 0, 0)
-            # Note that this will be subtracted from the _point held in abeyance_.
-            relative_held_line_pos[0] -= pt_delta_to_subtract_from_incoming_end[0]
-            relative_held_line_pos[1] -= pt_delta_to_subtract_from_incoming_end[1]
-
-            pt_delta_to_add_to_outgoing_start = self.RelativeControlPointPosition(f_desired_shorten, f_out_Dx, f_out_Dy, 0, 0)
-
-            # We know that when we tack on a curve, we must chop some off the end of the incoming segment,
-            # and also chop some off the start of the outgoing segment.
-            # Now, we know we want the control points to be on a projection of each segment,
-            # in order that there be no abrupt change of plotting angle.  The question is, how
-            # far beyond the endpoint should we place the control point.
-            pt_relative_control_point_in = self.RelativeControlPointPosition(
-                    transformed_hatch_spacing / f_control_point_divider,
-                    f_in_Dx,
-                    f_in_Dy,
-                    0,
-                    0)
-            pt_relative_control_point_out = self.RelativeControlPointPosition(
-                    transformed_hatch_spacing / f_control_point_divider,
-                    f_out_Dx,
-                    f_out_Dy,
-                    delta_x,
-                    delta_y)
-
-            cumulative_path += '{0:f},{1:f} '.format(relative_held_line_pos[0],
-                                                     relative_held_line_pos[1])  # close out this segment, which has been modified
-            pt_last_position_abs[0] += relative_held_line_pos[0]
-            pt_last_position_abs[1] += relative_held_line_pos[1]
-            # add bezier cubic curve
-            cumulative_path += ('c {0:f},{1:f} {2:f},{3:f} {4:f},{5:f} l '.format(pt_relative_control_point_in[0],
-                                                                                  pt_relative_control_point_in[1],
-                                                                                  pt_relative_control_point_out[0],
-                                                                                  pt_relative_control_point_out[1],
-                                                                                  delta_x,
-                                                                                  delta_y))
-            pt_last_position_abs[0] += delta_x
-            pt_last_position_abs[1] += delta_y
-            # Next, move pen in appropriate direction to draw the new segment, given that
-            # we have just moved to the initial end of the new segment.
-            # This needs special treatment, as we just did some length changing.
-            delta_x = abs_line_segments[count][n_new_segment_end2_index][0] - abs_line_segments[count][n_new_segment_end1_index][0] + pt_delta_to_add_to_outgoing_start[0]
-            delta_y = abs_line_segments[count][n_new_segment_end2_index][1] - abs_line_segments[count][n_new_segment_end1_index][1] + pt_delta_to_add_to_outgoing_start[1]
-            relative_held_line_pos[0] = delta_x  # delta is from initial point
-            relative_held_line_pos[1] = delta_y  # Will be printed after we know if it must be modified
-
-            # Mark this segment as drawn
-            abs_line_segments[count][2] = True
-
-            cumulative_path = self.recursivelyAppendNearbySegments(transformed_hatch_spacing,
-                                                                       n_recursion_count,
-                                                                       count,
-                                                                       n_new_segment_end2_index,
-                                                                       n_abs_line_segment_total,
-                                                                       abs_line_segments,
-                                                                       cumulative_path,
-                                                                       relative_held_line_pos)
-            return cumulative_path
+                n_new_segment_end1_index = n_new_segment_end1_index_at_closest
+                n_new_segment_end2_index = not n_new_segment_end1_index
+                # n_new_segment_end1_index is 0 for connecting to pt1,
+                # and is 1 for connecting to pt2
+                count = n_outer_count_at_closest  # count is the index of the segment to be appended.
+                delta_x = delta_x_at_closest  # delta from final end of incoming segment to initial end of outgoing segment
+                delta_y = delta_y_at_closest
+
+                # First, move pen to initial end (may be either its pt1 or its pt2) of new segment
+
+                # Insert a bezier curve for this transition element
+                # To accomplish this, we need information on the incoming and outgoing segments.
+                # Specifically, we need to know the lengths and angles of the segments in
+                # order to decide on control points.
+                f_in_Dx = abs_line_segments.point(n_ref_segment_count, n_ref_end_index)[0] - abs_line_segments.point(n_ref_segment_count, not n_ref_end_index)[0]
+                f_in_Dy = abs_line_segments.point(n_ref_segment_count, n_ref_end_index)[1] - abs_line_segments.point(n_ref_segment_count, not n_ref_end_index)[1]
+                # The outgoing deltas are based on the reverse direction of the segment, i.e. the segment pointing back to the joiner bezier curve
+                f_out_Dx = abs_line_segments.point(count, n_new_segment_end1_index)[0] - abs_line_segments.point(count, n_new_segment_end2_index)[0]  # index is [count][start point = 0, final point = 1][0=x, 1=y]
+                f_out_Dy = abs_line_segments.point(count, n_new_segment_end1_index)[1] - abs_line_segments.point(count, n_new_segment_end2_index)[1]
+
+                length_of_incoming = math.hypot(f_in_Dx, f_in_Dy)
+                length_of_outgoing = math.hypot(f_out_Dx, f_out_Dy)
+
+                # We are going to trim-up the ends of the incoming and outgoing segments,
+                # in order to get a curve which reliably does not extend beyond the boundary.
+                # Crude readings from inkscape on bezier curve overshoot, using control points extended hatch-spacing distance parallel to segment:
+                # when end points are in line, overshoot 12/16 in direction of segment
+                #          when at 45 degrees, overshoot 12/16 in direction of segment
+                #          when at 60 degrees, overshoot 12/16 in direction of segment
+                # Conclusion, at any angle, remove 0.75 * hatch spacing from the length of both lines,
+                # where 0.75 is, by no coincidence, BEZIER_OVERSHOOT_MULTIPLIER
+
+                # If hatches are getting quite short, we can use a smaller Bezier loop at
+                # the end to squeeze into smaller spaces.  We'll use a normal nice smooth
+                # curve for non-short hatches
+                f_desired_shorten_for_smoothest_join = transformed_hatch_spacing * BEZIER_OVERSHOOT_MULTIPLIER  # This is what we really want to use for smooth curves
+                # Separately check incoming vs outgoing lengths to see if bezier distances must be reduced,
+                # then choose greatest reduction to apply to both - lest we go off-course
+                # Finally, clip reduction to be no less than 1.0
+                f_control_point_divider_incoming = 2.0 * f_desired_shorten_for_smoothest_join / length_of_incoming
+                f_control_point_divider_outgoing = 2.0 * f_desired_shorten_for_smoothest_join / length_of_outgoing
+                if f_control_point_divider_incoming > f_control_point_divider_outgoing:
+                    f_largest_desired_control_point_divider = f_control_point_divider_incoming
+                else:
+                    f_largest_desired_control_point_divider = f_control_point_divider_outgoing
+                if f_largest_desired_control_point_divider < 1.0:
+                    f_control_point_divider = 1.0
+                else:
+                    f_control_point_divider = f_largest_desired_control_point_divider
+                f_desired_shorten = f_desired_shorten_for_smoothest_join / f_control_point_divider
+
+                pt_delta_to_subtract_from_incoming_end = self.RelativeControlPointPosition(f_desired_shorten, f_in_Dx, f_in_Dy, 0, 0)
+                # Note that this will be subtracted from the _point held in abeyance_.
+                relative_held_line_pos[0] -= pt_delta_to_subtract_from_incoming_end[0]
+                relative_held_line_pos[1] -= pt_delta_to_subtract_from_incoming_end[1]
+
+                pt_delta_to_add_to_outgoing_start = self.RelativeControlPointPosition(f_desired_shorten, f_out_Dx, f_out_Dy, 0, 0)
+
+                # We know that when we tack on a curve, we must chop some off the end of the incoming segment,
+                # and also chop some off the start of the outgoing segment.
+                # Now, we know we want the control points to be on a projection of each segment,
+                # in order that there be no abrupt change of plotting angle.  The question is, how
+                # far beyond the endpoint should we place the control point.
+                pt_relative_control_point_in = self.RelativeControlPointPosition(
+                        transformed_hatch_spacing / f_control_point_divider,
+                        f_in_Dx,
+                        f_in_Dy,
+                        0,
+                        0)
+                pt_relative_control_point_out = self.RelativeControlPointPosition(
+                        transformed_hatch_spacing / f_control_point_divider,
+                        f_out_Dx,
+                        f_out_Dy,
+                        delta_x,
+                        delta_y)
+
+                path_data.lineBy(relative_held_line_pos[0], relative_held_line_pos[1])  # close out this segment, which has been modified
+                pt_last_position_abs[0] += relative_held_line_pos[0]
+                pt_last_position_abs[1] += relative_held_line_pos[1]
+                # add bezier cubic curve
+                path_data.curveBy(pt_relative_control_point_in[0],
+                                  pt_relative_control_point_in[1],
+                                  pt_relative_control_point_out[0],
+                                  pt_relative_control_point_out[1],
+                                  delta_x,
+                                  delta_y)
+                pt_last_position_abs[0] += delta_x
+                pt_last_position_abs[1] += delta_y
+                # Next, move pen in appropriate direction to draw the new segment, given that
+                # we have just moved to the initial end of the new segment.
+                # This needs special treatment, as we just did some length changing.
+                delta_x = abs_line_segments.point(count, n_new_segment_end2_index)[0] - abs_line_segments.point(count, n_new_segment_end1_index)[0] + pt_delta_to_add_to_outgoing_start[0]
+                delta_y = abs_line_segments.point(count, n_new_segment_end2_index)[1] - abs_line_segments.point(count, n_new_segment_end1_index)[1] + pt_delta_to_add_to_outgoing_start[1]
+                relative_held_line_pos[0] = delta_x  # delta is from initial point
+                relative_held_line_pos[1] = delta_y  # Will be printed after we know if it must be modified
+
+                # Mark this segment as drawn
+                abs_line_segments.setDrawn(count)
+                segment_ends.remove(count)
+                n_segments_joined += 1
+
+                # The segment just drawn is the reference for the next pass
+                n_ref_segment_count = count
+                n_ref_end_index = n_new_segment_end2_index
 
     def ProposeNeighborhoodRadiusSquared(self, transformed_hatch_spacing):
         return transformed_hatch_spacing * transformed_hatch_spacing * self.options.hatchScope * self.options.hatchScope
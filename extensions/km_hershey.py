@@ -51,15 +51,24 @@ Major revisions in Hershey Text 3.0:
 
 import os
 import math
+import csv
+import re
+import hashlib
+import json
+from array import array
+from collections import OrderedDict
 
 from copy import deepcopy
+from lxml import etree
 
 import inkex
-from inkex import Transform, Style, units
+from inkex import Transform, Style, units, Path
 
 from inkex import load_svg, Group, TextElement, FlowPara, SVGfont, FontFace,\
     FlowSpan, Glyph, MissingGlyph, Tspan, FlowRoot, Rectangle, Use, PathElement, Defs
 
+from km_path_data import PathDataWriter
+
 
 class Hershey(inkex.Effect):
 
@@ -86,6 +95,26 @@ class Hershey(inkex.Effect):
             type=inkex.Boolean, dest="preserve_text", \
             default=False, help="Preserve original text")
 
+        self.arg_parser.add_argument("--mergelines", \
+            type=inkex.Boolean, dest="merge_lines", \
+            default=False, help="Merge the glyphs of each line into a single path")
+
+        self.arg_parser.add_argument("--csvfile", \
+            dest="csv_file", \
+            default="", help="CSV file of values for batch mode")
+
+        self.arg_parser.add_argument("--gridcolumns", \
+            type=int, dest="grid_columns", \
+            default=10, help="Number of columns in the batch mode grid")
+
+        self.arg_parser.add_argument("--gridspacingx", \
+            dest="grid_spacing_x", \
+            default="60mm", help="Horizontal spacing of the batch mode grid")
+
+        self.arg_parser.add_argument("--gridspacingy", \
+            dest="grid_spacing_y", \
+            default="15mm", help="Vertical spacing of the batch mode grid")
+
         self.arg_parser.add_argument("--action", \
             dest="util_mode", \
             default="sample", help="The utility option selected")
@@ -95,6 +124,7 @@ class Hershey(inkex.Effect):
             default="sample", help="Text to use for font table")
 
         self.font_file_list = dict()
+        self.font_family_list = dict() # Font family name -> path, from the font index
         self.font_load_fail = False
 
         self.svg_height = None
@@ -104,7 +134,10 @@ class Hershey(inkex.Effect):
 
         self.warn_unflow = False
         self.warn_textpath = False    # For future use: Give warning about text attached to path.
-        self.font_dict = dict() # Font dictionary - Dictionary of loaded fonts
+        self.font_dict = OrderedDict() # Loaded fonts, least recently used first
+        self.glyph_cache = dict() # Scaled glyphs, keyed by (font family, char, font height)
+        self.width_cache = dict() # Stroke-width strings, keyed by stroke scale
+        self.line_strokes = dict() # Glyph strokes awaiting merging, keyed by line group
 
         self.nodes_to_delete = [] # List of font elements to remove
 
@@ -119,10 +152,24 @@ class Hershey(inkex.Effect):
         self.text_y = []    #List; y-coordinate of text line start
         self.line_number = 0
         self.new_line = True
+        self.last_char = None # (font family, font height, char) last drawn, for kerning
         self.render_width = 1
 
     PX_PER_INCH = 96.0
 
+    # Bump whenever the digest format from parse_svg_font() changes, so that
+    # compiled fonts written by older versions are parsed afresh
+    FONT_CACHE_VERSION = 4
+
+    # Likewise for the index of font files made by font_directory_index()
+    FONT_INDEX_VERSION = 1
+
+    # Most fonts kept loaded at once; the least recently used goes first
+    FONTS_RESIDENT = 8
+
+    # Decimal places written in the path data of merged lines
+    MERGED_PATH_PRECISION = 4
+
     help_text = '''====== Hershey Text Help ======
 
 The Hershey Text extension is designed to replace text in your document (either
@@ -499,7 +546,8 @@ Evil Mad Scientist Laboratories
         in practice. (If you have a counterexample please contact Evil Mad
         Scientist tech support and let us know!)
 
-       (4) Kerning details are not implemented yet.
+       (4) Only horizontal kerning pairs (<hkern>) are read, and only
+        between single characters; vertical kerning is not supported.
         '''
 
         digest = None
@@ -558,12 +606,29 @@ Evil Mad Scientist Laboratories
                     scale
                         A numeric scaling factor computed from the
                         units_per_em value, which gives the overall scale
+
+                    advances
+                        An array of the horizontal advance of every
+                        code point of the basic multilingual plane, from 0
+                        up to the highest one in the font, for quick width
+                        calculations. Points without a glyph of their own
+                        hold the advance of the missing glyph.
+
+                    missing_advance
+                        Advance of the missing glyph (0 if none), for
+                        code points beyond the advances array
+
+                    kerning
+                        A dictionary mapping (first char, second char)
+                        pairs to the kerning value (k) of the first
+                        <hkern> element naming them
                 '''
 
                 digest = dict()
                 geometry = dict()
                 glyphs = dict()
                 missing_glyph = dict()
+                kern_elements = []
 
                 digest['font_id'] = node.get('id')
 
@@ -642,6 +707,35 @@ Evil Mad Scientist Laboratories
                         missing_glyph['d'] = element.get('d') # SVG path data
                         digest['missing_glyph'] = missing_glyph
 
+                    elif element.tag == inkex.addNS('hkern', 'svg'):
+                        # Read once all glyph names are known
+                        kern_elements.append(element)
+
+                missing_advance = missing_glyph.get('horiz_adv_x', 0.0)
+
+                advances = self.advance_table(glyphs, missing_advance)
+
+                glyph_names = dict()
+                for uni_text in glyphs:
+                    if glyphs[uni_text]['glyph_name'] is not None:
+                        glyph_names.setdefault(glyphs[uni_text]['glyph_name'], uni_text)
+
+                kerning = dict()
+                for element in kern_elements:
+                    try:
+                        k = float(element.get('k', '0'))
+                    except ValueError:
+                        continue
+                    firsts = self.kern_chars(element.get('u1'), element.get('g1'), glyphs, glyph_names)
+                    seconds = self.kern_chars(element.get('u2'), element.get('g2'), glyphs, glyph_names)
+                    for first in firsts:
+                        for second in seconds:
+                            kerning.setdefault((first, second), k) # First match wins
+
+                digest['advances'] = advances
+                digest['missing_advance'] = missing_advance
+                digest['kerning'] = kerning
+
 
                 # Main scaling factor
                 digest['scale'] = 1.0 /  geometry['units_per_em']
@@ -652,10 +746,280 @@ Evil Mad Scientist Laboratories
                 return digest
         return None
 
+    def advance_table(self, glyphs, missing_advance):
+        '''
+        The advances array of a digest (see parse_svg_font), built from
+        its glyphs and the advance of its missing glyph
+        '''
+
+        bmp_points = [ord(uni_text) for uni_text in glyphs \
+            if len(uni_text) == 1 and ord(uni_text) < 0x10000]
+        advances = array('d', [missing_advance]) * (max(bmp_points + [-1]) + 1)
+        for point in bmp_points:
+            advances[point] = glyphs[chr(point)]['horiz_adv_x']
+        return advances
+
+    def kern_chars(self, unicode_list, name_list, glyphs, glyph_names):
+        '''
+        The characters named by the u1/u2 (unicode_list) and g1/g2
+        (name_list) attributes of an <hkern> element: comma-separated
+        characters or U+ code points and ranges (such as U+0041-005A or
+        U+004?), and glyph names. Only characters with glyphs in the font
+        are returned.
+        '''
+
+        chars = []
+        if unicode_list:
+            for item in unicode_list.split(','):
+                if item.strip():
+                    item = item.strip()
+                if item.upper().startswith('U+') and len(item) > 2:
+                    span = item[2:].split('-')
+                    try:
+                        first = int(span[0].replace('?', '0'), 16)
+                        last = int(span[-1].replace('?', 'F'), 16)
+                    except ValueError:
+                        continue
+                    for point in range(first, min(last, 0x10FFFF) + 1):
+                        if chr(point) in glyphs:
+                            chars.append(chr(point))
+                elif item in glyphs:
+                    chars.append(item)
+        if name_list:
+            for name in name_list.split(','):
+                uni_text = glyph_names.get(name.strip())
+                if uni_text is not None:
+                    chars.append(uni_text)
+        return chars
+
+    def user_cache_path(self, path, suffix):
+        '''
+        Path of a file in the per-user cache directory that holds
+        information about the file or directory at path.
+
+        Cache files are only ever kept here, never next to the fonts:
+        a font directory may be shared or supplied by someone else, and
+        writing there would change its modification time.
+        '''
+
+        base = os.environ.get('XDG_CACHE_HOME') or os.environ.get('LOCALAPPDATA')
+        if not base:
+            base = os.path.join(os.path.expanduser('~'), '.cache')
+        path_hash = hashlib.sha1(os.path.realpath(path).encode('utf-8')).hexdigest()
+        return os.path.join(base, 'km_hershey', path_hash + suffix)
+
+    def read_cache_file(self, cache_path):
+        '''
+        Read the JSON cache file at cache_path, returning None if it is
+        missing or cannot be read. A file that is not valid JSON raises
+        ValueError, for the caller to count as a miss.
+        '''
+
+        try:
+            with open(cache_path, 'r', encoding='utf-8') as cache_file:
+                return json.load(cache_file)
+        except OSError:
+            return None
+
+    def write_cache_file(self, cache_path, data):
+        '''
+        Write data to the cache file at cache_path as JSON. A failure to
+        write just means the work is done again next time.
+        '''
+
+        try:
+            directory = os.path.dirname(cache_path)
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            # Write then rename, so that a reader never sees half a file
+            with open(cache_path + '.tmp', 'w', encoding='utf-8') as cache_file:
+                json.dump(data, cache_file, separators=(',', ':'))
+            os.replace(cache_path + '.tmp', cache_path)
+        except OSError:
+            pass
+
+    def digest_to_json(self, digest):
+        '''
+        The font digest from parse_svg_font() in a form that JSON can
+        hold: the kerning pairs become a list of [first, second, k]
+        entries. The advances array is left out, being rebuilt from the
+        glyphs on reading.
+        '''
+
+        if digest is None:
+            return None
+        data = dict(digest)
+        del data['advances']
+        data['kerning'] = [[first, second, k] for (first, second), k in digest['kerning'].items()]
+        return data
+
+    def digest_from_json(self, data):
+        '''
+        Rebuild a font digest from the form written by digest_to_json(),
+        checking its structure as it goes. Raises ValueError, TypeError,
+        KeyError or AttributeError if data is not such a digest.
+        '''
+
+        if data is None:
+            return None
+        if not isinstance(data, dict) or not isinstance(data['glyphs'], dict):
+            raise ValueError('Not a font digest')
+
+        glyph_list = list(data['glyphs'].values())
+        if 'missing_glyph' in data:
+            glyph_list.append(data['missing_glyph'])
+        for glyph in glyph_list:
+            if not isinstance(glyph['d'], (str, type(None))):
+                raise ValueError('Bad glyph path data')
+            glyph['horiz_adv_x'] = float(glyph['horiz_adv_x'])
+
+        digest = dict(data)
+        digest['geometry'] = {key: float(value) for key, value in data['geometry'].items()}
+        digest['scale'] = float(data['scale'])
+        digest['missing_advance'] = float(data['missing_advance'])
+        digest['advances'] = self.advance_table(data['glyphs'], digest['missing_advance'])
+        digest['kerning'] = {(str(first), str(second)): float(k) \
+            for first, second, k in data['kerning']}
+        return digest
+
+    def read_font_cache(self, font_path, font_stat):
+        '''
+        Look for a compiled digest of the SVG font at font_path, made from
+        the file as it is now: same modification time and size as given
+        by font_stat.
+
+        Returns (True, digest) on a hit -- the digest being None for a file
+        found before not to hold a font -- or (False, None) on a miss. A
+        cache file that is damaged counts as a miss, and is replaced once
+        the font has been parsed again.
+        '''
+
+        try:
+            compiled = self.read_cache_file(self.user_cache_path(font_path, '.digest.json'))
+            if compiled is not None and \
+                    compiled['version'] == self.FONT_CACHE_VERSION and \
+                    compiled['mtime'] == font_stat.st_mtime_ns and \
+                    compiled['size'] == font_stat.st_size:
+                return True, self.digest_from_json(compiled['digest'])
+        except (ValueError, TypeError, KeyError, AttributeError):
+            pass # Not a digest that we wrote
+        return False, None
+
+    def write_font_cache(self, font_path, font_stat, digest):
+        '''
+        Save the digest parsed from the SVG font at font_path, for
+        read_font_cache() to find on later runs.
+        '''
+
+        compiled = {'version': self.FONT_CACHE_VERSION,
+                    'mtime': font_stat.st_mtime_ns,
+                    'size': font_stat.st_size,
+                    'digest': self.digest_to_json(digest)}
+        self.write_cache_file(self.user_cache_path(font_path, '.digest.json'), compiled)
+
+    def read_font_family(self, font_path):
+        '''
+        Font family named by the <font-face> element of the SVG font at
+        font_path, or None if there is none. The file is only parsed as
+        far as that element, which comes before the glyphs.
+        '''
+
+        font_face_tag = inkex.addNS('font-face', 'svg')
+        try:
+            with open(font_path, 'rb') as font_file:
+                for _, element in etree.iterparse(font_file, tag=font_face_tag):
+                    return element.get('font-family')
+        except Exception:
+            pass # Not an SVG file that we can read
+        return None
+
+    def font_directory_index(self, directory):
+        '''
+        Index of the SVG files in directory: a dictionary that maps each
+        file name to (modification time, size, font family).
+
+        The index is kept in the per-user cache directory, and is used as
+        it stands for as long as the directory's modification time stays
+        the same, so that the directory need not be listed on every run.
+        Once files are added, removed or renamed, the directory is listed
+        again, but only those files that are new or changed are read for
+        their font family.
+        '''
+
+        try:
+            dir_stat = os.stat(directory)
+        except OSError:
+            return dict()
+
+        index_path = self.user_cache_path(directory, '.index.json')
+        try:
+            index = self.read_cache_file(index_path)
+            if index is not None:
+                if index['version'] != self.FONT_INDEX_VERSION or \
+                        not isinstance(index['mtime'], int):
+                    index = None
+                else:
+                    for (mtime, size, family) in index['files'].values():
+                        if not isinstance(family, (str, type(None))):
+                            raise ValueError('Bad font family')
+        except (ValueError, TypeError, KeyError, AttributeError):
+            index = None # Not an index that we wrote
+
+        if index is not None and index['mtime'] == dir_stat.st_mtime_ns:
+            return index['files']
+
+        old_files = index['files'] if index is not None else dict()
+        files = dict()
+        for dir_item in os.listdir(directory):
+            if dir_item.endswith((".svg", ".SVG")):
+                file_path = os.path.join(directory, dir_item)
+                if not os.path.isfile(file_path): # i.e., if a directory
+                    continue
+                file_stat = os.stat(file_path)
+                entry = old_files.get(dir_item)
+                if entry is None or entry[0] != file_stat.st_mtime_ns or \
+                        entry[1] != file_stat.st_size:
+                    entry = (file_stat.st_mtime_ns, file_stat.st_size,
+                             self.read_font_family(file_path))
+                files[dir_item] = entry
+
+        index = {'version': self.FONT_INDEX_VERSION,
+                 'mtime': dir_stat.st_mtime_ns,
+                 'files': files}
+        self.write_cache_file(index_path, index)
+        return files
+
+    def add_font_directory(self, directory):
+        '''
+        Add the SVG files in directory to our list of font files, under
+        both their file names (without extension) and the font family
+        names given within them.
+        '''
+
+        for dir_item, (_, _, family) in self.font_directory_index(directory).items():
+            file_path = os.path.join(directory, dir_item)
+            root, _ = os.path.splitext(dir_item)
+            self.font_file_list[root] = file_path
+            if family:
+                self.font_family_list[family] = file_path
+
+    def remember_font(self, fontname, digest):
+        '''
+        Add a font (or None, for one that could not be loaded) to the
+        font library. Once more than FONTS_RESIDENT fonts are held,
+        the least recently used are dropped; they are simply loaded
+        again, from their compiled digests, if needed later on.
+        '''
+
+        self.font_dict[fontname] = digest
+        while len(self.font_dict) > self.FONTS_RESIDENT:
+            self.font_dict.popitem(last=False)
+
     def load_font(self, fontname):
         '''
         Attempt to load an SVG font from a file in our list
-        of (likely) SVG font files.
+        of (likely) SVG font files, looked up first by file name
+        and then by the font family name given within the file.
         If we can, add the contents to the font library.
         Otherwise, add a "None" entry to the font library.
         '''
@@ -664,12 +1028,15 @@ Evil Mad Scientist Laboratories
             return
 
         if fontname in self.font_dict:
+            self.font_dict.move_to_end(fontname)
             return # Awesome: The font is already loaded.
 
         if fontname in self.font_file_list:
             the_path = self.font_file_list[fontname]
+        elif fontname in self.font_family_list:
+            the_path = self.font_family_list[fontname]
         else:
-            self.font_dict[fontname] = None
+            self.remember_font(fontname, None)
             return # Font not located.
         try:
             '''
@@ -682,15 +1049,23 @@ Evil Mad Scientist Laboratories
             Only the first font found in the font file will be read.
             Multiple weights and styles within a font family are not
             presently supported.
+
+            The parsed digest is compiled to disk, so that the SVG is only
+            parsed again once the font file changes.
             '''
-            font_svg = load_svg(the_path)
-            self.font_dict[fontname] = self.parse_svg_font(font_svg.getroot())
+            font_stat = os.stat(the_path)
+            found, digest = self.read_font_cache(the_path, font_stat)
+            if not found:
+                font_svg = load_svg(the_path)
+                digest = self.parse_svg_font(font_svg.getroot())
+                self.write_font_cache(the_path, font_stat, digest)
+            self.remember_font(fontname, digest)
 
         except IOError:
-            self.font_dict[fontname] = None
+            self.remember_font(fontname, None)
         except:
             inkex.errormsg('Error parsing SVG font at ' + str(the_path))
-            self.font_dict[fontname] = None
+            self.remember_font(fontname, None)
 
 
     def font_table(self):
@@ -702,8 +1077,14 @@ Evil Mad Scientist Laboratories
 
         # Embed text in group to make manipulation easier:
         group = self.svg.get_current_layer().add(Group())
-        for fontname in self.font_file_list:
+
+        # Only check here which files hold fonts; each font is loaded
+        # again as its sample line is rendered.
+        fontnames = []
+        for fontname in sorted(self.font_file_list):
             self.load_font(fontname)
+            if self.font_dict[fontname] is not None:
+                fontnames.append(fontname)
 
         font_size = 0.2 # in inches -- will be scaled by viewbox factor.
         font_size_text = str(font_size / self.vb_scale_factor) + 'px'
@@ -716,10 +1097,7 @@ Evil Mad Scientist Laboratories
         y_offset = 1.5 * x_offset
         y = y_offset
 
-        for fontname in sorted(self.font_dict):
-            if self.font_dict[fontname] is None:
-                continue # If the SVG file did NOT contain a font, skip it.
-
+        for fontname in fontnames:
             text_attribs = {'x':'0', 'y': str(y), 'hershey-ignore':'true'}
             textline = group.add(TextElement(**text_attribs))
             textline.text = fontname
@@ -823,24 +1201,23 @@ Evil Mad Scientist Laboratories
             - Search that directory for SVG fonts.
 
         This function will create a list of available files that
-        appear to be SVG(SVG font) files. It does not parse the files.
+        appear to be SVG(SVG font) files. It does not load the fonts.
         We will format it as a dictionary, that maps each file name
-        (without extension) to a path.
+        (without extension) to a path, along with a second dictionary
+        that maps the font family names found in the files to paths.
+        Both come from the font index kept for each directory; see
+        font_directory_index().
         '''
 
         self.font_file_list = dict()
+        self.font_family_list = dict()
 
         # List contents of primary font directory:
         font_directory_name = 'svg_fonts'
 
         font_dir = os.path.realpath(
             os.path.join(os.getcwd(), font_directory_name))
-        for dir_item in os.listdir(font_dir):
-            if dir_item.endswith((".svg", ".SVG")):
-                file_path = os.path.join(font_dir, dir_item)
-                if os.path.isfile(file_path): # i.e., if not a directory
-                    root, _ = os.path.splitext(dir_item)
-                    self.font_file_list[root] = file_path
+        self.add_font_directory(font_dir)
 
         # split off file extension(e.g., ".svg")
         root, _ = os.path.splitext(self.options.otherfont)
@@ -868,23 +1245,12 @@ Evil Mad Scientist Laboratories
 
             # Also search the directory where that file
             # was located for other SVG files(which may be fonts)
-
-            for dir_item in os.listdir(directory):
-                if dir_item.endswith((".svg", ".SVG")):
-                    file_path = os.path.join(directory, dir_item)
-                    if os.path.isfile(file_path): # i.e., if not a directory
-                        root, _ = os.path.splitext(dir_item)
-                        self.font_file_list[root] = file_path
+            self.add_font_directory(directory)
             return
 
         # Check for case "(C)": A directory name
         if os.path.isdir(test_path):
-            for dir_item in os.listdir(test_path):
-                if dir_item.endswith((".svg", ".SVG")):
-                    file_path = os.path.join(test_path, dir_item)
-                    if os.path.isfile(file_path): # i.e., if not a directory
-                        root, _ = os.path.splitext(dir_item)
-                        self.font_file_list[root] = file_path
+            self.add_font_directory(test_path)
 
 
     def font_load_wrapper(self, fontname):
@@ -954,23 +1320,79 @@ Evil Mad Scientist Laboratories
         if fontname is None:
             return None
 
-        try:
-            scale_factor = self.font_dict[fontname]['scale']
-        except:
-            scale_factor = 0.001  # Default: 1/1000
+        digest = self.font_dict[fontname]
 
-        try:
-            if char not in self.font_dict[fontname]['glyphs']:
-                x_adv = self.font_dict[fontname]['missing_glyph']['horiz_adv_x']
+        glyph = digest['glyphs'].get(char)
+        if glyph is None:
+            glyph = digest.get('missing_glyph')
+            if glyph is None:
+                return None
 
-                return self.font_dict[fontname]['missing_glyph']['d'], \
-                    x_adv, scale_factor
-            x_adv = self.font_dict[fontname]['glyphs'][char]['horiz_adv_x']
+        return glyph['d'], glyph['horiz_adv_x'], digest['scale']
 
-            return self.font_dict[fontname]['glyphs'][char]['d'], \
-                x_adv, scale_factor
-        except:
-            return None
+
+    def text_width(self, fontname, text, font_height):
+        '''
+        Width of the string text set in a single font and height, found
+        from the font's advances array and kerning pairs in one pass,
+        without looking up or laying out any glyphs.
+        '''
+
+        fontname = self.font_load_wrapper(fontname) # Load the font if available
+
+        if fontname is None:
+            return 0
+
+        digest = self.font_dict[fontname]
+        advances = digest['advances']
+        top = len(advances)
+        glyphs = digest['glyphs']
+        missing_advance = digest['missing_advance']
+
+        width = sum([advances[point] if point < top else \
+            glyphs[chr(point)]['horiz_adv_x'] if chr(point) in glyphs else missing_advance \
+            for point in map(ord, text)])
+
+        kerning = digest['kerning']
+        if kerning:
+            width -= sum([kerning.get(pair, 0.0) for pair in zip(text, text[1:])])
+
+        return width * digest['scale'] * font_height
+
+
+    def line_width(self, chars, start, end):
+        '''
+        Width of the characters chars[start:end] of the text being
+        rendered, laid out as draw_svg_text() will lay them out. The font
+        and height may change along the line; each run of characters in a
+        single font and height is measured by text_width(), since kerning
+        only applies within such a run.
+        '''
+
+        width = 0
+        run_start = start
+        for i in range(start + 1, end + 1):
+            if i == end or self.text_families[i] != self.text_families[run_start] or \
+                    self.text_heights[i] != self.text_heights[run_start]:
+                width += self.text_width(self.text_families[run_start], \
+                    "".join(chars[run_start:i]), self.text_heights[run_start])
+                run_start = i
+        return width
+
+
+    def get_kerning(self, fontname, first, second):
+        '''
+        Kerning between the characters first and second in the given
+        font (k of the matching <hkern>, or 0), scaled to a font height of 1
+        '''
+
+        fontname = self.font_load_wrapper(fontname)
+
+        if fontname is None:
+            return 0
+
+        digest = self.font_dict[fontname]
+        return digest['kerning'].get((first, second), 0.0) * digest['scale']
 
 
     def handle_viewbox(self):
@@ -999,19 +1421,22 @@ Evil Mad Scientist Laboratories
         # In case of non-square aspect ratio, use average value.
 
 
-    def draw_svg_text(self, chardata, parent):
+    def get_scaled_glyph(self, font_family, char, font_height):
         '''
-        Render an individual svg glyph
+        Given a font face name, a character and a font height, return the
+        glyph's SVG path data already scaled to that height (and mirrored,
+        since SVG fonts use an inverted Y axis), along with its scaled
+        horizontal advance and -- when merging lines -- its strokes as a
+        cubic superpath, as (path data or None, advance, superpath).
+
+        Each (font, character, height) is looked up and parsed only once;
+        after that, placing the glyph only takes a translation.
         '''
-        char = chardata['char']
-        font_family = chardata['font_family']
-        offset = chardata['offset']
-        vertoffset = chardata['vertoffset']
-        font_height = chardata['font_height']
-        font_scale = 1.0
 
-        # Stroke scale factor, including external transformations:
-        stroke_scale = chardata['stroke_scale'] * self.vb_scale_factor
+        key = (font_family, char, font_height)
+        glyph = self.glyph_cache.get(key)
+        if glyph is not None:
+            return glyph
 
         try:
             path_string, adv_x, scale_factor = self.get_font_char(font_family, char)
@@ -1020,20 +1445,35 @@ Evil Mad Scientist Laboratories
             path_string = None
             scale_factor = 1.0
 
-        if self.font_load_fail:
-            return 0
+        font_scale = scale_factor * font_height
 
-        font_scale *= scale_factor * font_height
+        if path_string is not None:
+            scale_transform = Transform(scale=(font_scale, -font_scale))
+            path_string = str(Path(path_string).transform(scale_transform))
+
+        superpath = None
+        if path_string is not None and self.options.merge_lines:
+            # The strokes of the glyph, each a list of
+            # [control-in, vertex, control-out] triples
+            superpath = [[[tuple(point) for point in triple] for triple in stroke]
+                         for stroke in Path(path_string).to_superpath()]
+
+        glyph = (path_string, float(adv_x) * font_scale, superpath)
+        self.glyph_cache[key] = glyph
+        return glyph
 
-        h_offset = 0
-        v_offset = 0
 
-        # SVG fonts use inverted Y axis; mirror vertically
-        scale_transform = Transform(scale=(font_scale, -font_scale))
+    def get_width_string(self, stroke_scale):
+        '''
+        Stroke-width style value for a glyph whose scale, including
+        external transformations, is stroke_scale
+        '''
+
+        width_string = self.width_cache.get(stroke_scale)
+        if width_string is not None:
+            return width_string
 
-        # Combine scales of external transformations with the scaling
-        # applied by this function:
-        _scale = font_scale * stroke_scale
+        _scale = stroke_scale
         if _scale == 0:
             _scale = 1
         stroke_width = self.render_width / _scale
@@ -1048,19 +1488,255 @@ Evil Mad Scientist Laboratories
             prec = int(math.ceil(-log_ten) + 3)
             width_string = "{0:.{1}f}in".format(stroke_width, prec)
 
-        p_style = {'stroke-width': width_string}
+        self.width_cache[stroke_scale] = width_string
+        return width_string
 
-        the_transform = Transform(translate=(offset + h_offset, vertoffset + v_offset))
-        the_transform @= scale_transform
 
-        if path_string is not None:
+    def draw_svg_text(self, chardata, parent):
+        '''
+        Render an individual svg glyph
+        '''
+        char = chardata['char']
+        font_family = chardata['font_family']
+        offset = chardata['offset']
+        vertoffset = chardata['vertoffset']
+        font_height = chardata['font_height']
+
+        # Stroke scale factor, including external transformations:
+        stroke_scale = chardata['stroke_scale'] * self.vb_scale_factor
+
+        path_string, advance, superpath = self.get_scaled_glyph(font_family, char, font_height)
+
+        if self.font_load_fail:
+            return 0
+
+        # Kern against the character before, if on the same line in the same font
+        if not self.new_line and self.last_char is not None and \
+                self.last_char[0] == font_family and self.last_char[1] == font_height:
+            offset -= self.get_kerning(font_family, self.last_char[2], char) * font_height
+        self.new_line = False
+        self.last_char = (font_family, font_height, char)
+
+        if superpath is not None:
+            # Hold the strokes back, moved into place, for merge_line_strokes()
+            strokes, _ = self.line_strokes.setdefault(parent, ([], self.get_width_string(stroke_scale)))
+            for stroke in superpath:
+                strokes.append([[(x + offset, y + vertoffset) for (x, y) in triple] for triple in stroke])
+            self.output_generated = True
+        elif path_string is not None:
+            # The path data is already scaled, so it needs no parsing here
             path_element = parent.add(PathElement())
-            path_element.set_path(path_string)
-            path_element.style = p_style
-            path_element.transform = the_transform
+            path_element.set('d', path_string)
+            path_element.style = {'stroke-width': self.get_width_string(stroke_scale)}
+            path_element.transform = Transform(translate=(offset, vertoffset))
             self.output_generated = True
 
-        return offset + float(adv_x) * font_scale  # new horizontal offset value
+        return offset + advance  # new horizontal offset value
+
+
+    def merge_line_strokes(self):
+        '''
+        Write out the glyph strokes held back by draw_svg_text() when
+        merging lines: one path for each group the glyphs were drawn into,
+        holding every stroke of the line. The strokes are put in drawing order by always going
+        on to the nearest end of a stroke not yet drawn, turning a stroke
+        around if that end is its last point, so as to keep the pen-up
+        moves between glyphs short. A stroke starting right where the last
+        one ended simply carries on from it.
+        '''
+
+        for line_group, (strokes, width_string) in self.line_strokes.items():
+            path_data = PathDataWriter(self.MERGED_PATH_PRECISION)
+            pen_x, pen_y = 0.0, 0.0
+            while strokes:
+                best_index = 0
+                best_reversed = False
+                best_distance = None
+                for index, stroke in enumerate(strokes):
+                    for reverse, point in ((False, stroke[0][1]), (True, stroke[-1][1])):
+                        distance = (point[0] - pen_x) ** 2 + (point[1] - pen_y) ** 2
+                        if best_distance is None or distance < best_distance:
+                            best_index, best_reversed, best_distance = index, reverse, distance
+                stroke = strokes.pop(best_index)
+                if best_reversed:
+                    stroke = [(triple[2], triple[1], triple[0]) for triple in reversed(stroke)]
+
+                if len(path_data) == 0 or stroke[0][1] != (pen_x, pen_y):
+                    path_data.moveTo(*stroke[0][1]) # Else carry on from the last stroke
+                for previous, triple in zip(stroke, stroke[1:]):
+                    if previous[2] == previous[1] and triple[0] == triple[1]:
+                        path_data.lineTo(*triple[1])
+                    else:
+                        path_data.curveTo(*(previous[2] + triple[0] + triple[1]))
+                pen_x, pen_y = stroke[-1][1]
+
+            path_element = line_group.add(PathElement())
+            path_element.set('d', str(path_data))
+            path_element.style = {'stroke-width': width_string}
+        self.line_strokes = dict()
+
+
+    def transform_scale(self, transform):
+        '''
+        Compute estimate of transformation scale applied to
+        an element, for purposes of calculating the
+        stroke width to apply. When all transforms are applied
+        and our elements are displayed on the page, we want the
+        final visible stroke width to be reasonable.
+        Transformation matrix is [[a c e][b d f]]
+        scale_x = sqrt(a * a + b * b),
+        scale_y = sqrt(c * c + d * d)
+        Take estimated scale as the mean of the two.
+        '''
+
+        if transform is None:
+            return 1.0
+
+        transform2 = Transform(transform).matrix
+
+        scale_x = math.sqrt(transform2[0][0] * transform2[0][0] +
+                            transform2[1][0] * transform2[1][0])
+        scale_y = math.sqrt(transform2[0][1] * transform2[0][1] +
+                            transform2[1][1] * transform2[1][1])
+
+        return (scale_x + scale_y) / 2.0 # Average. ¯\_(ツ)_/¯
+
+
+    def batch_render(self):
+        '''
+        Batch (variable data) mode: render one string per row of a CSV
+        file, laid out on a grid, in the style of a single selected
+        template text element.
+
+        The first row of the CSV file names its columns. Each {name} in
+        the template text is replaced by the value of that column; if the
+        template holds no such field, each string is simply the value of
+        the first column. The grid starts at the template's position (or
+        that of its first tspan) and runs across grid_columns columns,
+        then down, spaced in document units.
+
+        Each string becomes a single path, its glyphs merged as with the
+        "merge lines" option and its place on the grid written into the
+        path data, so that the document grows by one element per row.
+        No text elements or groups are made for the strings, and the CSV
+        file is read one row at a time. The finished paths are all held
+        in the document until it is written out, as usual.
+        '''
+
+        template = None
+        for id_ref in self.options.ids:
+            if isinstance(self.svg.selected[id_ref], TextElement):
+                template = self.svg.selected[id_ref]
+                break
+        if template is None:
+            inkex.errormsg('Please select one text element to use as the template.')
+            return
+
+        template_text = "".join(template.itertext())
+        fields = re.compile(r'\{([^{}]+)\}')
+
+        # Style and position come from the first line of the template,
+        # the style including what is inherited or set by CSS
+        tspans = [child for child in template if isinstance(child, Tspan)]
+        node_style = (tspans[0] if tspans else template).specified_style()
+
+        def position(name):
+            value = template.get(name)
+            if value is None and tspans:
+                value = tspans[0].get(name)
+            if not value or not value.split():
+                return 0.0
+            return float(value.split()[0])
+
+        font_height = 16
+        if 'font-size' in node_style:
+            font_height = self.units_to_userunits(node_style['font-size'])
+        font_family = 'sans-serif'
+        if 'font-family' in node_style:
+            font_family = self.strip_quotes(node_style['font-family'])
+        text_align = node_style.get('text-anchor', 'start')
+
+        start_x = position('x')
+        start_y = position('y')
+        spacing_x = self.svg.unittouu(self.options.grid_spacing_x)
+        spacing_y = self.svg.unittouu(self.options.grid_spacing_y)
+        columns = max(1, self.options.grid_columns)
+
+        group = template.getparent().add(Group())
+        group.label = 'Hershey Text'
+        group.style = {'stroke' : '#000000', 'fill' : 'none', \
+            'stroke-linecap' : 'round', 'stroke-linejoin' : 'round'}
+        group.transform = template.transform
+        scale_r = self.transform_scale(template.transform)
+
+        # Glyphs are always merged here; see merge_line_strokes()
+        self.options.merge_lines = True
+
+        char_data = dict()
+        char_data['font_family'] = font_family
+        char_data['font_height'] = font_height
+        char_data['vertoffset'] = 0
+        char_data['stroke_scale'] = scale_r
+
+        try:
+            csv_file = open(self.options.csv_file, 'r', newline='', encoding='utf-8-sig')
+        except (IOError, OSError):
+            inkex.errormsg('Unable to open CSV file ' + str(self.options.csv_file))
+            return
+
+        with csv_file:
+            reader = csv.reader(csv_file)
+            header = next(reader, None)
+            if header is None:
+                return
+            columns_by_name = dict((name.strip(), index) for index, name in enumerate(header))
+            use_fields = any(match in columns_by_name for match in fields.findall(template_text))
+
+            def field_value(row, match):
+                index = columns_by_name.get(match.group(1))
+                if index is None or index >= len(row):
+                    return match.group(0)
+                return row[index]
+
+            count = 0
+            for row in reader:
+                if not row:
+                    continue
+                if use_fields:
+                    text = fields.sub(lambda match: field_value(row, match), template_text)
+                else:
+                    text = row[0]
+
+                # Width first, from the font's advances, for the alignment
+                width = self.text_width(font_family, text, font_height)
+                if self.font_load_fail:
+                    break
+
+                y_pos, x_pos = divmod(count, columns)
+                x_shift = start_x + x_pos * spacing_x
+                if text_align == "middle":
+                    x_shift -= width / 2
+                elif text_align == "end":
+                    x_shift -= width
+
+                # The glyphs are placed straight at their grid position, and
+                # merged into a single path added to the group
+                w = x_shift
+                char_data['vertoffset'] = start_y + y_pos * spacing_y
+                self.new_line = True
+                for char in text:
+                    char_data['char'] = char
+                    char_data['offset'] = w
+                    w = self.draw_svg_text(char_data, group)
+
+                if self.line_strokes:
+                    self.merge_line_strokes() # Keep only one string's strokes at a time
+                count += 1
+
+        if len(group) == 0:
+            template.getparent().remove(group)
+        elif not self.options.preserve_text:
+            self.nodes_to_delete.append(template)
 
 
     def recursive_get_encl_transform(self, node):
@@ -1419,29 +2095,7 @@ Evil Mad Scientist Laboratories
                 except ValueError:
                     pass
 
-                if(transform is not None):
-                    transform2 = Transform(transform).matrix
-
-                    '''
-                    Compute estimate of transformation scale applied to
-                    this element, for purposes of calculating the
-                    stroke width to apply. When all transforms are applied
-                    and our elements are displayed on the page, we want the
-                    final visible stroke width to be reasonable.
-                    Transformation matrix is [[a c e][b d f]]
-                    scale_x = sqrt(a * a + b * b),
-                    scale_y = sqrt(c * c + d * d)
-                    Take estimated scale as the mean of the two.
-                    '''
-
-                    scale_x = math.sqrt(transform2[0][0] * transform2[0][0] +
-                                        transform2[1][0] * transform2[1][0])
-                    scale_y = math.sqrt(transform2[0][1] * transform2[0][1] +
-                                        transform2[1][1] * transform2[1][1])
-
-                    scale_r = (scale_x + scale_y) / 2.0 # Average. ¯\_(ツ)_/¯
-                else:
-                    scale_r = 1.0
+                scale_r = self.transform_scale(transform)
 
                 the_id = node.get('id')
 
@@ -1785,73 +2439,59 @@ Evil Mad Scientist Laboratories
                         x_start_line = float(self.text_x[i]) # We are starting a new line here.
                         y_start_line = float(self.text_y[i])
 
-                        while(i < str_len):
-                            # Inner while loop, that we will break out of,
-                            # back to the outer while loop.
+                        # The line runs on until the next piece of the string
+                        # is at a different position
+                        i_end = i + 1
+                        while(i_end < str_len and \
+                              float(self.text_x[i_end]) == x_start_line and \
+                              float(self.text_y[i_end]) == y_start_line):
+                            i_end += 1
+
+                        text_align = self.text_aligns[i_end - 1]
+                        # Not currently supporting text alignment that changes in the span;
+                        # Use the text alignment as of the last character.
+
+                        # Left(or "start") alignment is default.
+                        # if(text_align == "middle"): Center alignment
+                        # if(text_align == "end"): Right alignment
+                        #
+                        # Strategy: Align every row (left, center, or right)
+                        # before it is drawn, measuring it from the advances
+                        # and kerning of its fonts.
+
+                        x_shift = x_start_line
+                        if text_align in ("middle", "end"):
+                            width_this_line = self.line_width(letter_vals, i, i_end)
+                            if(text_align == "middle"): # when using text-anchor
+                                x_shift = x_start_line -(width_this_line / 2)
+                            else:
+                                x_shift = x_start_line - width_this_line
 
-                            q_val = letter_vals[i]
-                            charfont_height = self.text_heights[i]
+                        line_group.transform = Transform(translate=(x_shift, y_start_line))
 
+                        while(i < i_end):
                             char_data = dict()
-                            char_data['char'] = q_val
+                            char_data['char'] = letter_vals[i]
                             char_data['font_family'] = self.text_families[i]
 
-                            char_data['font_height'] = charfont_height
+                            char_data['font_height'] = self.text_heights[i]
                             char_data['offset'] = w
                             char_data['vertoffset'] = 0
                             char_data['stroke_scale'] = scale_r
 
                             w = self.draw_svg_text(char_data, line_group)
-                            width_this_line = w
-                            w_temp = w
-
-                            # Set the alignment if(A) this is the last character in the string
-                            # or if the next piece of the string is at a different position
-
-                            set_alignment = False
-                            i_next = i + 1
-                            if(i_next >= str_len):  # End of the string; last character.
-                                set_alignment = True
-                            elif((float(self.text_x[i_next]) != x_start_line) or \
-                                 (float(self.text_y[i_next]) != y_start_line)):
-                                set_alignment = True
-
-                            if set_alignment:
-                                text_align = self.text_aligns[i]
-                                # Not currently supporting text alignment that changes in the span;
-                                # Use the text alignment as of the last character.
-
-                                # Left(or "start") alignment is default.
-                                # if(text_align == "middle"): Center alignment
-                                # if(text_align == "end"): Right alignment
-                                #
-                                # Strategy: Align every row (left, center, or right)
-                                # as it is created.
-
-                                x_shift = 0
-                                if(text_align == "middle"): # when using text-anchor
-                                    x_shift = x_start_line -(width_this_line / 2)
-                                elif(text_align == "end"):
-                                    x_shift = x_start_line - width_this_line
-                                else:
-                                    x_shift = x_start_line
-
-                                y_shift = y_start_line
-
-                                the_transform = Transform(translate=(x_shift, y_shift))
-
-                                line_group.transform = the_transform
-
-                                line_group = group.add(Group()) # Create new group for this line
-
-                                self.new_line = True # Used for managing indent defects
-                                w = 0
-                                i += 1
-                                break
-                            i += 1    # Only executed when set_alignment is false.
+                            i += 1
+
+                        line_group = group.add(Group()) # Create new group for this line
+
+                        self.new_line = True # Used for managing indent defects
+                        w = 0
 
                     the_transform = Transform()
 
+                if self.line_strokes:
+                    self.merge_line_strokes()
+
                 if len(line_group) == 0:
                     parent = line_group.getparent()
                     parent.remove(line_group)
@@ -1905,6 +2545,8 @@ Evil Mad Scientist Laboratories
 
         if self.options.mode == "help":
             inkex.errormsg(self.help_text)
+        elif self.options.mode == "batch":
+            self.batch_render()
         elif self.options.mode == "utilities":
 
             if self.options.util_mode == "sample":
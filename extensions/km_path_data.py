@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+
+# km_path_data.py
+#
+# Compact writer for SVG path data, shared by the KM-Laser extensions.
+#
+# Path data built up by repeated string concatenation, with every
+# coordinate printed to six decimal places and every command letter
+# spelled out, easily makes for documents of hundreds of megabytes when
+# there are many short strokes (as with hatch fills).  PathDataWriter
+# instead
+#
+#   - writes every coordinate relative to the current point, rounded to a
+#     chosen number of decimal places and without trailing zeros,
+#   - leaves out a command letter whenever it repeats the previous one
+#     (and the "l" of a line drawn straight after a move),
+#   - drops moves which are followed by another move, and lines which
+#     come to nothing once rounded,
+#   - collects the pieces in a list, which is only joined once.
+#
+# The caller always passes exact coordinates.  The writer keeps track of
+# the current point both as given and as a reader will reconstruct it from
+# the rounded numbers written, and each relative coordinate is taken
+# between the two: rounding errors therefore never add up along a path.
+
+class PathDataWriter(object):
+
+    """
+    Accumulate the commands of an SVG path and write them out as compact,
+    relative path data.  Absolute (moveTo, lineTo, curveTo) and relative
+    (moveBy, lineBy, curveBy) forms of the commands may be mixed freely.
+    str() of the writer gives the path data.
+    """
+
+    def __init__(self, precision=3):
+        self.precision = precision
+        self.tokens = []
+        self.command = None  # Last command letter written
+        self.x, self.y = (0.0, 0.0)  # Current point, exactly
+        self.xOut, self.yOut = (0.0, 0.0)  # Current point, as written
+        self.xStart, self.yStart = (0.0, 0.0)  # Start of the current subpath, exactly
+        self.xStartOut, self.yStartOut = (0.0, 0.0)  # Start of the current subpath, as written
+        self.bMovePending = False
+
+    def __str__(self):
+        return ' '.join(self.tokens)
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def number(self, value):
+        # Fixed point, less any trailing zeros
+        text = '{0:.{1}f}'.format(value, self.precision)
+        if '.' in text:
+            text = text.rstrip('0').rstrip('.')
+        if text == '-0':
+            text = '0'
+        return text
+
+    def relative(self, x, y):
+        # The rounded offset of (x, y) from the current point as written
+        dx = round(x - self.xOut, self.precision)
+        dy = round(y - self.yOut, self.precision)
+        return dx, dy
+
+    def write(self, letter, coordinates):
+        # Leave the letter out when it repeats the last one; a line
+        # straight after a move is implied by the move
+        if letter != self.command and not (letter == 'l' and self.command == 'm'):
+            self.tokens.append(letter)
+        for i in range(0, len(coordinates), 2):
+            self.tokens.append(self.number(coordinates[i]) + ',' + self.number(coordinates[i + 1]))
+        self.command = letter
+
+    def flushMove(self):
+        if self.bMovePending:
+            dx, dy = self.relative(self.x, self.y)
+            self.write('m', (dx, dy))
+            self.xOut += dx
+            self.yOut += dy
+            self.xStartOut, self.yStartOut = (self.xOut, self.yOut)
+            self.bMovePending = False
+
+    def moveTo(self, x, y):
+        # Only written once something is drawn from it, so a run of moves
+        # comes down to the last of them
+        self.x, self.y = (x, y)
+        self.xStart, self.yStart = (x, y)
+        self.bMovePending = True
+
+    def moveBy(self, dx, dy):
+        self.moveTo(self.x + dx, self.y + dy)
+
+    def lineTo(self, x, y):
+        b_first_after_move = self.bMovePending
+        self.flushMove()
+        self.x, self.y = (x, y)
+        dx, dy = self.relative(x, y)
+        if dx == 0 and dy == 0 and not b_first_after_move:
+            return  # Nothing to see once rounded
+        self.write('l', (dx, dy))
+        self.xOut += dx
+        self.yOut += dy
+
+    def lineBy(self, dx, dy):
+        self.lineTo(self.x + dx, self.y + dy)
+
+    def curveTo(self, x1, y1, x2, y2, x, y):
+        self.flushMove()
+        dx1, dy1 = self.relative(x1, y1)
+        dx2, dy2 = self.relative(x2, y2)
+        dx, dy = self.relative(x, y)
+        self.write('c', (dx1, dy1, dx2, dy2, dx, dy))
+        self.x, self.y = (x, y)
+        self.xOut += dx
+        self.yOut += dy
+
+    def curveBy(self, dx1, dy1, dx2, dy2, dx, dy):
+        self.curveTo(self.x + dx1, self.y + dy1, self.x + dx2, self.y + dy2, self.x + dx, self.y + dy)
+
+    def close(self):
+        if self.bMovePending:
+            return  # Nothing drawn to close
+        self.tokens.append('z')
+        self.command = 'z'
+        # Closing returns the current point to the start of the subpath
+        self.x, self.y = (self.xStart, self.yStart)
+        self.xOut, self.yOut = (self.xStartOut, self.yStartOut)
@@ -0,0 +1,95 @@
+import io
+import os
+import sys
+
+import pytest
+
+inkex = pytest.importorskip("inkex")
+
+EXTENSIONS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'extensions')
+sys.path.insert(0, EXTENSIONS)
+
+SVG = '''<svg xmlns="http://www.w3.org/2000/svg" width="100mm" height="100mm" viewBox="0 0 100 100">
+{0}
+</svg>'''
+
+
+@pytest.fixture
+def run_hatch_fill(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    import km_hatch_fill
+
+    def run(body, *args):
+        svg_path = tmp_path / 'input.svg'
+        svg_path.write_text(SVG.format(body))
+        effect = km_hatch_fill.Hatch_Fill()
+        effect.run(list(args) + ['--holdBackHatchFromEdges=false', str(svg_path)], output=io.BytesIO())
+        return effect
+    return run
+
+
+def hatched_ids(effect):
+    # Each hatched element is moved into a new group beside its hatch path
+    return sorted(node.get('id') for node in effect.svg.iter()
+                  if node.get('id', '').startswith('shape') and len(node.getparent()) == 2 and
+                  node.getparent()[1].tag == inkex.addNS('path', 'svg'))
+
+
+def square(n, attributes=''):
+    x = 10 + 20 * n
+    return '<rect id="shape{0}" x="{1}" y="10" width="10" height="10" {2}/>'.format(n, x, attributes)
+
+
+def test_hidden_shapes_are_not_hatched(run_hatch_fill):
+    body = (square(0) + square(1, 'style="visibility:hidden"') + square(2, 'display="none"') +
+            '<g visibility="hidden">' + square(3) + square(4, 'visibility="visible"') + '</g>')
+    effect = run_hatch_fill(body)
+
+    assert hatched_ids(effect) == ['shape0', 'shape4']
+
+
+def test_shapes_hidden_by_css_are_not_hatched(run_hatch_fill):
+    body = ('<style>.gone { display: none; } .ghost { visibility: collapse; }</style>' +
+            square(0) + square(1, 'class="gone"') + square(2, 'class="ghost"'))
+    effect = run_hatch_fill(body)
+
+    assert hatched_ids(effect) == ['shape0']
+
+
+def test_culling_leaves_visible_shapes_unchanged(run_hatch_fill):
+    body = ('<g transform="translate(3.3333333,1.7777777) rotate(13.333333)">' +
+            square(0, 'transform="matrix(0.9333333,0.1111111,-0.1111111,0.9333333,1.2345678,2.3456789)"') +
+            '</g>')
+    culled = run_hatch_fill(body, '--cullHidden=true')
+    kept = run_hatch_fill(body, '--cullHidden=false')
+
+    assert culled.svg.tostring() == kept.svg.tostring()
+
+
+def stacking_order(effect):
+    # The hatched shapes, in the order their groups are painted
+    return [node.get('id') for node in effect.svg.iter() if node.get('id', '').startswith('shape')]
+
+
+def rect(n, x, y, size=10):
+    return '<rect id="shape{0}" x="{1}" y="{2}" width="{3}" height="{3}"/>'.format(n, x, y, size)
+
+
+def test_travel_ordering_visits_separate_objects_nearest_first(run_hatch_fill):
+    body = rect(0, 80, 10) + rect(1, 0, 10) + rect(2, 40, 10)
+    effect = run_hatch_fill(body, '--optimizeTravel=true')
+
+    assert stacking_order(effect) == ['shape1', 'shape2', 'shape0']
+
+
+def test_travel_ordering_keeps_overlapping_objects_in_stacking_order(run_hatch_fill):
+    # shape1 is the nearer to shape2, but is painted over shape0
+    body = rect(0, 80, 10) + rect(1, 70, 10) + rect(2, 0, 10)
+    effect = run_hatch_fill(body, '--optimizeTravel=true')
+
+    assert stacking_order(effect) == ['shape2', 'shape0', 'shape1']
+
+    body = rect(0, 80, 10) + rect(1, 60, 10) + rect(2, 0, 10)
+    effect = run_hatch_fill(body, '--optimizeTravel=true')
+
+    assert stacking_order(effect) == ['shape2', 'shape1', 'shape0']
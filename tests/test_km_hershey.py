@@ -0,0 +1,125 @@
+import io
+import os
+import sys
+
+import pytest
+
+inkex = pytest.importorskip("inkex")
+
+EXTENSIONS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'extensions')
+KERN_FONT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fonts', 'KernTest.svg')
+sys.path.insert(0, EXTENSIONS)
+
+# A document in millimetres: one user unit is one millimetre
+SVG = '''<svg xmlns="http://www.w3.org/2000/svg" width="200mm" height="100mm" viewBox="0 0 200 100">
+{0}
+</svg>'''
+
+
+@pytest.fixture
+def run_hershey(tmp_path, monkeypatch):
+    # The fonts are found relative to the working directory, as in Inkscape
+    monkeypatch.chdir(EXTENSIONS)
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'cache'))
+    import km_hershey
+
+    def run(body, *args):
+        svg_path = tmp_path / 'input.svg'
+        svg_path.write_text(SVG.format(body))
+        effect = km_hershey.Hershey()
+        effect.run(list(args) + [str(svg_path)], output=io.BytesIO())
+        return effect
+    return run
+
+
+def line_groups(effect):
+    # The groups holding the glyphs of each line of text
+    return [group for group in effect.svg.iter('{http://www.w3.org/2000/svg}g')
+            if any(child.tag == '{http://www.w3.org/2000/svg}path' for child in group)]
+
+
+@pytest.mark.parametrize('anchor, fraction', [('start', 0.0), ('middle', 0.5), ('end', 1.0)])
+def test_anchored_line_is_aligned_from_its_measured_width(run_hershey, anchor, fraction):
+    text = '<text x="100" y="50" style="font-size:10px;font-family:EMSAllure;text-anchor:{0}">AVAWay</text>'
+    effect = run_hershey(text.format(anchor))
+
+    groups = line_groups(effect)
+    assert len(groups) == 1
+    width = effect.text_width('EMSAllure', 'AVAWay', 10)
+    assert width > 0
+    x_shift = groups[0].transform.matrix[0][2]
+    assert x_shift == pytest.approx(100 - fraction * width)
+
+
+def drawn_boxes(effect):
+    # Bounding boxes, in document coordinates, of the paths drawn
+    return [path.path.transform(path.composed_transform()).bounding_box()
+            for path in effect.svg.iter('{http://www.w3.org/2000/svg}path')]
+
+
+def test_batch_draws_one_path_per_row_spaced_in_document_units(run_hershey, tmp_path):
+    csv_path = tmp_path / 'names.csv'
+    csv_path.write_text('name\nAda\nAda\nAda\nAda\n')
+    style = 'font-size:5px;font-family:EMSAllure'
+    text = '<text id="template" x="20" y="20" style="{0}">{{name}}</text>'.format(style)
+    effect = run_hershey(text, '--tab=batch', '--id=template', '--csvfile=' + str(csv_path),
+                         '--gridcolumns=2', '--gridspacingx=60mm', '--gridspacingy=15mm')
+    expected = run_hershey('<text x="20" y="20" style="{0}">Ada</text>'.format(style), '--mergelines=true')
+
+    # One path for each row, straight in the batch group
+    paths = list(effect.svg.iter('{http://www.w3.org/2000/svg}path'))
+    assert len(paths) == 4
+    assert all(path.getparent().label == 'Hershey Text' and path.get('transform') is None
+               for path in paths)
+
+    [box] = drawn_boxes(expected)
+    offsets = [(0, 0), (60, 0), (0, 15), (60, 15)]
+    for row_box, (dx, dy) in zip(drawn_boxes(effect), offsets):
+        assert (row_box.left, row_box.top, row_box.right, row_box.bottom) == pytest.approx(
+            (box.left + dx, box.top + dy, box.right + dx, box.bottom + dy), abs=1e-3)
+
+
+def test_batch_template_style_and_position_are_inherited(run_hershey, tmp_path):
+    csv_path = tmp_path / 'names.csv'
+    csv_path.write_text('name\nAda\n')
+    text = ('<style>.names { font-family: EMSAllure; }</style>'
+            '<g class="names" style="text-anchor:end">'
+            '<text id="template" style="font-size:5px"><tspan x="100" y="30">{name}</tspan></text>'
+            '</g>')
+    effect = run_hershey(text, '--tab=batch', '--id=template', '--csvfile=' + str(csv_path))
+    expected = run_hershey('<text x="100" y="30" style="font-size:5px;font-family:EMSAllure;'
+                           'text-anchor:end">Ada</text>', '--mergelines=true')
+
+    [row_box] = drawn_boxes(effect)
+    [box] = drawn_boxes(expected)
+    assert (row_box.left, row_box.top, row_box.right, row_box.bottom) == pytest.approx(
+        (box.left, box.top, box.right, box.bottom), abs=1e-3)
+
+
+def test_kerning_pairs_are_read_first_match_first(run_hershey):
+    effect = run_hershey('', '--otherfont=' + KERN_FONT)
+    effect.load_font('KernTest')
+
+    assert effect.font_dict['KernTest']['kerning'] == {
+        ('A', 'V'): 80.0, ('A', 'y'): 30.0, ('V', 'y'): 30.0, ('W', 'y'): 30.0,
+        ('W', 'a'): 50.0, ('V', 'A'): 40.0}
+
+
+def test_kerned_width(run_hershey):
+    effect = run_hershey('', '--otherfont=' + KERN_FONT)
+
+    # Advances of 600 + 600 + 600 + 500, less kerning of 80 + 40 + 30
+    assert effect.text_width('KernTest', 'AVAy', 10) == pytest.approx(21.5)
+    assert effect.text_width('KernTest', 'Wa', 10) == pytest.approx(11.5)
+
+
+def test_end_anchored_kerned_line_finishes_at_its_x(run_hershey):
+    text = '<text x="100" y="50" style="font-size:10px;font-family:KernTest;text-anchor:end">AVAy</text>'
+    effect = run_hershey(text, '--otherfont=' + KERN_FONT)
+
+    groups = line_groups(effect)
+    assert len(groups) == 1
+    glyph_offsets = [path.transform.matrix[0][2] for path in groups[0]]
+    assert glyph_offsets == pytest.approx([0.0, 5.2, 10.8, 16.5])
+    # The last glyph, y, advances by 5
+    assert groups[0].transform.matrix[0][2] + glyph_offsets[-1] + 5.0 == pytest.approx(100)